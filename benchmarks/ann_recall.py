@@ -0,0 +1,53 @@
+"""Recall@k vs. latency of the VectorDBTool ANN index types against an exact scan.
+
+Uses clustered synthetic vectors so it runs without downloading a model:
+
+    python benchmarks/ann_recall.py --vectors 200000 --dim 384 --k 5
+"""
+import argparse
+import os
+import sys
+import time
+import faiss
+import numpy as np
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from omnirag.vectordb_tool import create_index, recall_report
+def synthetic_vectors(n, dim, n_clusters=256, seed=0):
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(size=(n_clusters, dim)).astype('float32')
+    labels = rng.integers(0, n_clusters, size=n)
+    vectors = centers[labels] + 0.3 * rng.normal(size=(n, dim)).astype('float32')
+    return vectors.astype('float32')
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--vectors", type=int, default=100000)
+    parser.add_argument("--dim", type=int, default=384)
+    parser.add_argument("--queries", type=int, default=500)
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--types", default="ivf_flat,hnsw,ivf_pq")
+    args = parser.parse_args()
+    vectors = synthetic_vectors(args.vectors + args.queries, args.dim)
+    data, queries = vectors[:args.vectors], vectors[args.vectors:]
+    exact = faiss.IndexFlatL2(args.dim)
+    exact.add(data)
+    start = time.perf_counter()
+    exact.search(queries, args.k)
+    exact_ms = 1000.0 * (time.perf_counter() - start) / len(queries)
+    print(f"{args.vectors} vectors, dim={args.dim}, {len(queries)} queries, k={args.k}")
+    print(f"{'index':<10} {'setting':<14} {'recall@k':>9} {'ms/query':>9} {'speedup':>8} {'build s':>8}")
+    print(f"{'flat':<10} {'exact':<14} {1.0:>9.3f} {exact_ms:>9.3f} {1.0:>8.1f} {0.0:>8.1f}")
+    for index_type in args.types.split(","):
+        start = time.perf_counter()
+        index = create_index(index_type, args.dim, len(data))
+        if not index.is_trained:
+            index.train(data[:min(len(data), 100000)])
+        index.add(data)
+        build_s = time.perf_counter() - start
+        for row in recall_report(index, exact, queries, args.k):
+            setting = ", ".join(f"{key}={row[key]}" for key in ('nprobe', 'ef_search') if key in row)
+            print(
+                f"{index_type:<10} {setting:<14} {row['recall_at_k']:>9.3f} "
+                f"{row['latency_ms']:>9.3f} {exact_ms / max(row['latency_ms'], 1e-9):>8.1f} {build_s:>8.1f}"
+            )
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,26 @@
+"""Calibrate the LiquidAnalyzer keyword -> LLM cascade threshold on labelled queries.
+
+The input is JSON Lines ({"query": ..., "level": "beginner|intermediate|expert"})
+or a CSV with query,level columns:
+
+    python benchmarks/calibrate_liquid.py labelled_queries.jsonl --model Qwen/Qwen2.5-0.5B-Instruct
+"""
+import argparse
+import os
+import sys
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from omnirag.liquid_analyzer import LiquidAnalyzer
+from omnirag.llm_client import LLMClient
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("labelled_path")
+    parser.add_argument("--model", default="Qwen/Qwen2.5-0.5B-Instruct")
+    parser.add_argument("--thresholds", default="0,0.1,0.2,0.3,0.4,0.5,0.6,0.7,0.8,0.9,1.0")
+    args = parser.parse_args()
+    analyzer = LiquidAnalyzer(LLMClient(model_name=args.model))
+    analyzer.calibrate(
+        args.labelled_path,
+        thresholds=[float(value) for value in args.thresholds.split(",")]
+    )
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,128 @@
+"""Tokens/s and memory of LLMClient's CPU modes against the float32 path.
+
+Each mode runs in a fresh process, so load time and peak RSS are not shared:
+
+    python benchmarks/cpu_inference.py --model Qwen/Qwen2.5-0.5B-Instruct \
+        --modes float32,int8,bf16 --threads 8 --max-tokens 128 --runs 5
+
+Greedy decoding is used throughout, and each mode's answers are compared
+with float32's to show how often quantization changes the output.
+"""
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import time
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+PROMPTS = (
+    "Explain how a vector database finds the nearest neighbours of a query.",
+    "Summarize the difference between retrieval-augmented generation and fine-tuning.",
+    "Describe three ways to make transformer inference faster on a CPU.",
+    "What is the purpose of a tokenizer in a language model?",
+)
+def rss_mb():
+    with open("/proc/self/statm") as f:
+        return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024)
+def peak_rss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+def run_mode(args, mode):
+    """Load the model in one mode and time greedy generation; runs in a worker process"""
+    import torch
+    import transformers
+    from omnirag.llm_client import LLMClient
+    # Measured after the imports, so model_rss_mb is the weights and buffers.
+    baseline = rss_mb()
+    llm = LLMClient(
+        model_name=args.model,
+        prefix_cache_size=0,
+        shared=False,
+        cpu_mode=None if mode == "float32" else mode,
+        num_threads=args.threads,
+        compile_model=args.compile,
+        quantized_cache_dir=args.cache_dir
+    )
+    start = time.perf_counter()
+    llm.load()
+    load_seconds = time.perf_counter() - start
+    loaded_mb = rss_mb() - baseline
+    # The first call pays for lazy initialisation (and compilation with --compile).
+    start = time.perf_counter()
+    llm.generate(PROMPTS[0], max_tokens=8, temperature=0)
+    first_call_seconds = time.perf_counter() - start
+    answers = []
+    tokens = 0
+    start = time.perf_counter()
+    for i in range(args.runs):
+        prompt = PROMPTS[i % len(PROMPTS)]
+        answer = llm.generate(prompt, max_tokens=args.max_tokens, temperature=0)
+        tokens += llm.last_usage[0]['completion_tokens']
+        if i < len(PROMPTS):
+            answers.append(answer)
+    seconds = time.perf_counter() - start
+    return {
+        'mode': mode,
+        'applied_mode': llm.effective_cpu_mode or "float32",
+        'load_seconds': load_seconds,
+        'first_call_seconds': first_call_seconds,
+        'tokens': tokens,
+        'seconds': seconds,
+        'tokens_per_second': tokens / seconds if seconds else 0.0,
+        'model_rss_mb': loaded_mb,
+        'peak_rss_mb': peak_rss_mb(),
+        'answers': answers
+    }
+def spawn(args, mode):
+    command = [sys.executable, os.path.abspath(__file__), "--worker", mode] + args.passthrough
+    result = subprocess.run(command, capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(f"{mode} run failed:\n{result.stderr[-2000:]}")
+    return json.loads(result.stdout.strip().splitlines()[-1])
+def print_report(rows):
+    reference = next((row for row in rows if row['mode'] == "float32"), None)
+    print(
+        f"\n{'mode':<8} {'applied':<8} {'load s':>7} {'1st call s':>10} {'tok/s':>8} "
+        f"{'speedup':>8} {'model MB':>9} {'peak MB':>8} {'same as fp32':>13}"
+    )
+    for row in rows:
+        speedup = same = "-"
+        if reference and reference['tokens_per_second']:
+            speedup = f"{row['tokens_per_second'] / reference['tokens_per_second']:.2f}x"
+        if reference and row['answers']:
+            matches = sum(a == b for a, b in zip(row['answers'], reference['answers']))
+            same = f"{matches / len(row['answers']):.0%}"
+        print(
+            f"{row['mode']:<8} {row['applied_mode']:<8} {row['load_seconds']:>7.2f} {row['first_call_seconds']:>10.2f} "
+            f"{row['tokens_per_second']:>8.1f} {speedup:>8} {row['model_rss_mb']:>9.1f} "
+            f"{row['peak_rss_mb']:>8.1f} {same:>13}"
+        )
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--model", default="Qwen/Qwen2.5-0.5B-Instruct")
+    parser.add_argument("--modes", default="float32,int8,bf16")
+    parser.add_argument("--threads", type=int, default=None, help="torch intra-op threads")
+    parser.add_argument("--max-tokens", type=int, default=128)
+    parser.add_argument("--runs", type=int, default=4)
+    parser.add_argument("--compile", action="store_true", help="wrap the forward pass in torch.compile")
+    parser.add_argument("--cache-dir", default=None, help="reuse int8 weights from this directory")
+    parser.add_argument("--json", help="also write the results to this path")
+    parser.add_argument("--worker", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.worker:
+        import contextlib
+        with contextlib.redirect_stdout(sys.stderr):
+            row = run_mode(args, args.worker)
+        print(json.dumps(row))
+        return
+    args.passthrough = sys.argv[1:]
+    rows = []
+    for mode in args.modes.split(","):
+        print(f"Running {mode}...", flush=True)
+        rows.append(spawn(args, mode))
+    print_report(rows)
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(rows, f, indent=2)
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+"""Query latency, identifier hit rate and memory of dense, lexical and hybrid retrieval.
+
+Runs offline on a synthetic corpus in which every tenth chunk carries a unique
+identifier (an error code), with the stub embedder standing in for the model:
+
+    python benchmarks/hybrid_retrieval.py --chunks 200000 --queries 300 --embed-ms 8
+
+--embed-ms is the simulated cost of embedding one query with a transformer,
+which the lexical path never pays. Memory is reported per million chunks,
+scaled linearly from the measured corpus.
+"""
+import argparse
+import contextlib
+import io
+import os
+import random
+import sys
+import time
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from omnirag.lexical_index import LexicalIndex
+from omnirag.vectordb_tool import VectorDBTool
+from benchmarks.pipeline import synthetic_corpus, percentiles
+from benchmarks.stubs import StubEmbedder
+MODES = ("dense", "lexical", "hybrid")
+def rss_mb():
+    with open("/proc/self/statm") as f:
+        return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024)
+def identifier(doc_id):
+    return f"ERR-{doc_id:07d}"
+def corpus_with_identifiers(n_chunks, words_per_chunk, seed=0):
+    docs, vocab = synthetic_corpus(n_chunks, words_per_chunk, seed=seed)
+    for doc_id in range(0, n_chunks, 10):
+        docs[doc_id] += f" Raised as {identifier(doc_id)} when the check fails."
+    return docs, vocab
+def make_queries(n_chunks, vocab, n_queries, seed=0):
+    """Half identifier lookups with a known answer, half topical questions"""
+    rng = random.Random(seed)
+    queries = []
+    for i in range(n_queries):
+        if i % 2 == 0:
+            doc_id = rng.randrange(0, n_chunks, 10)
+            queries.append((f"What does {identifier(doc_id)} mean?", doc_id))
+        else:
+            topic = rng.choice(vocab)
+            queries.append((f"How is {rng.choice(topic)} used with {rng.choice(topic)}?", None))
+    return queries
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--chunks", type=int, default=100000)
+    parser.add_argument("--words-per-chunk", type=int, default=120)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--top-k", type=int, default=3)
+    parser.add_argument("--dim", type=int, default=384)
+    parser.add_argument("--embed-ms", type=float, default=8.0, help="simulated transformer cost per query embedding")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    docs, vocab = corpus_with_identifiers(args.chunks, args.words_per_chunk, args.seed)
+    queries = make_queries(args.chunks, vocab, args.queries, args.seed)
+    # The lexical index is built on its own first, so its build time and
+    # memory are not mixed up with the embedding of the corpus.
+    before = rss_mb()
+    start = time.perf_counter()
+    lexical = LexicalIndex()
+    for i in range(0, len(docs), 10000):
+        lexical.add(docs[i:i + 10000])
+    lexical.compact()
+    lexical_seconds = time.perf_counter() - start
+    lexical_rss = rss_mb() - before
+    stats = lexical.stats()
+    embedder = StubEmbedder(dim=args.dim)
+    with contextlib.redirect_stdout(io.StringIO()):
+        db = VectorDBTool(embedding_model="stub-embedder", embedder=embedder, lexical_index=False)
+        for i in range(0, len(docs), 10000):
+            db.add_documents(docs[i:i + 10000])
+    db.lexical = lexical
+    # Only queries pay the simulated model cost, not the corpus embedding above.
+    embedder.encode_ms_per_text = args.embed_ms
+    scale = 1e6 / args.chunks
+    print(f"{args.chunks} chunks, {args.words_per_chunk} words each, {len(queries)} queries, top_k={args.top_k}")
+    print(
+        f"\nLexical index: built in {lexical_seconds:.1f}s ({args.chunks / lexical_seconds:.0f} chunks/s), "
+        f"{stats['terms']} terms, {stats['postings']} postings"
+    )
+    print(
+        f"  arrays {stats['bytes'] / 2**20:.1f} MB ({stats['bytes'] / args.chunks:.1f} B/chunk), "
+        f"RSS +{lexical_rss:.1f} MB while building"
+    )
+    print(
+        f"  per million chunks: {stats['bytes'] * scale / 2**20:.0f} MB lexical vs "
+        f"{4 * args.dim * 1e6 / 2**20:.0f} MB of float32 vectors in a flat FAISS index"
+    )
+    print(f"\n{'mode':<8} {'p50 ms':>8} {'p99 ms':>8} {'mean ms':>8} {'id hit@k':>9}")
+    for mode in MODES:
+        latencies = []
+        found = 0
+        lookups = 0
+        for text, doc_id in queries:
+            start = time.perf_counter()
+            hits = db.search_hits(text, top_k=args.top_k, mode=mode)
+            latencies.append(time.perf_counter() - start)
+            if doc_id is not None:
+                lookups += 1
+                found += any(hit['id'] == doc_id for hit in hits)
+        row = percentiles(latencies)
+        print(
+            f"{mode:<8} {row['p50_ms']:>8.2f} {row['p99_ms']:>8.2f} {row['mean_ms']:>8.2f} "
+            f"{found / max(lookups, 1):>9.0%}"
+        )
+if __name__ == "__main__":
+    main()
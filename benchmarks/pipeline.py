@@ -0,0 +1,234 @@
+"""End-to-end OmniRAG pipeline benchmark on stub LLM, embedder and web search backends.
+
+Runs offline and deterministically, so numbers from two commits are comparable:
+
+    python benchmarks/pipeline.py --docs 5000 --queries 60 --mix simple=0.5,complex=0.3,web=0.2 \
+        --decode-ms 2 --prefill-ms 0.05 --concurrency 8 --json before.json
+
+Reports ingestion throughput, per-stage latency, LLM calls and tokens per prompt
+kind, p50/p99 query latency sequentially and under concurrent load, and peak RSS.
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import random
+import resource
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from omnirag import OmniRAG
+from benchmarks.stubs import StubEmbedder, StubLLM, StubWebSearch
+QUERY_KINDS = ("simple", "complex", "web")
+def synthetic_corpus(n_docs, words_per_doc=120, n_topics=50, seed=0):
+    """Documents drawn from per-topic vocabularies, so retrieval has real structure"""
+    rng = random.Random(seed)
+    vocab = [[f"t{topic}term{j}" for j in range(40)] for topic in range(n_topics)]
+    common = ["the", "a", "of", "system", "data", "model", "method", "uses", "with", "for"]
+    docs = []
+    for i in range(n_docs):
+        topic = vocab[i % n_topics]
+        words = [rng.choice(topic) if rng.random() < 0.5 else rng.choice(common) for _ in range(words_per_doc)]
+        docs.append(f"Document {i}: " + " ".join(words))
+    return docs, vocab
+def synthetic_queries(vocab, n_queries, mix, seed=0):
+    """Distinct queries (so caches never hit) of each kind in the given proportions"""
+    rng = random.Random(seed)
+    kinds = rng.choices(list(mix), weights=list(mix.values()), k=n_queries)
+    queries = []
+    for i, kind in enumerate(kinds):
+        a, b, c = (rng.choice(rng.choice(vocab)) for _ in range(3))
+        if kind == "simple":
+            text = f"What is {a}? ({i})"
+        elif kind == "complex":
+            text = f"Compare {a} and {b}, and also explain how {c} works step by step ({i})"
+        else:
+            text = f"What is the latest news about {a}? ({i})"
+        queries.append((kind, text))
+    return queries
+def parse_mix(value):
+    mix = {}
+    for part in value.split(","):
+        kind, weight = part.split("=")
+        if kind not in QUERY_KINDS:
+            raise ValueError(f"Unknown query kind: {kind} (expected one of {', '.join(QUERY_KINDS)})")
+        mix[kind] = float(weight)
+    return mix
+def peak_rss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+def percentiles(latencies):
+    if not latencies:
+        return {'p50_ms': 0.0, 'p99_ms': 0.0, 'mean_ms': 0.0}
+    ms = 1000.0 * np.asarray(latencies)
+    return {
+        'p50_ms': float(np.percentile(ms, 50)),
+        'p99_ms': float(np.percentile(ms, 99)),
+        'mean_ms': float(ms.mean())
+    }
+class StageTimer:
+    """Wraps pipeline methods to accumulate wall time and call counts per stage"""
+    def __init__(self):
+        self.stats = {}
+        self._lock = threading.Lock()
+    def wrap(self, stage, owner, name):
+        method = getattr(owner, name)
+        def timed(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return method(*args, **kwargs)
+            finally:
+                elapsed = time.perf_counter() - start
+                with self._lock:
+                    counters = self.stats.setdefault(stage, {'calls': 0, 'seconds': 0.0})
+                    counters['calls'] += 1
+                    counters['seconds'] += elapsed
+        setattr(owner, name, timed)
+def instrument(rag, timer):
+    timer.wrap('liquid', rag.liquid_analyzer, 'analyze')
+    timer.wrap('decompose', rag.chain_decomposer, 'decompose')
+    timer.wrap('retrieve', rag, '_retrieve')
+    timer.wrap('transform', rag, '_transform_hits')
+    timer.wrap('polish', rag.content_transformer, 'polish')
+    timer.wrap('polish', rag.content_transformer, 'polish_stream')
+def run_queries(rag, queries, concurrency):
+    latencies = {kind: [] for kind in QUERY_KINDS}
+    def one(item):
+        kind, text = item
+        start = time.perf_counter()
+        rag.query(text)
+        return kind, time.perf_counter() - start
+    start = time.perf_counter()
+    if concurrency > 1:
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            results = list(pool.map(one, queries))
+    else:
+        results = [one(item) for item in queries]
+    wall = time.perf_counter() - start
+    for kind, elapsed in results:
+        latencies[kind].append(elapsed)
+    everything = [elapsed for _, elapsed in results]
+    return {
+        'queries': len(queries),
+        'concurrency': concurrency,
+        'seconds': wall,
+        'queries_per_second': len(queries) / wall if wall else 0.0,
+        **percentiles(everything),
+        'by_kind': {kind: percentiles(values) for kind, values in latencies.items() if values}
+    }
+def print_report(report):
+    ingest = report['ingestion']
+    print(f"\nIngestion: {ingest['docs']} docs in {ingest['seconds']:.2f}s ({ingest['docs_per_second']:.0f} docs/s)")
+    for phase in ('sequential', 'concurrent'):
+        run = report[phase]
+        print(
+            f"\n{phase.capitalize()} ({run['queries']} queries, concurrency {run['concurrency']}): "
+            f"{run['queries_per_second']:.2f} q/s, p50 {run['p50_ms']:.1f} ms, p99 {run['p99_ms']:.1f} ms"
+        )
+        for kind, row in run['by_kind'].items():
+            print(f"  {kind:<8} p50 {row['p50_ms']:>9.1f} ms   p99 {row['p99_ms']:>9.1f} ms")
+    print(f"\n{'stage':<12} {'calls':>7} {'total s':>9} {'ms/call':>9}")
+    for stage, row in report['stages'].items():
+        print(f"{stage:<12} {row['calls']:>7} {row['seconds']:>9.2f} {1000.0 * row['seconds'] / row['calls']:>9.2f}")
+    print(f"\n{'LLM prompts':<12} {'count':>7} {'prompt tok':>11} {'output tok':>11} {'model s':>9}")
+    for stage, row in report['llm'].items():
+        print(
+            f"{stage:<12} {row['prompts']:>7} {row['prompt_tokens']:>11} "
+            f"{row['completion_tokens']:>11} {row['seconds']:>9.2f}"
+        )
+    generation = report['generation']
+    print(
+        f"\nGeneration batches: {generation['batches_run']} for {generation['prompts_run']} prompts "
+        f"(avg {generation['avg_batch_size']:.2f})   Web searches: {report['web_calls']}"
+    )
+    print(f"Peak RSS: {report['peak_rss_mb']:.1f} MB")
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--docs", type=int, default=2000)
+    parser.add_argument("--words-per-doc", type=int, default=120)
+    parser.add_argument("--queries", type=int, default=40)
+    parser.add_argument("--mix", default="simple=0.5,complex=0.3,web=0.2")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--max-concurrency", type=int, default=1, help="OmniRAG sub-query concurrency")
+    parser.add_argument("--prefill-ms", type=float, default=0.05, help="stub LLM ms per prompt token")
+    parser.add_argument("--decode-ms", type=float, default=2.0, help="stub LLM ms per generated token")
+    parser.add_argument("--response-tokens", type=int, default=48)
+    parser.add_argument("--embed-ms", type=float, default=0.0, help="stub embedder ms per text")
+    parser.add_argument("--web-ms", type=float, default=150.0)
+    parser.add_argument("--dim", type=int, default=384)
+    parser.add_argument("--index-type", default="flat")
+    parser.add_argument("--no-prefix-reuse", action="store_true")
+    parser.add_argument("--profile", default="quality", help="fast, balanced or quality")
+    parser.add_argument("--deadline-ms", type=float, default=None, help="per-query latency budget")
+    parser.add_argument("--answer-mode", default="staged", help="staged or fused")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", help="also write the report to this path")
+    parser.add_argument("--verbose", action="store_true", help="show the pipeline's own output")
+    args = parser.parse_args()
+    llm = StubLLM(
+        prefill_ms_per_token=args.prefill_ms,
+        decode_ms_per_token=args.decode_ms,
+        response_tokens=args.response_tokens,
+        prefix_reuse=not args.no_prefix_reuse
+    )
+    web = StubWebSearch(latency_ms=args.web_ms)
+    docs, vocab = synthetic_corpus(args.docs, args.words_per_doc, seed=args.seed)
+    mix = parse_mix(args.mix)
+    sequential_queries = synthetic_queries(vocab, args.queries, mix, seed=args.seed)
+    concurrent_queries = synthetic_queries(vocab, args.queries, mix, seed=args.seed + 1)
+    output = contextlib.nullcontext() if args.verbose else contextlib.redirect_stdout(io.StringIO())
+    timer = StageTimer()
+    with output:
+        rag = OmniRAG(
+            embedding_model="stub-embedder",
+            index_type=args.index_type,
+            max_concurrency=args.max_concurrency,
+            max_concurrent_queries=args.concurrency,
+            # Measure the pipeline itself, not cache hits.
+            cache_max_entries=0,
+            semantic_cache_threshold=None,
+            stage_cache_max_entries=0,
+            llm=llm,
+            embedder=StubEmbedder(dim=args.dim, encode_ms_per_text=args.embed_ms),
+            profile=args.profile,
+            deadline_ms=args.deadline_ms,
+            answer_mode=args.answer_mode
+        )
+        rag.web_search = web
+        instrument(rag, timer)
+        start = time.perf_counter()
+        rag.add_documents(docs)
+        ingest_seconds = time.perf_counter() - start
+        sequential = run_queries(rag, sequential_queries, 1)
+        stages = {stage: dict(counters) for stage, counters in timer.stats.items()}
+        llm_stats = llm.stats()
+        generation = rag.generator.stats()
+        web_calls = web.calls
+        concurrent = run_queries(rag, concurrent_queries, args.concurrency)
+        rag.close()
+    report = {
+        'config': vars(args),
+        'ingestion': {
+            'docs': len(docs),
+            'seconds': ingest_seconds,
+            'docs_per_second': len(docs) / ingest_seconds if ingest_seconds else 0.0
+        },
+        'sequential': sequential,
+        'concurrent': concurrent,
+        # Stage, LLM and batching breakdowns cover the sequential run only,
+        # where a stage's wall time is not inflated by waiting on other queries.
+        'stages': stages,
+        'llm': llm_stats,
+        'generation': generation,
+        'web_calls': web_calls,
+        'peak_rss_mb': peak_rss_mb()
+    }
+    print_report(report)
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+if __name__ == "__main__":
+    main()
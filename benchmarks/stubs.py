@@ -0,0 +1,174 @@
+"""Deterministic local stand-ins for the LLM, the embedder and web search.
+
+They let the benchmarks drive the full OmniRAG pipeline without downloading a
+model: latency is simulated per token, and every response is derived from a
+hash of the prompt, so the same run produces the same work every time.
+"""
+import hashlib
+import re
+import threading
+import time
+import numpy as np
+from omnirag.chain_decomposer import ChainDecomposer
+from omnirag.content_transformer import ContentTransformer
+from omnirag.liquid_analyzer import LiquidAnalyzer
+TOKEN_PATTERN = re.compile(r"\w+|[^\w\s]")
+def stable_hash(text):
+    return int.from_bytes(hashlib.sha256(text.encode('utf-8')).digest()[:8], 'little')
+class StubTokenizer:
+    """Word/punctuation tokenizer with a vocabulary that grows as text is seen"""
+    def __init__(self):
+        self.vocab = {}
+        self.words = []
+        self._lock = threading.Lock()
+    def encode(self, text, add_special_tokens=False):
+        ids = []
+        for word in TOKEN_PATTERN.findall(text):
+            token_id = self.vocab.get(word)
+            if token_id is None:
+                with self._lock:
+                    token_id = self.vocab.setdefault(word, len(self.words))
+                    if token_id == len(self.words):
+                        self.words.append(word)
+            ids.append(token_id)
+        return ids
+    def decode(self, ids, skip_special_tokens=True):
+        return " ".join(self.words[int(i)] for i in ids)
+class StubLLM:
+    """Stands in for LLMClient. A batch sleeps prefill_ms_per_token for every
+    prompt token plus decode_ms_per_token for every step of its longest
+    response, as a padded batch on one device would. Registered prefixes
+    are only prefilled once when prefix_reuse is on, like LLMClient's cache."""
+    STAGES = (
+        ('classify', (LiquidAnalyzer.CLASSIFICATION_PREFIX,)),
+        ('decompose', (ChainDecomposer.DECOMPOSE_PREFIX,)),
+        ('transform', (ContentTransformer.SIMPLIFY_PREFIX, ContentTransformer.TECHNICAL_DEPTH_PREFIX)),
+        ('polish', ("Polish the draft answer",)),
+        ('answer', ("Based on the context", "Answer the question using the context")),
+        ('synthesis', ("Combine these sub-answers",)),
+    )
+    def __init__(self, model_name="stub-llm", prefill_ms_per_token=0.05, decode_ms_per_token=2.0,
+                 response_tokens=48, batch_size=8, prefix_reuse=True):
+        self.model_name = model_name
+        self.device = "cpu"
+        self.batch_size = batch_size
+        self.prefill_ms_per_token = prefill_ms_per_token
+        self.decode_ms_per_token = decode_ms_per_token
+        self.response_tokens = response_tokens
+        self.prefix_reuse = prefix_reuse
+        self.tokenizer = StubTokenizer()
+        self.prefixes = []
+        self._warm_prefixes = set()
+        self._lock = threading.Lock()
+        self.stage_stats = {}
+        self.last_usage = []
+    def register_prefix(self, prefix):
+        if prefix and prefix not in self.prefixes:
+            self.prefixes.append(prefix)
+    def prefix_cache_stats(self):
+        return {'prefixes': len(self.prefixes), 'cached': len(self._warm_prefixes)}
+    def clear_cache(self):
+        self._warm_prefixes = set()
+    def generate(self, prompt, max_tokens=512, temperature=0.75, system_prompt=None, streamer=None):
+        return self.generate_batch([prompt], max_tokens, temperature, system_prompt)[0]
+    def generate_stream(self, prompt, max_tokens=512, temperature=0.75, system_prompt=None):
+        words = self._respond(prompt, max_tokens).split(" ")
+        prefill = self._prefill_tokens([prompt])[0]
+        self._record(prompt, prefill, len(words), 0.0)
+        self.last_usage = [{'prompt_tokens': prefill, 'completion_tokens': len(words)}]
+        for i, word in enumerate(words):
+            time.sleep(self.decode_ms_per_token / 1000.0)
+            yield word if i == 0 else " " + word
+    def generate_batch(self, prompts, max_tokens=512, temperature=0.75, system_prompt=None):
+        prompts = list(prompts)
+        responses = []
+        usage = []
+        for i in range(0, len(prompts), self.batch_size):
+            batch = prompts[i:i + self.batch_size]
+            texts = [self._respond(prompt, max_tokens) for prompt in batch]
+            completion = [len(self.tokenizer.encode(text)) for text in texts]
+            prefill = self._prefill_tokens(batch)
+            seconds = (self.prefill_ms_per_token * sum(prefill) + self.decode_ms_per_token * max(completion)) / 1000.0
+            time.sleep(seconds)
+            for prompt, tokens, generated in zip(batch, prefill, completion):
+                self._record(prompt, tokens, generated, seconds / len(batch))
+                usage.append({'prompt_tokens': tokens, 'completion_tokens': generated})
+            responses.extend(texts)
+        self.last_usage = usage
+        return responses
+    def stats(self):
+        with self._lock:
+            return {stage: dict(counters) for stage, counters in self.stage_stats.items()}
+    def reset_stats(self):
+        with self._lock:
+            self.stage_stats = {}
+    def stage_of(self, prompt):
+        for stage, openings in self.STAGES:
+            if prompt.startswith(openings):
+                return stage
+        return 'other'
+    def _prefill_tokens(self, prompts):
+        tokens = [len(self.tokenizer.encode(prompt)) for prompt in prompts]
+        if not self.prefix_reuse or len(prompts) != 1:
+            return tokens
+        prefix = max((p for p in self.prefixes if prompts[0].startswith(p)), key=len, default="")
+        if prefix in self._warm_prefixes:
+            return [tokens[0] - len(self.tokenizer.encode(prefix))]
+        self._warm_prefixes.add(prefix)
+        return tokens
+    def _record(self, prompt, prompt_tokens, completion_tokens, seconds):
+        stage = self.stage_of(prompt)
+        with self._lock:
+            counters = self.stage_stats.setdefault(stage, {
+                'prompts': 0, 'prompt_tokens': 0, 'completion_tokens': 0, 'seconds': 0.0
+            })
+            counters['prompts'] += 1
+            counters['prompt_tokens'] += prompt_tokens
+            counters['completion_tokens'] += completion_tokens
+            counters['seconds'] += seconds
+    def _respond(self, prompt, max_tokens):
+        seed = stable_hash(prompt)
+        stage = self.stage_of(prompt)
+        if stage == 'classify':
+            level = LiquidAnalyzer.LEVELS[seed % 3]
+            return f"LEVEL: {level}\nCONFIDENCE: high\nREASON: stub classification."
+        words = [w for w in TOKEN_PATTERN.findall(prompt[-400:]) if w.isalnum()] or ["stub"]
+        if stage == 'decompose':
+            question = prompt[len(ChainDecomposer.DECOMPOSE_PREFIX):].split("\n")[0]
+            terms = [w for w in TOKEN_PATTERN.findall(question) if w.isalnum() and len(w) > 3] or words
+            return "\n".join(
+                f"What is {terms[(seed + i) % len(terms)]} and how is it used?"
+                for i in range(2 + seed % 3)
+            )
+        count = min(max_tokens, self.response_tokens)
+        return " ".join(words[(seed + i * 7) % len(words)] for i in range(count))
+class StubEmbedder:
+    """Stands in for SentenceTransformer: a hashed bag-of-words vector per text"""
+    def __init__(self, dim=384, encode_ms_per_text=0.0):
+        self.dim = dim
+        self.encode_ms_per_text = encode_ms_per_text
+    def get_sentence_embedding_dimension(self):
+        return self.dim
+    def encode(self, sentences, batch_size=32, convert_to_numpy=True, normalize_embeddings=False, **kwargs):
+        single = isinstance(sentences, str)
+        texts = [sentences] if single else list(sentences)
+        vectors = np.zeros((len(texts), self.dim), dtype='float32')
+        for row, text in enumerate(texts):
+            for word in TOKEN_PATTERN.findall(text.lower()):
+                h = stable_hash(word)
+                vectors[row, h % self.dim] += 1.0 if (h >> 32) & 1 else -1.0
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        vectors /= np.maximum(norms, 1e-12)
+        if self.encode_ms_per_text:
+            time.sleep(self.encode_ms_per_text * len(texts) / 1000.0)
+        return vectors[0] if single else vectors
+class StubWebSearch:
+    """Stands in for WebSearchTool with a fixed round-trip latency"""
+    def __init__(self, latency_ms=150.0):
+        self.latency_ms = latency_ms
+        self.enabled = True
+        self.calls = 0
+    def search(self, query, max_results=3):
+        self.calls += 1
+        time.sleep(self.latency_ms / 1000.0)
+        return [f"Web result {i} about {query}" for i in range(max_results)]
@@ -1,12 +1,21 @@
+import re
 class AgenticPlanner:
-    def __init__(self, llm_client):
+    # A token that looks like an identifier rather than a word: letters mixed
+    # with digits (E1234, v2.3, 404NotFound), snake_case, camelCase, or an
+    # all-caps name longer than an acronym (ECONNREFUSED).
+    IDENTIFIER_PATTERN = re.compile(r"[A-Za-z].*\d|\d.*[A-Za-z]|\w_\w|[a-z][A-Z]|^[A-Z]{6,}$")
+    # An acronym (AI, DNS, HTTP) is usually asked about in words, which BM25
+    # alone does not match.
+    ACRONYM_PATTERN = re.compile(r"^[A-Z]{2,5}$")
+    def __init__(self, llm_client, keyword_max_words=6):
         self.llm = llm_client
+        self.keyword_max_words = keyword_max_words
         self.web_keywords = [
             'latest', 'recent', 'current', 'now', 'today',
             '2024', '2025', '2026', 'news', 'trending',
             'this year', 'this month', 'update'
         ]
-    def plan(self, query, web_available=False):
+    def plan(self, query, web_available=False, lexical_available=False):
         query_lower = query.lower()
         needs_current_info = any(keyword in query_lower for keyword in self.web_keywords)
         if needs_current_info and web_available:
@@ -14,7 +23,31 @@ class AgenticPlanner:
                 'tool': 'web_search',
                 'reasoning': 'Query requires current/recent information from web'
             }
+        if lexical_available and self.is_keyword_query(query):
+            return {
+                'tool': 'lexical',
+                'reasoning': 'Short lookup of exact terms or identifiers: lexical index, no embedding'
+            }
+        if lexical_available and self.is_acronym_query(query):
+            return {
+                'tool': 'hybrid',
+                'reasoning': 'Short query naming an acronym: lexical and dense results fused'
+            }
         return {
             'tool': 'vectordb',
             'reasoning': 'Using local knowledge base for general information'
         }
+    def is_keyword_query(self, query):
+        """A short query that quotes an exact phrase or names an identifier"""
+        words = self._short_query_words(query)
+        if '"' in query and words:
+            return True
+        return any(self.IDENTIFIER_PATTERN.search(word) for word in words)
+    def is_acronym_query(self, query):
+        """A short query that names an acronym"""
+        return any(self.ACRONYM_PATTERN.search(word) for word in self._short_query_words(query))
+    def _short_query_words(self, query):
+        words = query.split()
+        if len(words) > self.keyword_max_words:
+            return []
+        return [word.strip("?!.,;:()'") for word in words]
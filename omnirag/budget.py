@@ -0,0 +1,163 @@
+import threading
+import time
+# Pipeline stages in execution order. classify, transform, synthesis and
+# polish are optional; the rest always run.
+STAGES = ('classify', 'decompose', 'retrieve', 'transform', 'answer', 'synthesis', 'polish')
+OPTIONAL_STAGES = ('classify', 'transform', 'synthesis', 'polish')
+# Optional stages in the order they are given up when a deadline is tight:
+# the per-chunk rewrites cost the most LLM calls, the synthesis matters most.
+DROP_ORDER = ('transform', 'polish', 'classify', 'synthesis')
+PROFILES = {
+    'fast': {
+        'classify': False,
+        'transform': False,
+        'synthesis': False,
+        'polish': False,
+        'max_sub_queries': 2,
+        'answer_tokens': 200,
+        'synthesis_tokens': 300,
+        'polish_tokens': 300
+    },
+    'balanced': {
+        'classify': True,
+        'transform': False,
+        'synthesis': True,
+        'polish': True,
+        'max_sub_queries': 3,
+        'answer_tokens': 300,
+        'synthesis_tokens': 400,
+        'polish_tokens': 400
+    },
+    'quality': {
+        'classify': True,
+        'transform': True,
+        'synthesis': True,
+        'polish': True,
+        'max_sub_queries': 4,
+        'answer_tokens': 300,
+        'synthesis_tokens': 500,
+        'polish_tokens': 500
+    }
+}
+class LatencyModel:
+    """Running estimates of what each stage costs per query and of the time per
+    generated token, learned from finished query traces"""
+    def __init__(self, alpha=0.3):
+        self.alpha = alpha
+        self._stage_ms = {}
+        self._ms_per_token = None
+        self._lock = threading.Lock()
+    def observe(self, trace, skipped=()):
+        """Fold one finished trace (Trace.finish()) into the estimates; the
+        skipped stages ran in a reduced form and say nothing about their cost"""
+        llm_ms = 0.0
+        tokens = 0
+        with self._lock:
+            for stage, row in trace['stages'].items():
+                if stage in STAGES and stage not in skipped:
+                    self._stage_ms[stage] = self._update(self._stage_ms.get(stage), row['ms'])
+                llm_ms += row['llm_ms']
+                tokens += row['completion_tokens']
+            if tokens:
+                self._ms_per_token = self._update(self._ms_per_token, llm_ms / tokens)
+    def stage_ms(self, stage):
+        with self._lock:
+            return self._stage_ms.get(stage)
+    def ms_per_token(self):
+        with self._lock:
+            return self._ms_per_token
+    def stats(self):
+        with self._lock:
+            return {'stage_ms': dict(self._stage_ms), 'ms_per_token': self._ms_per_token}
+    def _update(self, current, value):
+        return value if current is None else (1 - self.alpha) * current + self.alpha * value
+class BudgetPlanner:
+    """Decides which optional stages of one query run. The profile switches stages
+    off outright; with a deadline_ms, stages estimated not to fit are dropped up
+    front, and before each later stage the remaining budget is checked again:
+    an optional stage that no longer fits is skipped and generations get fewer
+    max_tokens (never below min_tokens). Stages in omit do not exist in the
+    caller's pipeline, so they are neither estimated nor reported as skipped."""
+    def __init__(self, profile="quality", deadline_ms=None, latency=None, min_tokens=32, omit=()):
+        if profile not in PROFILES:
+            raise ValueError(f"Unknown profile: {profile} (expected one of {', '.join(PROFILES)})")
+        self.profile = profile
+        self.settings = PROFILES[profile]
+        self.deadline_ms = deadline_ms
+        self.latency = latency
+        self.min_tokens = min_tokens
+        self.started = time.perf_counter()
+        self.skipped = []
+        self.shortened = {}
+        self._lock = threading.Lock()
+        self.planned = {stage: self.settings[stage] and stage not in omit for stage in OPTIONAL_STAGES}
+        for stage in OPTIONAL_STAGES:
+            if not self.planned[stage] and stage not in omit:
+                self._skip(stage, 'profile')
+        if deadline_ms is not None and latency is not None:
+            for stage in DROP_ORDER:
+                if self._estimate(STAGES) <= deadline_ms:
+                    break
+                if self.planned[stage]:
+                    self.planned[stage] = False
+                    self._skip(stage, 'deadline')
+    @property
+    def max_sub_queries(self):
+        return self.settings['max_sub_queries']
+    @property
+    def degraded(self):
+        """Whether the deadline, not just the profile, changed this query's answer"""
+        return bool(self.shortened) or any(skip['reason'] != 'profile' for skip in self.skipped)
+    def elapsed_ms(self):
+        return 1000.0 * (time.perf_counter() - self.started)
+    def remaining_ms(self):
+        return None if self.deadline_ms is None else self.deadline_ms - self.elapsed_ms()
+    def run(self, stage):
+        """Whether optional stage should run now; records the skip if not"""
+        with self._lock:
+            if not self.planned[stage]:
+                return False
+            remaining = self.remaining_ms()
+            if remaining is not None:
+                needed = self._estimate(STAGES[STAGES.index(stage):])
+                if remaining <= 0 or needed > remaining:
+                    self.planned[stage] = False
+                    self._skip(stage, 'deadline')
+                    return False
+            return True
+    def max_tokens(self, stage):
+        """The profile's max_tokens for stage's generation, cut to what the remaining budget allows"""
+        tokens = self.settings[f"{stage}_tokens"]
+        remaining = self.remaining_ms()
+        ms_per_token = self.latency.ms_per_token() if self.latency is not None else None
+        if remaining is None or not ms_per_token:
+            return tokens
+        with self._lock:
+            budget = remaining - self._estimate(STAGES[STAGES.index(stage) + 1:])
+            fitting = int(budget / ms_per_token)
+            if fitting >= tokens:
+                return tokens
+            tokens = max(fitting, self.min_tokens)
+            self.shortened[stage] = min(tokens, self.shortened.get(stage, tokens))
+            return tokens
+    def metadata(self):
+        with self._lock:
+            return {
+                'profile': self.profile,
+                'deadline_ms': self.deadline_ms,
+                'elapsed_ms': self.elapsed_ms(),
+                'skipped': [dict(skip) for skip in self.skipped],
+                'shortened': dict(self.shortened)
+            }
+    def _estimate(self, stages):
+        """Expected milliseconds of the planned stages among stages, from the latency model"""
+        if self.latency is None:
+            return 0.0
+        return sum(
+            self.latency.stage_ms(stage) or 0.0
+            for stage in stages
+            if stage not in self.planned or self.planned[stage]
+        )
+    def _skip(self, stage, reason):
+        if all(skip['stage'] != stage for skip in self.skipped):
+            self.skipped.append({'stage': stage, 'reason': reason})
@@ -1,32 +1,238 @@
+import sys
+import json
 import hashlib
+import threading
+from collections import OrderedDict
 from datetime import datetime, timedelta
+import numpy as np
+from omnirag import tracing
+def estimate_size(value, _seen=None):
+    """Approximate deep size in bytes of a cached result (dicts, lists, strings, numbers)"""
+    if _seen is None:
+        _seen = set()
+    if id(value) in _seen:
+        return 0
+    _seen.add(id(value))
+    size = sys.getsizeof(value)
+    if isinstance(value, dict):
+        size += sum(estimate_size(k, _seen) + estimate_size(v, _seen) for k, v in value.items())
+    elif isinstance(value, (list, tuple, set, frozenset)):
+        size += sum(estimate_size(item, _seen) for item in value)
+    return size
 class SimpleCache:
-    def __init__(self, ttl_minutes=60):
-        self.cache = {}
+    """Thread-safe LRU cache bounded by entry count and approximate byte size.
+    Expired entries are dropped on every access, not only when their key is read again."""
+    def __init__(self, ttl_minutes=60, max_entries=1024, max_bytes=64 * 1024 * 1024):
+        self.cache = OrderedDict()
         self.ttl = timedelta(minutes=ttl_minutes)
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._expiry = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.RLock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
     def _hash_key(self, query):
         return hashlib.md5(query.encode()).hexdigest()
     def get(self, query):
         key = self._hash_key(query)
-        if key in self.cache:
-            item = self.cache[key]
-            if datetime.now() - item['timestamp'] < self.ttl:
-                return item['result']
-            else:
-                del self.cache[key]
+        with self._lock:
+            self._purge_expired()
+            if key in self.cache:
+                self.cache.move_to_end(key)
+                self.hits += 1
+                return self.cache[key]['result']
+            self.misses += 1
         return None
     def set(self, query, result):
         key = self._hash_key(query)
-        self.cache[key] = {
-            'result': result,
-            'timestamp': datetime.now()
-        }
+        size = estimate_size(result)
+        with self._lock:
+            self._purge_expired()
+            if key in self.cache:
+                self._remove(key)
+            if size > self.max_bytes:
+                return
+            now = datetime.now()
+            self.cache[key] = {
+                'result': result,
+                'timestamp': now,
+                'size': size
+            }
+            self._expiry[key] = now + self.ttl
+            self._bytes += size
+            while len(self.cache) > self.max_entries or self._bytes > self.max_bytes:
+                self._remove(next(iter(self.cache)))
+                self.evictions += 1
     def clear(self):
-        self.cache = {}
+        with self._lock:
+            self.cache = OrderedDict()
+            self._expiry = OrderedDict()
+            self._bytes = 0
     def size(self):
-        return len(self.cache)
+        with self._lock:
+            self._purge_expired()
+            return len(self.cache)
     def stats(self):
-        return {
-            'size': len(self.cache),
-            'ttl_minutes': self.ttl.total_seconds() / 60
-        }
+        with self._lock:
+            self._purge_expired()
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self.cache),
+                'bytes': self._bytes,
+                'max_entries': self.max_entries,
+                'max_bytes': self.max_bytes,
+                'ttl_minutes': self.ttl.total_seconds() / 60,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'evictions': self.evictions,
+                'expirations': self.expirations
+            }
+    def _remove(self, key):
+        item = self.cache.pop(key)
+        self._expiry.pop(key, None)
+        self._bytes -= item['size']
+    def _purge_expired(self):
+        # Every entry gets the same TTL, so _expiry is ordered by expiry time
+        # and only its expired head needs to be looked at.
+        now = datetime.now()
+        while self._expiry:
+            key, expires_at = next(iter(self._expiry.items()))
+            if expires_at > now:
+                break
+            self._remove(key)
+            self.expirations += 1
+class SemanticCache:
+    """Answer cache looked up by embedding similarity, so paraphrases of a past
+    query reuse its answer when the user level and the namespace (any other
+    setting that changes the answer) match. Without an embedder,
+    embedder_loader is called for one on the first lookup; the index is sized
+    by the first vector added."""
+    def __init__(self, embedder=None, threshold=0.9, ttl_minutes=60, max_entries=1024, top_k=5,
+                 embedder_loader=None):
+        self._embedder = embedder
+        self.embedder_loader = embedder_loader
+        self.threshold = threshold
+        self.ttl = timedelta(minutes=ttl_minutes)
+        self.max_entries = max_entries
+        self.top_k = top_k
+        self.index = None
+        self.entries = OrderedDict()
+        self._expiry = OrderedDict()
+        self._next_id = 0
+        self._lock = threading.RLock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+    @property
+    def embedder(self):
+        if self._embedder is None:
+            self._embedder = self.embedder_loader()
+        return self._embedder
+    def embed(self, query):
+        vector = self.embedder.encode([query], convert_to_numpy=True, normalize_embeddings=True)
+        return vector.astype('float32')
+    def lookup(self, vector, user_level, namespace=None):
+        """Return (result, similarity) of the closest live entry for user_level and
+        namespace above the threshold"""
+        with self._lock:
+            self._purge_expired()
+            if self.index is not None and self.index.ntotal:
+                scores, ids = self.index.search(vector, min(self.top_k, self.index.ntotal))
+                for score, entry_id in zip(scores[0], ids[0]):
+                    if score < self.threshold:
+                        break
+                    entry = self.entries.get(int(entry_id))
+                    if entry is not None and entry['user_level'] == user_level and entry['namespace'] == namespace:
+                        self.entries.move_to_end(int(entry_id))
+                        self.hits += 1
+                        return entry['result'], float(score)
+            self.misses += 1
+        return None, 0.0
+    def add(self, vector, query, user_level, result, namespace=None):
+        with self._lock:
+            self._purge_expired()
+            entry_id = self._next_id
+            self._next_id += 1
+            if self.index is None:
+                import faiss
+                self.index = faiss.IndexIDMap2(faiss.IndexFlatIP(vector.shape[1]))
+            self.index.add_with_ids(vector, np.array([entry_id], dtype='int64'))
+            self.entries[entry_id] = {
+                'query': query,
+                'user_level': user_level,
+                'namespace': namespace,
+                'result': result
+            }
+            self._expiry[entry_id] = datetime.now() + self.ttl
+            while len(self.entries) > self.max_entries:
+                self._remove([next(iter(self.entries))])
+                self.evictions += 1
+    def clear(self):
+        with self._lock:
+            if self.index is not None:
+                self.index.reset()
+            self.entries = OrderedDict()
+            self._expiry = OrderedDict()
+    def size(self):
+        return len(self.entries)
+    def stats(self):
+        with self._lock:
+            self._purge_expired()
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self.entries),
+                'threshold': self.threshold,
+                'max_entries': self.max_entries,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'evictions': self.evictions,
+                'expirations': self.expirations
+            }
+    def _remove(self, entry_ids):
+        for entry_id in entry_ids:
+            self.entries.pop(entry_id, None)
+            self._expiry.pop(entry_id, None)
+        if self.index is not None:
+            self.index.remove_ids(np.array(entry_ids, dtype='int64'))
+    def _purge_expired(self):
+        now = datetime.now()
+        expired = []
+        for entry_id, expires_at in self._expiry.items():
+            if expires_at > now:
+                break
+            expired.append(entry_id)
+        if expired:
+            self._remove(expired)
+            self.expirations += len(expired)
+class StageCache:
+    """Memoizes intermediate pipeline results keyed on (stage, input, level, model),
+    with its own bounds and per-stage hit/miss counters."""
+    def __init__(self, model_name, ttl_minutes=24 * 60, max_entries=4096, max_bytes=32 * 1024 * 1024):
+        self.model_name = model_name
+        self.store = SimpleCache(ttl_minutes=ttl_minutes, max_entries=max_entries, max_bytes=max_bytes)
+        self.stage_stats = {}
+        self._lock = threading.Lock()
+    def _key(self, stage, value, level):
+        return json.dumps([stage, self.model_name, level, value])
+    def get(self, stage, value, level=None):
+        """Return the memoized result, or None when the stage has to run"""
+        item = self.store.get(self._key(stage, value, level))
+        with self._lock:
+            counters = self.stage_stats.setdefault(stage, {'hits': 0, 'misses': 0})
+            counters['hits' if item is not None else 'misses'] += 1
+        tracing.record_cache(f"stage:{stage}", item is not None)
+        return item['value'] if item is not None else None
+    def set(self, stage, value, result, level=None):
+        self.store.set(self._key(stage, value, level), {'value': result})
+    def clear(self):
+        self.store.clear()
+    def stats(self):
+        stats = self.store.stats()
+        stats['stages'] = {stage: dict(counters) for stage, counters in self.stage_stats.items()}
+        return stats
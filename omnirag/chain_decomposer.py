@@ -1,6 +1,18 @@
 class ChainDecomposer:
-    def __init__(self, llm_client):
+    # Static opening of the decomposition prompt, placed before the question so
+    # the LLM client can reuse its KV cache.
+    DECOMPOSE_PREFIX = """Break the complex question below into 2-4 simpler questions.
+Instructions:
+- Return ONLY the sub-questions
+- One question per line
+- NO numbering, bullets, or explanations
+- Keep questions simple and clear
+Original Question:
+"""
+    def __init__(self, llm_client, stage_cache=None):
         self.llm = llm_client
+        self.stage_cache = stage_cache
+        self.llm.register_prefix(self.DECOMPOSE_PREFIX)
         self.complex_indicators = [
             'compare', 'vs', 'versus', 'difference between',
             'and also', 'what are', 'list', 'explain each',
@@ -13,14 +25,16 @@ class ChainDecomposer:
         is_long = len(query.split()) > 15
         return has_multiple_sentences or has_complex_words or is_long
     def decompose(self, query):
-        prompt = f"""Break this complex question into 2-4 simpler questions.
-Original Question: {query}
-
-Instructions:
-- Return ONLY the sub-questions
-- One question per line
-- NO numbering, bullets, or explanations
-- Keep questions simple and clear
+        if self.stage_cache is not None:
+            cached = self.stage_cache.get('chain', query)
+            if cached is not None:
+                return list(cached)
+        sub_queries = self._decompose(query)
+        if self.stage_cache is not None and sub_queries != [query]:
+            self.stage_cache.set('chain', query, list(sub_queries))
+        return sub_queries
+    def _decompose(self, query):
+        prompt = f"""{self.DECOMPOSE_PREFIX}{query}
 Sub-questions:"""
         response = self.llm.generate(prompt, max_tokens=200)
         lines = [line.strip() for line in response.split('\n') if line.strip()]
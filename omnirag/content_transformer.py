@@ -1,48 +1,123 @@
 class ContentTransformer:
-    def __init__(self, llm_client):
+    def __init__(self, llm_client, stage_cache=None):
         self.llm = llm_client
+        self.stage_cache = stage_cache
+        self.llm.register_prefix(self.SIMPLIFY_PREFIX)
+        self.llm.register_prefix(self.TECHNICAL_DEPTH_PREFIX)
+        for user_level in ("beginner", "intermediate", "expert"):
+            self.llm.register_prefix(self._polish_prefix(user_level))
+            self.llm.register_prefix(self.fused_answer_prefix(user_level))
     def transform(self, content, user_level):
-        if user_level == "intermediate":
+        if user_level not in ("beginner", "expert"):
             return content
+        return self.transform_batch([content], user_level)[0]
+    def transform_batch(self, contents, user_level):
+        """Transform several chunks with a single batched generation, reusing memoized rewrites"""
+        contents = list(contents)
         if user_level == "beginner":
-            return self._simplify(content)
-        if user_level == "expert":
-            return self._add_technical_depth(content)
-        return content
-    def _simplify(self, content):
-        """Make content simple for beginners"""
-        prompt = f"""Rewrite this text for complete beginners:
-Original Text:
-{content}
+            build_prompt = self._simplify_prompt
+        elif user_level == "expert":
+            build_prompt = self._technical_depth_prompt
+        else:
+            return contents
+        results = [None] * len(contents)
+        if self.stage_cache is not None:
+            for i, content in enumerate(contents):
+                results[i] = self.stage_cache.get('transform', content, user_level)
+        # Chunks retrieved by several sub-queries are rewritten only once.
+        missing = list(dict.fromkeys(content for content, result in zip(contents, results) if result is None))
+        if missing:
+            generated = dict(zip(missing, self.llm.generate_batch(
+                [build_prompt(content) for content in missing],
+                max_tokens=300
+            )))
+            for i, content in enumerate(contents):
+                if results[i] is None:
+                    results[i] = generated[content]
+            if self.stage_cache is not None:
+                for content, transformed in generated.items():
+                    if transformed:
+                        self.stage_cache.set('transform', content, transformed, user_level)
+        return results
+    # Static openings of the rewrite prompts, placed before the variable text so
+    # the LLM client can reuse their KV cache.
+    SIMPLIFY_PREFIX = """Rewrite the text below for complete beginners.
 Instructions:
 - Use VERY simple language
 - Remove all jargon and technical terms
 - Add everyday analogies
 - Keep it short and clear
 - Explain like teaching a child
-Simplified Version:"""
-        return self.llm.generate(prompt, max_tokens=300)
-    def _add_technical_depth(self, content):
-        """Add technical details for experts"""
-        prompt = f"""Enhance this text with technical depth for experts:
 Original Text:
-{content}
+"""
+    TECHNICAL_DEPTH_PREFIX = """Enhance the text below with technical depth for experts.
 Instructions:
 - Add precise technical terminology
 - Include implementation details
 - Add relevant algorithms or methods
 - Be concise but thorough
 - Assume expert knowledge
+Original Text:
+"""
+    def _simplify_prompt(self, content):
+        """Make content simple for beginners"""
+        return f"""{self.SIMPLIFY_PREFIX}{content}
+Simplified Version:"""
+    def _technical_depth_prompt(self, content):
+        """Add technical details for experts"""
+        return f"""{self.TECHNICAL_DEPTH_PREFIX}{content}
 Technical Version:"""
-        return self.llm.generate(prompt, max_tokens=300)
-    def polish(self, answer, user_level):
-        prompt = f"""Polish this answer for a {user_level} level user:
-Draft Answer:
-{answer}
+    def polish(self, answer, user_level, max_tokens=500):
+        return self.llm.generate(self._polish_prompt(answer, user_level), max_tokens=max_tokens)
+    def polish_stream(self, answer, user_level, max_tokens=500):
+        """Yield the polished answer piece by piece as it is generated"""
+        return self.llm.generate_stream(self._polish_prompt(answer, user_level), max_tokens=max_tokens)
+    def _polish_prefix(self, user_level):
+        return f"""Polish the draft answer below for a {user_level} level user.
 Instructions:
 - Ensure consistent tone for {user_level} level
 - Remove any inappropriate complexity
 - Make structure clear
 - Keep concise and focused
+Draft Answer:
+"""
+    def _polish_prompt(self, answer, user_level):
+        return f"""{self._polish_prefix(user_level)}{answer}
 Polished Answer:"""
-        return self.llm.generate(prompt, max_tokens=500)
+    # What the rewrite and polish prompts ask for at each level, given to the
+    # fused answer mode's single generation instead.
+    LEVEL_INSTRUCTIONS = {
+        'beginner': """- Use very simple language and no jargon
+- Add everyday analogies
+- Keep it short and clear""",
+        'intermediate': """- Use a clear, consistent tone
+- Briefly explain technical terms
+- Keep it concise and focused""",
+        'expert': """- Use precise technical terminology
+- Include implementation details, algorithms or methods
+- Be concise but thorough"""
+    }
+    def fused_answer_prefix(self, user_level):
+        return f"""Answer the question using the context below, written for a {user_level} level user.
+Instructions:
+{self.LEVEL_INSTRUCTIONS.get(user_level, self.LEVEL_INSTRUCTIONS['intermediate'])}
+- Make structure clear
+Context:
+"""
+    def fused_answer_prompt(self, question, context, user_level):
+        """Answer from raw chunks at the user's level in one generation, replacing
+        the per-chunk rewrites, the answer and the polish"""
+        return f"""{self.fused_answer_prefix(user_level)}{context}
+Question: {question}
+Answer:"""
+    def fused_synthesis_prompt(self, question, sub_results, user_level):
+        """Combine sub-answers into the final, polished answer in one generation"""
+        combined = "\n\n".join(f"Q: {r['sub_query']}\nA: {r['answer']}" for r in sub_results)
+        return f"""Combine these sub-answers into one coherent, complete answer for a {user_level} level user.
+Instructions:
+{self.LEVEL_INSTRUCTIONS.get(user_level, self.LEVEL_INSTRUCTIONS['intermediate'])}
+- Make structure clear
+Original Question: {question}
+Sub-Answers:
+{combined}
+Final Answer:"""
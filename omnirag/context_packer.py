@@ -0,0 +1,118 @@
+import threading
+class ContextPacker:
+    """Fits retrieved chunks into answer prompts by token count: a chunk retrieved
+    by several sub-queries is kept only where it ranked best (each list keeps
+    its own top hit), and each prompt's
+    context takes chunks in retrieval-score order until max_tokens is reached.
+    Without a tokenizer, tokenizer_loader is called for one when first needed;
+    likewise max_tokens_loader for max_tokens (None without a loader: no limit)."""
+    def __init__(self, tokenizer=None, max_tokens=1024, separator="\n\n", tokenizer_loader=None,
+                 max_tokens_loader=None):
+        self._tokenizer = tokenizer
+        self.tokenizer_loader = tokenizer_loader
+        self.max_tokens = max_tokens
+        self.max_tokens_loader = max_tokens_loader
+        self.separator = separator
+        self._separator_tokens = None
+        self._lock = threading.Lock()
+        # Query threads pack concurrently; a fast tokenizer is not safe to
+        # call from several threads at once.
+        self._tokenizer_lock = threading.Lock()
+        self.duplicates_removed = 0
+        self.chunks_packed = 0
+        self.chunks_dropped = 0
+        self.chunks_truncated = 0
+        self.tokens_packed = 0
+    @property
+    def tokenizer(self):
+        if self._tokenizer is None:
+            with self._lock:
+                if self._tokenizer is None:
+                    self._tokenizer = self.tokenizer_loader()
+        return self._tokenizer
+    def count_tokens(self, text):
+        with self._tokenizer_lock:
+            return len(self.tokenizer.encode(text, add_special_tokens=False))
+    def truncate(self, text, max_tokens):
+        with self._tokenizer_lock:
+            ids = self.tokenizer.encode(text, add_special_tokens=False)
+            if len(ids) <= max_tokens:
+                return text
+            return self.tokenizer.decode(ids[:max_tokens]).strip()
+    def dedupe(self, hit_lists):
+        """Keep each chunk only in the hit list where it ranks highest (the first
+        such list on a tie), except that every list keeps its own top hit, so no
+        sub-query is left without context. Lists compare by rank, not score:
+        dense, BM25, fused and web scores are on unrelated scales."""
+        best = {}
+        tops = []
+        for list_idx, hits in enumerate(hit_lists):
+            order = sorted(range(len(hits)), key=lambda i: hits[i]['score'], reverse=True)
+            tops.append(order[0] if order else None)
+            for rank, i in enumerate(order):
+                key = self._hit_key(hits[i])
+                if key not in best or rank < best[key][1]:
+                    best[key] = (list_idx, rank)
+        deduped = []
+        removed = 0
+        for list_idx, hits in enumerate(hit_lists):
+            kept = []
+            seen = set()
+            for i, hit in enumerate(hits):
+                key = self._hit_key(hit)
+                if (best[key][0] == list_idx or i == tops[list_idx]) and key not in seen:
+                    seen.add(key)
+                    kept.append(hit)
+                else:
+                    removed += 1
+            deduped.append(kept)
+        with self._lock:
+            self.duplicates_removed += removed
+        return deduped
+    def pack(self, texts, scores, max_tokens=None):
+        """Join the highest-scoring texts that fit in max_tokens, in score order.
+        When even the best text does not fit on its own it is truncated."""
+        if self.max_tokens is None and self.max_tokens_loader is not None:
+            self.max_tokens = self.max_tokens_loader()
+        budget = self.max_tokens if max_tokens is None else max_tokens
+        order = sorted(range(len(texts)), key=lambda i: scores[i], reverse=True)
+        if budget is None:
+            return self.separator.join(texts[i] for i in order if texts[i])
+        if self._separator_tokens is None:
+            self._separator_tokens = self.count_tokens(self.separator)
+        packed = []
+        used = 0
+        dropped = 0
+        truncated = 0
+        for i in order:
+            if not texts[i]:
+                continue
+            cost = self.count_tokens(texts[i]) + (self._separator_tokens if packed else 0)
+            if used + cost <= budget:
+                packed.append(texts[i])
+                used += cost
+            elif not packed:
+                packed.append(self.truncate(texts[i], budget))
+                used = budget
+                truncated += 1
+            else:
+                dropped += 1
+        with self._lock:
+            self.chunks_packed += len(packed)
+            self.chunks_dropped += dropped
+            self.chunks_truncated += truncated
+            self.tokens_packed += used
+        return self.separator.join(packed)
+    def stats(self):
+        with self._lock:
+            return {
+                'max_tokens': self.max_tokens,
+                'duplicates_removed': self.duplicates_removed,
+                'chunks_packed': self.chunks_packed,
+                'chunks_dropped': self.chunks_dropped,
+                'chunks_truncated': self.chunks_truncated,
+                'tokens_packed': self.tokens_packed
+            }
+    def _hit_key(self, hit):
+        # Web results carry no document id, so they are identified by their text.
+        return ('doc', hit['id']) if hit['id'] is not None else ('web', hit['text'])
@@ -0,0 +1,74 @@
+import os
+import mmap
+import numpy as np
+class DocumentStore:
+    """List-like document storage that can be saved as one UTF-8 blob plus an
+    offsets array, and loaded back memory-mapped so that several processes
+    share the same pages. Documents added after loading stay in memory until
+    the next save."""
+    DATA_FILE = "documents.bin"
+    OFFSETS_FILE = "offsets.npy"
+    def __init__(self, documents=None):
+        self._data = None
+        self._offsets = None
+        self._base_count = 0
+        self._tail = list(documents or [])
+    def __len__(self):
+        return self._base_count + len(self._tail)
+    def __getitem__(self, idx):
+        if isinstance(idx, slice):
+            return [self[i] for i in range(*idx.indices(len(self)))]
+        if idx < 0:
+            idx += len(self)
+        if idx < 0 or idx >= len(self):
+            raise IndexError("document index out of range")
+        if idx >= self._base_count:
+            return self._tail[idx - self._base_count]
+        start, end = int(self._offsets[idx]), int(self._offsets[idx + 1])
+        return self._data[start:end].decode('utf-8')
+    def __iter__(self):
+        for idx in range(len(self)):
+            yield self[idx]
+    def append(self, document):
+        self._tail.append(document)
+    def extend(self, documents):
+        self._tail.extend(documents)
+    def clear(self):
+        self._data = None
+        self._offsets = None
+        self._base_count = 0
+        self._tail = []
+    def save(self, path):
+        os.makedirs(path, exist_ok=True)
+        data_path = os.path.join(path, self.DATA_FILE)
+        offsets_path = os.path.join(path, self.OFFSETS_FILE)
+        offsets = np.zeros(len(self) + 1, dtype=np.int64)
+        # Write to temporary files and swap them in, so processes that still
+        # have the previous files mapped keep reading consistent data.
+        with open(data_path + ".tmp", 'wb') as f:
+            position = 0
+            for idx, document in enumerate(self, 1):
+                encoded = document.encode('utf-8')
+                f.write(encoded)
+                position += len(encoded)
+                offsets[idx] = position
+        with open(offsets_path + ".tmp", 'wb') as f:
+            np.save(f, offsets)
+        os.replace(data_path + ".tmp", data_path)
+        os.replace(offsets_path + ".tmp", offsets_path)
+    @classmethod
+    def load(cls, path, mmap_mode=True):
+        store = cls()
+        data_path = os.path.join(path, cls.DATA_FILE)
+        offsets_path = os.path.join(path, cls.OFFSETS_FILE)
+        offsets = np.load(offsets_path, mmap_mode='r' if mmap_mode else None)
+        if mmap_mode and os.path.getsize(data_path) > 0:
+            with open(data_path, 'rb') as f:
+                data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        else:
+            with open(data_path, 'rb') as f:
+                data = f.read()
+        store._data = data
+        store._offsets = offsets
+        store._base_count = len(offsets) - 1
+        return store
@@ -0,0 +1,64 @@
+import os
+import hashlib
+import sqlite3
+import threading
+import numpy as np
+class EmbeddingCache:
+    """On-disk embedding cache keyed by a hash of (embedding model, text)"""
+    DB_FILE = "embeddings.sqlite"
+    def __init__(self, cache_dir, model_key):
+        os.makedirs(cache_dir, exist_ok=True)
+        self.path = os.path.join(cache_dir, self.DB_FILE)
+        self.model_key = model_key
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, vector BLOB NOT NULL)"
+        )
+        self._conn.commit()
+        self.hits = 0
+        self.misses = 0
+    def key(self, text):
+        return hashlib.sha256(f"{self.model_key}\0{text}".encode('utf-8')).hexdigest()
+    def get_many(self, keys):
+        found = {}
+        keys = list(keys)
+        with self._lock:
+            # Stay well below SQLite's bound-parameter limit.
+            for i in range(0, len(keys), 500):
+                batch = keys[i:i + 500]
+                rows = self._conn.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({','.join('?' * len(batch))})",
+                    batch
+                ).fetchall()
+                for key, blob in rows:
+                    found[key] = np.frombuffer(blob, dtype='float32')
+        self.hits += len(found)
+        self.misses += len(keys) - len(found)
+        return found
+    def put_many(self, items):
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (key, vector) VALUES (?, ?)",
+                [(key, np.asarray(vector, dtype='float32').tobytes()) for key, vector in items]
+            )
+            self._conn.commit()
+    def size(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'path': self.path,
+            'entries': self.size(),
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else 0.0
+        }
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM embeddings")
+            self._conn.commit()
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,174 @@
+import asyncio
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+from omnirag import tracing
+class GenerationQueue:
+    """Single owner of the model: callers from any thread or event loop submit
+    prompts and a worker thread runs whatever is pending as one padded batch.
+    With batch_window_ms > 0 the worker waits that long after the first
+    request (or until max_batch_size requests are pending) before running."""
+    def __init__(self, llm_client, max_batch_size=None, batch_window_ms=0):
+        self.llm = llm_client
+        self.max_batch_size = max_batch_size or getattr(llm_client, 'batch_size', 8)
+        self.batch_window_ms = batch_window_ms
+        self._pending = deque()
+        self._cond = threading.Condition()
+        self._worker = None
+        self._closed = False
+        self.batches_run = 0
+        self.prompts_run = 0
+    def __getattr__(self, name):
+        # Everything that is not queueing (tokenizer, model_name, device...)
+        # is answered by the wrapped client.
+        if name == 'llm':
+            raise AttributeError(name)
+        return getattr(self.llm, name)
+    def submit(self, prompt, max_tokens=512, temperature=0.75, system_prompt=None):
+        return self.submit_batch([prompt], max_tokens, temperature, system_prompt)[0]
+    def submit_batch(self, prompts, max_tokens=512, temperature=0.75, system_prompt=None, sink=None):
+        # A streaming request carries its own sink, which also keeps it out of
+        # other requests' batches.
+        params = (max_tokens, temperature, system_prompt, sink)
+        # The worker thread credits token usage to the submitter's trace.
+        origin = tracing.current()
+        requests = [(prompt, params, Future(), origin) for prompt in prompts]
+        with self._cond:
+            if self._closed:
+                raise RuntimeError("GenerationQueue is closed")
+            self._ensure_worker()
+            self._pending.extend(requests)
+            self._cond.notify()
+        return [future for _, _, future, _ in requests]
+    def generate(self, prompt, max_tokens=512, temperature=0.75, system_prompt=None):
+        return self.submit(prompt, max_tokens, temperature, system_prompt).result()
+    def generate_batch(self, prompts, max_tokens=512, temperature=0.75, system_prompt=None):
+        futures = self.submit_batch(list(prompts), max_tokens, temperature, system_prompt)
+        return [future.result() for future in futures]
+    def generate_stream(self, prompt, max_tokens=512, temperature=0.75, system_prompt=None):
+        sink = queue.Queue()
+        future = self.submit_batch([prompt], max_tokens, temperature, system_prompt, sink)[0]
+        while True:
+            text = sink.get()
+            if text is None:
+                break
+            yield text
+        future.result()
+    async def agenerate(self, prompt, max_tokens=512, temperature=0.75, system_prompt=None):
+        return await asyncio.wrap_future(self.submit(prompt, max_tokens, temperature, system_prompt))
+    async def agenerate_batch(self, prompts, max_tokens=512, temperature=0.75, system_prompt=None):
+        futures = self.submit_batch(list(prompts), max_tokens, temperature, system_prompt)
+        return list(await asyncio.gather(*[asyncio.wrap_future(future) for future in futures]))
+    def stats(self):
+        stats = {
+            'batches_run': self.batches_run,
+            'prompts_run': self.prompts_run,
+            'avg_batch_size': self.prompts_run / self.batches_run if self.batches_run else 0.0,
+            'pending': len(self._pending),
+            'batch_window_ms': self.batch_window_ms
+        }
+        speculative_stats = getattr(self.llm, 'speculative_stats', None)
+        if speculative_stats is not None:
+            stats['speculative'] = speculative_stats()
+        return stats
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        if self._worker is not None:
+            self._worker.join()
+            self._worker = None
+    def _ensure_worker(self):
+        if self._worker is None or not self._worker.is_alive():
+            self._worker = threading.Thread(
+                target=self._run,
+                name="omnirag-generation",
+                daemon=True
+            )
+            self._worker.start()
+    def _wait_for_window(self):
+        """Hold the first request for up to batch_window_ms so concurrent callers can join its batch"""
+        if self.batch_window_ms <= 0:
+            return
+        deadline = time.monotonic() + self.batch_window_ms / 1000.0
+        while len(self._pending) < self.max_batch_size and not self._closed:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return
+            self._cond.wait(remaining)
+    def _next_batch(self):
+        """Pop up to max_batch_size pending requests sharing the first one's generation params"""
+        params = self._pending[0][1]
+        batch = []
+        remaining = deque()
+        while self._pending:
+            request = self._pending.popleft()
+            if request[1] == params and len(batch) < self.max_batch_size:
+                batch.append(request)
+            else:
+                remaining.append(request)
+        self._pending = remaining
+        return params, batch
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._pending and not self._closed:
+                    self._cond.wait()
+                if not self._pending:
+                    return
+                self._wait_for_window()
+                params, batch = self._next_batch()
+            batch = [request for request in batch if request[2].set_running_or_notify_cancel()]
+            if not batch:
+                continue
+            max_tokens, temperature, system_prompt, sink = params
+            if sink is not None:
+                self._run_stream(batch[0], sink)
+                continue
+            start = time.perf_counter()
+            try:
+                responses = self.llm.generate_batch(
+                    [prompt for prompt, _, _, _ in batch],
+                    max_tokens=max_tokens,
+                    temperature=temperature,
+                    system_prompt=system_prompt
+                )
+            except Exception as e:
+                for _, _, future, _ in batch:
+                    future.set_exception(e)
+                continue
+            self.batches_run += 1
+            self.prompts_run += len(batch)
+            self._credit(batch, time.perf_counter() - start)
+            for (_, _, future, _), response in zip(batch, responses):
+                future.set_result(response)
+    def _credit(self, batch, seconds):
+        usage = getattr(self.llm, 'last_usage', None) or []
+        for i, (_, _, _, (trace, stage)) in enumerate(batch):
+            if trace is not None:
+                tokens = usage[i] if i < len(usage) else {'prompt_tokens': 0, 'completion_tokens': 0}
+                trace.add_llm(stage, tokens['prompt_tokens'], tokens['completion_tokens'], seconds)
+    def _run_stream(self, request, sink):
+        prompt, (max_tokens, temperature, system_prompt, _), future, _ = request
+        start = time.perf_counter()
+        pieces = []
+        try:
+            for text in self.llm.generate_stream(
+                prompt,
+                max_tokens=max_tokens,
+                temperature=temperature,
+                system_prompt=system_prompt
+            ):
+                pieces.append(text)
+                sink.put(text)
+        except Exception as e:
+            future.set_exception(e)
+        else:
+            self.batches_run += 1
+            self.prompts_run += 1
+            self._credit([request], time.perf_counter() - start)
+            future.set_result("".join(pieces).strip())
+        finally:
+            sink.put(None)
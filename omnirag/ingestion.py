@@ -0,0 +1,158 @@
+import os
+import json
+import fnmatch
+import hashlib
+SUPPORTED_EXTENSIONS = ('.txt', '.md', '.json', '.jsonl', '.pdf')
+def iter_text_segments(file_path):
+    """Yield a text or markdown file line by line, or a PDF page by page"""
+    file_ext = os.path.splitext(file_path)[1].lower()
+    if file_ext == '.pdf':
+        from PyPDF2 import PdfReader
+        reader = PdfReader(file_path)
+        for page in reader.pages:
+            yield (page.extract_text() or "") + "\n"
+    else:
+        with open(file_path, 'r', encoding='utf-8') as f:
+            for line in f:
+                yield line
+def iter_word_chunks(segments, chunk_size=500, overlap=0):
+    """Re-cut a stream of text segments into chunks of chunk_size whitespace words,
+    each repeating the last overlap words of the previous one. Chunks may span
+    segment boundaries; only one chunk's worth of words is held."""
+    if not 0 <= overlap < chunk_size:
+        raise ValueError("overlap must be smaller than chunk_size")
+    words = []
+    emitted = False
+    for segment in segments:
+        words.extend(segment.split())
+        while len(words) >= chunk_size:
+            yield ' '.join(words[:chunk_size])
+            del words[:chunk_size - overlap]
+            emitted = True
+    if len(words) > (overlap if emitted else 0):
+        yield ' '.join(words)
+def iter_token_chunks(segments, tokenizer, chunk_size=500, overlap=0):
+    """Like iter_word_chunks, but chunk_size and overlap count tokenizer tokens"""
+    if not 0 <= overlap < chunk_size:
+        raise ValueError("overlap must be smaller than chunk_size")
+    ids = []
+    emitted = False
+    for segment in segments:
+        ids.extend(tokenizer.encode(segment, add_special_tokens=False))
+        while len(ids) >= chunk_size:
+            yield tokenizer.decode(ids[:chunk_size]).strip()
+            del ids[:chunk_size - overlap]
+            emitted = True
+    if len(ids) > (overlap if emitted else 0):
+        text = tokenizer.decode(ids).strip()
+        if text:
+            yield text
+JSON_DELIMITERS = (',', ']', ' ', '\t', '\r', '\n')
+def iter_json_records(file_path, read_size=1 << 16):
+    """Yield the items of a JSON Lines file or of a top-level JSON array one at a
+    time. Any other JSON document is yielded as a single record."""
+    with open(file_path, 'r', encoding='utf-8') as f:
+        if file_path.lower().endswith('.jsonl'):
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+            return
+        # Skip leading whitespace, however many reads it spans, before deciding
+        # between an array and a single document.
+        buffer = ""
+        while True:
+            more = f.read(read_size)
+            buffer = (buffer + more).lstrip()
+            if buffer or not more:
+                break
+        if not buffer.startswith('['):
+            yield json.loads(buffer + f.read())
+            return
+        decoder = json.JSONDecoder()
+        buffer = buffer[1:]
+        while True:
+            buffer = buffer.lstrip().lstrip(',').lstrip()
+            if buffer.startswith(']'):
+                return
+            try:
+                item, end = decoder.raw_decode(buffer)
+            except json.JSONDecodeError:
+                # The item continues past the buffer; read more and retry.
+                more = f.read(read_size)
+                if not more:
+                    raise
+                buffer += more
+                continue
+            # A number or literal is only complete once a delimiter follows it:
+            # "1." cut from "1.5" would otherwise decode as 1.
+            if not isinstance(item, (dict, list, str)) and buffer[end:end + 1] not in JSON_DELIMITERS:
+                more = f.read(read_size)
+                if more:
+                    buffer += more
+                    continue
+            yield item
+            buffer = buffer[end:]
+            if len(buffer) < read_size:
+                buffer += f.read(read_size)
+def iter_file_chunks(file_path, chunk_size=500, overlap=0, tokenizer=None):
+    """Yield the documents of a file: word chunks (token chunks when a tokenizer is
+    given) for text and PDF, one per record for JSON"""
+    file_ext = os.path.splitext(file_path)[1].lower()
+    if file_ext in ('.txt', '.md', '.pdf'):
+        if tokenizer is not None:
+            yield from iter_token_chunks(iter_text_segments(file_path), tokenizer, chunk_size, overlap)
+        else:
+            yield from iter_word_chunks(iter_text_segments(file_path), chunk_size, overlap)
+    elif file_ext in ('.json', '.jsonl'):
+        for record in iter_json_records(file_path):
+            yield str(record)
+    else:
+        raise ValueError(f"Unsupported file type: {file_ext}")
+def iter_batches(items, batch_size):
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+def iter_directory_files(directory, patterns=None, recursive=True):
+    patterns = patterns or ['*' + ext for ext in SUPPORTED_EXTENSIONS]
+    for root, dirs, files in os.walk(directory):
+        dirs.sort()
+        for name in sorted(files):
+            if any(fnmatch.fnmatch(name.lower(), pattern.lower()) for pattern in patterns):
+                yield os.path.join(root, name)
+        if not recursive:
+            break
+def file_sha256(file_path):
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+_worker_tokenizer = None
+def init_worker(tokenizer=None):
+    """Process-pool initializer: hand each worker the chunking tokenizer once"""
+    global _worker_tokenizer
+    _worker_tokenizer = tokenizer
+def extract_file(file_path, chunk_size=500, known_sha256=None, overlap=0, tokenizer=None):
+    """Process-pool worker: hash a file and, unless the hash is known_sha256, chunk it"""
+    stat = os.stat(file_path)
+    sha256 = file_sha256(file_path)
+    entry = {
+        'path': file_path,
+        'mtime_ns': stat.st_mtime_ns,
+        'size': stat.st_size,
+        'sha256': sha256,
+        'chunks': None
+    }
+    if sha256 != known_sha256:
+        entry['chunks'] = list(iter_file_chunks(
+            file_path,
+            chunk_size,
+            overlap,
+            tokenizer if tokenizer is not None else _worker_tokenizer
+        ))
+    return entry
@@ -0,0 +1,178 @@
+import os
+import re
+import hashlib
+import functools
+import threading
+from array import array
+from collections import Counter
+import numpy as np
+# Words, numbers and identifiers such as error codes, versions or file names:
+# inner dots, dashes and underscores are kept, so "ERR_CONN-42" is one term.
+TOKEN_PATTERN = re.compile(r"\w(?:[\w.\-]*\w)?")
+# Function words carry no topic but, being in nearly every chunk, let a
+# question's phrasing ("what is", "how does") outscore its subject.
+STOPWORDS = frozenset("""
+a about an and are as at be been but by can could did do does for from had has have how i if in into is it
+its me my of on or our should so than that the their them then there these they this those to was we were
+what when where which who whom why will with would you your
+""".split())
+def tokenize(text):
+    """Lowercased terms of text, stopwords dropped"""
+    return [term for term in TOKEN_PATTERN.findall(text.lower()) if term not in STOPWORDS]
+@functools.lru_cache(maxsize=1 << 16)
+def term_hash(term):
+    """Stable 64-bit id of a term, the same in every process"""
+    return int.from_bytes(hashlib.blake2b(term.encode('utf-8'), digest_size=8).digest(), 'little')
+class LexicalIndex:
+    """BM25 inverted index kept in flat numpy arrays: sorted 64-bit term hashes
+    with CSR offsets into parallel doc-id and term-frequency postings, plus
+    per-document lengths. Terms are hashed rather than stored, so there is no
+    Python vocabulary to hold in memory. Added documents are buffered and
+    merged into the arrays before the next search. Saved arrays can be loaded
+    memory-mapped, like the DocumentStore."""
+    FILES = ('terms', 'offsets', 'postings', 'tfs', 'doc_lengths')
+    FILE_PREFIX = "lexical_"
+    def __init__(self, k1=1.2, b=0.75):
+        self.k1 = k1
+        self.b = b
+        self._terms = np.zeros(0, dtype=np.uint64)
+        self._offsets = np.zeros(1, dtype=np.int64)
+        self._postings = np.zeros(0, dtype=np.int32)
+        self._tfs = np.zeros(0, dtype=np.uint16)
+        self._doc_lengths = np.zeros(0, dtype=np.int32)
+        self._total_length = 0
+        self._reset_pending()
+        self._lock = threading.Lock()
+    def __len__(self):
+        return len(self._doc_lengths) + len(self._pending_lengths)
+    def add(self, documents):
+        """Index documents; they get the ids following the documents already indexed"""
+        with self._lock:
+            doc_id = len(self)
+            for text in documents:
+                counts = Counter(tokenize(text))
+                for term, tf in counts.items():
+                    self._pending_terms.append(term_hash(term))
+                    self._pending_docs.append(doc_id)
+                    self._pending_tfs.append(min(tf, 65535))
+                self._pending_lengths.append(sum(counts.values()))
+                doc_id += 1
+    def compact(self):
+        """Merge buffered documents into the postings arrays"""
+        with self._lock:
+            if not len(self._pending_lengths):
+                return
+            terms = np.concatenate([
+                np.repeat(self._terms, np.diff(self._offsets)),
+                np.frombuffer(self._pending_terms, dtype=np.uint64)
+            ])
+            postings = np.concatenate([self._postings, np.frombuffer(self._pending_docs, dtype=np.int32)])
+            tfs = np.concatenate([self._tfs, np.frombuffer(self._pending_tfs, dtype=np.uint16)])
+            lengths = np.frombuffer(self._pending_lengths, dtype=np.int32)
+            order = np.lexsort((postings, terms))
+            terms = terms[order]
+            self._terms, starts = np.unique(terms, return_index=True)
+            self._offsets = np.append(starts, len(terms)).astype(np.int64)
+            self._postings = postings[order]
+            self._tfs = tfs[order]
+            self._doc_lengths = np.concatenate([self._doc_lengths, lengths])
+            self._total_length += int(lengths.sum())
+            self._reset_pending()
+    def search(self, query, top_k=5):
+        """BM25 top_k as [(doc_id, score)], best first; documents sharing no term are not returned"""
+        self.compact()
+        with self._lock:
+            terms, offsets, postings, tfs, doc_lengths = (
+                self._terms, self._offsets, self._postings, self._tfs, self._doc_lengths
+            )
+            n_docs = len(doc_lengths)
+            avg_length = self._total_length / n_docs if n_docs else 0.0
+        if not n_docs or not len(terms):
+            return []
+        positions = self._positions(terms, self._query_hashes(query))
+        doc_parts = []
+        score_parts = []
+        for position in positions[positions >= 0]:
+            start, end = offsets[position], offsets[position + 1]
+            docs = postings[start:end]
+            tf = tfs[start:end].astype(np.float32)
+            idf = self._idf(n_docs, end - start)
+            norm = self.k1 * (1.0 - self.b + self.b * doc_lengths[docs] / max(avg_length, 1e-9))
+            doc_parts.append(docs)
+            score_parts.append(idf * tf * (self.k1 + 1.0) / (tf + norm))
+        if not doc_parts:
+            return []
+        docs = np.concatenate(doc_parts)
+        scores = np.concatenate(score_parts)
+        # Common terms touch many documents: then a dense accumulator is
+        # cheaper than sorting the matched ids.
+        if len(docs) > n_docs // 8:
+            totals = np.bincount(docs, weights=scores, minlength=n_docs)
+            candidates = np.flatnonzero(totals)
+            totals = totals[candidates]
+        else:
+            candidates, inverse = np.unique(docs, return_inverse=True)
+            totals = np.bincount(inverse, weights=scores)
+        k = min(top_k, len(candidates))
+        best = np.argpartition(-totals, k - 1)[:k]
+        best = best[np.argsort(-totals[best], kind='stable')]
+        return [(int(candidates[i]), float(totals[i])) for i in best]
+    def reference_score(self, query):
+        """BM25 score of an average-length document holding every query term once
+        (terms missing from the index count at their highest idf): the scale on
+        which a search score of query is strong or weak"""
+        self.compact()
+        with self._lock:
+            terms, offsets, n_docs = self._terms, self._offsets, len(self._doc_lengths)
+        if not n_docs:
+            return 0.0
+        positions = self._positions(terms, self._query_hashes(query))
+        dfs = np.where(positions >= 0, offsets[positions + 1] - offsets[np.maximum(positions, 0)], 0)
+        return float(self._idf(n_docs, dfs).sum())
+    def stats(self):
+        self.compact()
+        with self._lock:
+            return {
+                'documents': len(self._doc_lengths),
+                'terms': len(self._terms),
+                'postings': len(self._postings),
+                'bytes': sum(values.nbytes for values in self._arrays())
+            }
+    def save(self, path):
+        self.compact()
+        os.makedirs(path, exist_ok=True)
+        with self._lock:
+            for name, values in zip(self.FILES, self._arrays()):
+                file_path = os.path.join(path, f"{self.FILE_PREFIX}{name}.npy")
+                with open(file_path + ".tmp", 'wb') as f:
+                    np.save(f, values)
+                os.replace(file_path + ".tmp", file_path)
+    @classmethod
+    def exists(cls, path):
+        return all(os.path.exists(os.path.join(path, f"{cls.FILE_PREFIX}{name}.npy")) for name in cls.FILES)
+    @classmethod
+    def load(cls, path, mmap_mode=True, k1=1.2, b=0.75):
+        index = cls(k1=k1, b=b)
+        index._terms, index._offsets, index._postings, index._tfs, index._doc_lengths = (
+            np.load(os.path.join(path, f"{cls.FILE_PREFIX}{name}.npy"), mmap_mode='r' if mmap_mode else None)
+            for name in cls.FILES
+        )
+        index._total_length = int(index._doc_lengths.sum())
+        return index
+    def _query_hashes(self, query):
+        return np.array(sorted({term_hash(term) for term in tokenize(query)}), dtype=np.uint64)
+    def _positions(self, terms, hashes):
+        """Index of each hash in terms, -1 where it is not indexed"""
+        if not len(terms):
+            return np.full(len(hashes), -1, dtype=np.int64)
+        positions = np.minimum(np.searchsorted(terms, hashes), len(terms) - 1)
+        return np.where(terms[positions] == hashes, positions, -1)
+    def _idf(self, n_docs, df):
+        return np.log(1.0 + (n_docs - df + 0.5) / (df + 0.5))
+    def _arrays(self):
+        return (self._terms, self._offsets, self._postings, self._tfs, self._doc_lengths)
+    def _reset_pending(self):
+        self._pending_terms = array('Q')
+        self._pending_docs = array('i')
+        self._pending_tfs = array('H')
+        self._pending_lengths = array('i')
@@ -1,7 +1,77 @@
+import csv
+import json
 class LiquidAnalyzer:
-    def __init__(self, llm_client):
+    LEVELS = ('beginner', 'intermediate', 'expert')
+    # Static part of the classification prompt. It comes before the question so
+    # the LLM client can keep its KV cache and only prefill the question.
+    CLASSIFICATION_PREFIX = (
+        "You are an expert at analyzing user questions to determine their expertise level.\n\n"
+        "TASK: Classify the user's expertise level based on their question.\n\n"
+        "CLASSIFICATION CRITERIA:\n\n"
+        "**BEGINNER** - User is new to the topic:\n"
+        "- Uses simple, everyday language\n"
+        "- Asks 'what is', 'how do I', 'explain' questions\n"
+        "- Seeks basic definitions or introductions\n"
+        "- Shows no assumed prior knowledge\n"
+        "- Examples:\n"
+        "  * What is machine learning?\n"
+        "  * How do I start learning Python?\n\n"
+        "**INTERMEDIATE** - User has some knowledge:\n"
+        "- Uses some technical terms correctly\n"
+        "- Asks about comparisons, differences, or best practices\n"
+        "- Understands basics but seeks deeper understanding\n"
+        "- Examples:\n"
+        "  * What's the difference between supervised and unsupervised learning?\n"
+        "  * When should I use a list vs a dictionary in Python?\n\n"
+        "**EXPERT** - User has advanced knowledge:\n"
+        "- Uses precise technical terminology\n"
+        "- Asks about optimization, architecture, or implementation details\n"
+        "- Discusses performance, scalability, or edge cases\n"
+        "- Examples:\n"
+        "  * How can I optimize my BERT model's inference latency?\n"
+        "  * What's the best architecture for distributed training?\n\n"
+        "ANALYSIS STEPS:\n"
+        "1. Identify technical terms used\n"
+        "2. Assess assumed background knowledge\n"
+        "3. Evaluate question complexity\n"
+        "4. Determine appropriate level\n\n"
+        "OUTPUT FORMAT (respond with ONLY this format):\n"
+        "LEVEL: [beginner/intermediate/expert]\n"
+        "CONFIDENCE: [high/medium/low]\n"
+        "REASON: [one sentence explaining why]\n\n"
+    )
+    def __init__(self, llm_client, stage_cache=None, cascade_threshold=0.5):
         self.llm = llm_client  
-    def analyze(self, query):
+        self.stage_cache = stage_cache
+        # Keyword answers whose margin (top minus runner-up score, as a share
+        # of the total) reaches this are accepted without asking the LLM.
+        # None always asks the LLM.
+        self.cascade_threshold = cascade_threshold
+        self.keyword_accepted = 0
+        self.llm_calls = 0
+        self.llm.register_prefix(self.CLASSIFICATION_PREFIX)
+    def analyze(self, query, use_llm=True):
+        """Classify query; with use_llm=False the keyword scores decide even when
+        their margin is below the cascade threshold"""
+        if self.stage_cache is not None:
+            cached = self.stage_cache.get('liquid', query)
+            if cached is not None:
+                return dict(cached)
+        result = self._analyze(query, use_llm)
+        if self.stage_cache is not None and result['method'] == 'llm':
+            self.stage_cache.set('liquid', query, dict(result))
+        return result
+    def _analyze(self, query, use_llm=True):
+        if self.cascade_threshold is not None or not use_llm:
+            result = self._keyword_analysis(query)
+            if not use_llm or result['margin'] >= self.cascade_threshold:
+                self.keyword_accepted += 1
+                result['method'] = 'keyword'
+                print(f"[LIQUID-KEYWORD] Level: {result['complexity']} | Margin: {result['margin']:.2f}")
+                return result
+        return self._llm_analysis(query)
+    def _llm_analysis(self, query):
+        self.llm_calls += 1
         prompt = self._create_classification_prompt(query)
         try:
             response = self.llm.generate(
@@ -23,45 +93,7 @@ class LiquidAnalyzer:
             result['method'] = 'fallback'
             return result
     def _create_classification_prompt(self, query):
-        prompt = (
-            "You are an expert at analyzing user questions to determine their expertise level.\n\n"
-            "TASK: Classify the user's expertise level based on their question.\n\n"
-            f"QUESTION: \"{query}\"\n\n"
-            "CLASSIFICATION CRITERIA:\n\n"
-            "**BEGINNER** - User is new to the topic:\n"
-            "- Uses simple, everyday language\n"
-            "- Asks 'what is', 'how do I', 'explain' questions\n"
-            "- Seeks basic definitions or introductions\n"
-            "- Shows no assumed prior knowledge\n"
-            "- Examples:\n"
-            "  * What is machine learning?\n"
-            "  * How do I start learning Python?\n\n"
-            "**INTERMEDIATE** - User has some knowledge:\n"
-            "- Uses some technical terms correctly\n"
-            "- Asks about comparisons, differences, or best practices\n"
-            "- Understands basics but seeks deeper understanding\n"
-            "- Examples:\n"
-            "  * What's the difference between supervised and unsupervised learning?\n"
-            "  * When should I use a list vs a dictionary in Python?\n\n"
-            "**EXPERT** - User has advanced knowledge:\n"
-            "- Uses precise technical terminology\n"
-            "- Asks about optimization, architecture, or implementation details\n"
-            "- Discusses performance, scalability, or edge cases\n"
-            "- Examples:\n"
-            "  * How can I optimize my BERT model's inference latency?\n"
-            "  * What's the best architecture for distributed training?\n\n"
-            "ANALYSIS STEPS:\n"
-            "1. Identify technical terms used\n"
-            "2. Assess assumed background knowledge\n"
-            "3. Evaluate question complexity\n"
-            "4. Determine appropriate level\n\n"
-            "OUTPUT FORMAT (respond with ONLY this format):\n"
-            "LEVEL: [beginner/intermediate/expert]\n"
-            "CONFIDENCE: [high/medium/low]\n"
-            "REASON: [one sentence explaining why]\n\n"
-            "Now analyze the question above:"
-        )
-        return prompt
+        return self.CLASSIFICATION_PREFIX + f"QUESTION: \"{query}\"\n\nNow analyze the question above:"
     def _parse_llm_response(self, response, query):
         response_lower = response.lower().strip()
         level = 'intermediate'
@@ -104,7 +136,71 @@ class LiquidAnalyzer:
             'query': query,
             'raw_response': response
         }
+    def cascade_stats(self):
+        total = self.keyword_accepted + self.llm_calls
+        return {
+            'threshold': self.cascade_threshold,
+            'keyword_accepted': self.keyword_accepted,
+            'llm_calls': self.llm_calls,
+            'llm_calls_avoided_rate': self.keyword_accepted / total if total else 0.0
+        }
+    def calibrate(self, labelled_path, thresholds=None):
+        """Report, per cascade threshold, how often the cascade agrees with the labels
+        of a query file and what fraction of LLM calls it avoids. The file is JSON
+        Lines with "query" and "level" fields, or a CSV with query,level columns."""
+        if thresholds is None:
+            thresholds = [round(0.1 * i, 1) for i in range(11)]
+        examples = self._load_labelled(labelled_path)
+        if not examples:
+            raise ValueError(f"No labelled queries found in {labelled_path}")
+        rows = []
+        for query, label in examples:
+            keyword = self._keyword_analysis(query)
+            llm = self._llm_analysis(query)
+            rows.append((label, keyword['complexity'], keyword['margin'], llm['complexity']))
+        report = [{
+            'threshold': None,
+            'agreement': sum(label == llm for label, _, _, llm in rows) / len(rows),
+            'llm_calls_avoided': 0.0,
+            'keyword_accuracy_when_accepted': None
+        }]
+        for threshold in thresholds:
+            accepted = [row for row in rows if row[2] >= threshold]
+            predictions = [keyword if margin >= threshold else llm for _, keyword, margin, llm in rows]
+            report.append({
+                'threshold': threshold,
+                'agreement': sum(label == pred for (label, _, _, _), pred in zip(rows, predictions)) / len(rows),
+                'llm_calls_avoided': len(accepted) / len(rows),
+                'keyword_accuracy_when_accepted': (
+                    sum(label == keyword for label, keyword, _, _ in accepted) / len(accepted)
+                    if accepted else None
+                )
+            })
+        print(f"Calibration on {len(rows)} labelled queries")
+        print(f"{'threshold':>10} {'agreement':>10} {'LLM avoided':>12}")
+        for row in report:
+            threshold = 'LLM only' if row['threshold'] is None else f"{row['threshold']:.2f}"
+            print(f"{threshold:>10} {row['agreement']:>10.3f} {row['llm_calls_avoided']:>12.3f}")
+        return report
+    def _load_labelled(self, labelled_path):
+        examples = []
+        with open(labelled_path, 'r', encoding='utf-8') as f:
+            if labelled_path.endswith(('.jsonl', '.json')):
+                for line in f:
+                    if line.strip():
+                        record = json.loads(line)
+                        examples.append((record['query'], record['level'].strip().lower()))
+            else:
+                for row in csv.reader(f):
+                    if len(row) >= 2 and row[1].strip().lower() in self.LEVELS:
+                        examples.append((row[0], row[1].strip().lower()))
+        return examples
     def _fallback_analysis(self, query):
+        result = self._keyword_analysis(query)
+        print(f"[LIQUID-FALLBACK] Level: {result['complexity']} | Confidence: {result['confidence']:.2f}")
+        print(f"[LIQUID-FALLBACK] {result['reasoning']}")
+        return result
+    def _keyword_analysis(self, query):
         query_lower = query.lower()
         beginner_score = 0
         intermediate_score = 0
@@ -204,23 +300,25 @@ class LiquidAnalyzer:
                     expert_score += 2
                 break
         total_score = beginner_score + intermediate_score + expert_score
+        scores = {
+            'beginner': beginner_score,
+            'intermediate': intermediate_score,
+            'expert': expert_score
+        }
         if total_score == 0:
             level = 'intermediate'
             confidence = 0.5
+            margin = 0.0
         else:
-            scores = {
-                'beginner': beginner_score,
-                'intermediate': intermediate_score,
-                'expert': expert_score
-            }
             level = max(scores, key=scores.get)
             confidence = scores[level] / total_score
+            runner_up = max(score for name, score in scores.items() if name != level)
+            margin = (scores[level] - runner_up) / total_score
         reasoning = f"Keyword analysis: B={beginner_score}, I={intermediate_score}, E={expert_score}"
-        print(f"[LIQUID-FALLBACK] Level: {level} | Confidence: {confidence:.2f}")
-        print(f"[LIQUID-FALLBACK] {reasoning}")
         return {
             'complexity': level,
             'confidence': confidence,
+            'margin': margin,
             'reasoning': reasoning,
             'query': query,
             'scores': scores
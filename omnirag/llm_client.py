@@ -1,49 +1,569 @@
-from transformers import AutoTokenizer, AutoModelForCausalLM
-import torch
+from collections import OrderedDict
+import copy
+import hashlib
+import os
+import re
+import threading
+import time
+import warnings
+from omnirag import tracing
+from omnirag.model_registry import registry as model_registry
+# Forward passes of a draft model made by the generate call running in this thread.
+_draft_calls = threading.local()
+def _count_draft_call(module, args, output):
+    if getattr(_draft_calls, 'active', False):
+        _draft_calls.count += 1
 class LLMClient:
-    def __init__(self, model_name="Qwen/Qwen2.5-0.5B-Instruct", use_4bit=False):
+    """Wrapper around a Hugging Face chat/seq2seq model. torch and transformers are
+    imported, and the tokenizer and the model loaded, only when first needed;
+    the tokenizer alone never loads the model weights. With shared=True the
+    weights come from the process-wide model registry, so clients of the same
+    model, dtype and quantization hold one copy; release() returns it.
+
+    With a draft_model (a smaller model sharing the tokenizer), single-prompt
+    Qwen calls of at least draft_min_tokens new tokens use assisted generation:
+    the draft proposes num_assistant_tokens tokens per step and the model
+    verifies them in one forward pass. Shorter calls keep the prefix cache,
+    which assisted calls do not use. Every draft_probe_interval-th eligible
+    call runs without the draft, so speculative_stats() can compare the two
+    throughputs.
+
+    On CPU, cpu_mode="int8" applies dynamic int8 quantization to the linear
+    layers and cpu_mode="bf16" loads bfloat16 weights where the CPU supports
+    them (otherwise float32 is kept). num_threads and num_interop_threads set
+    torch's thread pools, compile_model wraps the forward pass in
+    torch.compile, and quantized_cache_dir keeps int8 models on disk so later
+    starts skip the conversion."""
+    CPU_MODES = (None, "int8", "bf16")
+    def __init__(self, model_name="Qwen/Qwen2.5-0.5B-Instruct", use_4bit=False, batch_size=8,
+                 prefix_cache_size=8, shared=True, draft_model=None, num_assistant_tokens=5,
+                 assistant_schedule="heuristic", draft_min_tokens=128, draft_probe_interval=20,
+                 cpu_mode=None, num_threads=None, num_interop_threads=None, compile_model=False,
+                 quantized_cache_dir=None):
+        if cpu_mode not in self.CPU_MODES:
+            raise ValueError(f"Unknown cpu_mode: {cpu_mode} (expected int8, bf16 or None)")
         self.model_name = model_name
-        self.device = "cuda" if torch.cuda.is_available() else "cpu"
+        self.use_4bit = use_4bit
+        self.batch_size = batch_size
         self.is_qwen = "qwen" in model_name.lower()
         self.is_t5 = "t5" in model_name.lower()
-        print(f"   Loading {model_name}...")
-        print(f"   Device: {self.device}")
-        print(f"   Model Type: {'Qwen' if self.is_qwen else 'T5'}")
-        self.tokenizer = AutoTokenizer.from_pretrained(
+        self.shared = shared
+        self.cpu_mode = cpu_mode
+        self.num_threads = num_threads
+        self.num_interop_threads = num_interop_threads
+        self.compile_model = compile_model
+        self.quantized_cache_dir = quantized_cache_dir
+        self._effective_cpu_mode = False
+        self._model_key = None
+        self._device = None
+        self._tokenizer = None
+        self._model = None
+        self._tokenizer_lock = threading.Lock()
+        self._model_lock = threading.Lock()
+        self.draft_model_name = draft_model
+        self.num_assistant_tokens = num_assistant_tokens
+        self.assistant_schedule = assistant_schedule
+        self.draft_min_tokens = draft_min_tokens
+        self.draft_probe_interval = draft_probe_interval
+        self._draft = None
+        self._draft_key = None
+        self._draft_lock = threading.Lock()
+        # Why the draft is not used (incompatible tokenizer, load failure), if so.
+        self.draft_disabled = None
+        self._spec_lock = threading.Lock()
+        self._spec_calls = 0
+        self._spec_stats = {
+            'assisted': {'calls': 0, 'tokens': 0, 'seconds': 0.0, 'rounds': 0, 'drafted': 0, 'accepted': 0},
+            'plain': {'calls': 0, 'tokens': 0, 'seconds': 0.0}
+        }
+        # KV caches of static prompt openings (chat-template system portion plus
+        # a registered prefix), most recently used last.
+        self.prefix_cache_size = prefix_cache_size
+        self.prefixes = []
+        self._prefix_cache = OrderedDict()
+        self._template_heads = {}
+        self._prefix_lock = threading.Lock()
+        self.prefix_hits = 0
+        self.prefix_misses = 0
+        self.prefix_tokens_reused = 0
+        # Why the prefix cache is off (a transformers without croppable KV
+        # caches), if so.
+        self.prefix_cache_disabled = None
+        # Token counts of the prompts in the most recent generate/generate_batch
+        # call, one {'prompt_tokens', 'completion_tokens'} dict per prompt.
+        self.last_usage = []
+    @property
+    def device(self):
+        if self._device is None:
+            import torch
+            self._device = "cuda" if torch.cuda.is_available() else "cpu"
+        return self._device
+    @property
+    def tokenizer(self):
+        if self._tokenizer is None:
+            with self._tokenizer_lock:
+                if self._tokenizer is None:
+                    self._tokenizer = self._load_tokenizer()
+        return self._tokenizer
+    @tokenizer.setter
+    def tokenizer(self, tokenizer):
+        self._tokenizer = tokenizer
+    def new_tokenizer(self):
+        """A tokenizer instance separate from the one generation uses, for
+        counting tokens on other threads"""
+        return self._load_tokenizer()
+    @property
+    def model(self):
+        if self._model is None:
+            with self._model_lock:
+                if self._model is None:
+                    if self.shared:
+                        self._model = model_registry.acquire(self.model_key, self._load_model)
+                        self._model_key = self.model_key
+                    else:
+                        self._model = self._load_model()
+        return self._model
+    @model.setter
+    def model(self, model):
+        self._model = model
+    @property
+    def model_key(self):
+        """Registry key of the weights this client loads: (kind, name, dtype, quantization)"""
+        return self._weights_key(self.model_name, self.use_4bit)
+    def _weights_key(self, model_name, use_4bit):
+        if self.device == "cuda":
+            return ('llm', model_name, "float16", "4bit" if use_4bit else None)
+        cpu_mode = self.effective_cpu_mode
+        return (
+            'llm',
             model_name,
+            "bfloat16" if cpu_mode == "bf16" else "float32",
+            "int8-dynamic" if cpu_mode == "int8" else None
+        )
+    @property
+    def effective_cpu_mode(self):
+        """cpu_mode as applied on this machine: None on CUDA or when the mode is unsupported"""
+        if self._effective_cpu_mode is False:
+            import torch
+            mode = self.cpu_mode if self.device == "cpu" else None
+            if mode == "bf16":
+                is_supported = getattr(torch.ops.mkldnn, '_is_mkldnn_bf16_supported', None)
+                if is_supported is None or not is_supported():
+                    print(" bfloat16 is not supported on this CPU; keeping float32")
+                    mode = None
+            elif mode == "int8" and not hasattr(getattr(torch, 'ao', None), 'quantization'):
+                print(" Dynamic int8 quantization is not available in this torch build; keeping float32")
+                mode = None
+            self._effective_cpu_mode = mode
+        return self._effective_cpu_mode
+    @property
+    def is_loaded(self):
+        return self._model is not None
+    def load(self):
+        """Load the tokenizer and the model now instead of on the first generation"""
+        return self.tokenizer, self.model
+    def release(self):
+        """Drop this client's reference to the model; the weights are freed once no
+        other client holds them. The model is loaded again if used afterwards."""
+        with self._model_lock:
+            if self._model is None:
+                return
+            freed = model_registry.release(self._model_key) if self._model_key is not None else True
+            self._model = None
+            self._model_key = None
+        self.clear_prefix_cache()
+        with self._draft_lock:
+            if self._draft_key is not None:
+                model_registry.release(self._draft_key)
+            self._draft = None
+            self._draft_key = None
+        if freed and self.device == "cuda":
+            import torch
+            torch.cuda.empty_cache()
+    def _load_tokenizer(self):
+        from transformers import AutoTokenizer
+        tokenizer = AutoTokenizer.from_pretrained(
+            self.model_name,
             trust_remote_code=True
         )
-        if use_4bit and self.device == "cuda":
+        # Batched generation needs a pad token and left padding so that every
+        # prompt ends right where its new tokens start.
+        if tokenizer.pad_token is None:
+            tokenizer.pad_token = tokenizer.eos_token
+        tokenizer.padding_side = "left"
+        return tokenizer
+    def _load_model(self, model_name=None, use_4bit=None):
+        import torch
+        from transformers import AutoModelForCausalLM
+        model_name = model_name or self.model_name
+        use_4bit = self.use_4bit if use_4bit is None else use_4bit
+        print(f"   Loading {model_name}...")
+        print(f"   Device: {self.device}")
+        print(f"   Model Type: {'Qwen' if self.is_qwen else 'T5'}")
+        self._configure_threads()
+        cpu_mode = self.effective_cpu_mode
+        if cpu_mode:
+            print(f"   CPU Mode: {cpu_mode}")
+        cache_path = self._quantized_cache_path(model_name) if cpu_mode == "int8" else None
+        if cache_path and os.path.exists(cache_path):
+            print(f"   Quantized weights: {cache_path}")
+            model = self._load_int8_cache(model_name, cache_path)
+        elif use_4bit and self.device == "cuda":
             from transformers import BitsAndBytesConfig
             quantization_config = BitsAndBytesConfig(
                 load_in_4bit=True,
                 bnb_4bit_compute_dtype=torch.float16
             )
-            self.model = AutoModelForCausalLM.from_pretrained(
+            model = AutoModelForCausalLM.from_pretrained(
                 model_name,
                 quantization_config=quantization_config,
                 device_map="auto",
                 trust_remote_code=True
             )
         else:
-            self.model = AutoModelForCausalLM.from_pretrained(
+            model = AutoModelForCausalLM.from_pretrained(
                 model_name,
-                torch_dtype=torch.float16 if self.device == "cuda" else torch.float32,
+                torch_dtype=(
+                    torch.float16 if self.device == "cuda" else
+                    torch.bfloat16 if cpu_mode == "bf16" else torch.float32
+                ),
                 device_map="auto" if self.device == "cuda" else None,
                 trust_remote_code=True
             )
             if self.device == "cpu":
-                self.model = self.model.to(self.device)
-    def generate(self, prompt, max_tokens=512, temperature=0.75, system_prompt=None):
+                model = model.to(self.device)
+            if cpu_mode == "int8":
+                with warnings.catch_warnings():
+                    # torch.ao.quantization warns that it is deprecated in
+                    # favour of torchao; the eager API still works.
+                    warnings.simplefilter("ignore")
+                    model = torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+                if cache_path:
+                    os.makedirs(self.quantized_cache_dir, exist_ok=True)
+                    tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+                    torch.save(self._int8_state_dict(model), tmp_path)
+                    os.replace(tmp_path, cache_path)
+        if self.compile_model:
+            model.forward = torch.compile(model.forward, dynamic=True)
+        return model
+    def _load_int8_cache(self, model_name, cache_path):
+        """Rebuild an int8 model from a cached state dict without loading the float weights"""
+        import torch
+        from transformers import AutoConfig, AutoModelForCausalLM, GenerationConfig
         try:
-            if self.is_qwen:
-                return self._generate_qwen(prompt, max_tokens, temperature, system_prompt)
-            else:
-                return self._generate_t5(prompt, max_tokens, temperature)
+            from transformers.initialization import no_init_weights
+        except ImportError:
+            from transformers.modeling_utils import no_init_weights
+        config = AutoConfig.from_pretrained(model_name, trust_remote_code=True)
+        with no_init_weights():
+            model = AutoModelForCausalLM.from_config(config, torch_dtype=torch.float32, trust_remote_code=True)
+        state = torch.load(cache_path, weights_only=True)
+        quantized = {}
+        for key in [key for key in state if key.endswith(".int8_weight")]:
+            name = key[:-len(".int8_weight")]
+            weight = torch._make_per_tensor_quantized_tensor(
+                state.pop(key),
+                float(state.pop(f"{name}.int8_scale")),
+                int(state.pop(f"{name}.int8_zero_point"))
+            )
+            quantized[name] = (weight, state.pop(f"{name}.int8_bias", None))
+        # Everything but the linear layers, whose (uninitialised) float
+        # weights are then swapped for quantized ones.
+        model.load_state_dict(state, strict=False)
+        for name, (weight, bias) in quantized.items():
+            parent_name, _, child_name = name.rpartition(".")
+            parent = model.get_submodule(parent_name)
+            child = getattr(parent, child_name)
+            linear = torch.ao.nn.quantized.dynamic.Linear(
+                child.in_features,
+                child.out_features,
+                bias_=bias is not None,
+                dtype=torch.qint8
+            )
+            linear.set_weight_bias(weight, bias)
+            setattr(parent, child_name, linear)
+        try:
+            model.generation_config = GenerationConfig.from_pretrained(model_name)
+        except OSError:
+            pass
+        return model.eval()
+    def _int8_state_dict(self, model):
+        """State dict of a dynamically quantized model in plain tensors. Quantized
+        tensors pickle their qscheme as a bare name, which pickle resolves by
+        probing every loaded module, so their integer values, scale and zero
+        point are stored instead."""
+        import torch
+        state = {
+            key: value for key, value in model.state_dict().items()
+            if "_packed_params" not in key
+        }
+        for name, module in model.named_modules():
+            if isinstance(module, torch.ao.nn.quantized.dynamic.Linear):
+                weight, bias = module.weight(), module.bias()
+                state[f"{name}.int8_weight"] = weight.int_repr()
+                state[f"{name}.int8_scale"] = torch.tensor(weight.q_scale(), dtype=torch.float64)
+                state[f"{name}.int8_zero_point"] = torch.tensor(weight.q_zero_point())
+                if bias is not None:
+                    state[f"{name}.int8_bias"] = bias.detach()
+        return state
+    def _configure_threads(self):
+        import torch
+        if self.num_threads:
+            torch.set_num_threads(self.num_threads)
+        if self.num_interop_threads and torch.get_num_interop_threads() != self.num_interop_threads:
+            try:
+                torch.set_num_interop_threads(self.num_interop_threads)
+            except RuntimeError as e:
+                # Only possible before the first inter-op parallel work in the process.
+                print(f" Could not set inter-op threads: {e}")
+    def _quantized_cache_path(self, model_name):
+        """Cache file of the int8 model, keyed by its source revision and the library versions"""
+        if not self.quantized_cache_dir:
+            return None
+        import torch
+        import transformers
+        if os.path.isdir(model_name):
+            revision = max(
+                (os.stat(os.path.join(root, name)).st_mtime_ns for root, _, files in os.walk(model_name) for name in files),
+                default=0
+            )
+        else:
+            from transformers import AutoConfig
+            revision = getattr(AutoConfig.from_pretrained(model_name, trust_remote_code=True), '_commit_hash', None)
+        digest = hashlib.sha256(
+            repr((model_name, revision, torch.__version__, transformers.__version__)).encode('utf-8')
+        ).hexdigest()[:16]
+        name = re.sub(r"[^A-Za-z0-9_.-]+", "_", model_name).strip("_")
+        return os.path.join(self.quantized_cache_dir, f"{name}-int8-{digest}.pt")
+    @property
+    def draft(self):
+        """The draft model, loaded on first use; None without one or when it cannot be used"""
+        if self._draft is None and self.draft_model_name and self.draft_disabled is None and self.is_qwen:
+            with self._draft_lock:
+                if self._draft is None and self.draft_disabled is None:
+                    self._draft = self._load_draft()
+        return self._draft
+    def _load_draft(self):
+        from transformers import AutoTokenizer
+        try:
+            draft_tokenizer = AutoTokenizer.from_pretrained(self.draft_model_name, trust_remote_code=True)
+        except Exception as e:
+            self.draft_disabled = f"draft tokenizer failed to load: {e}"
+            print(f" Draft model disabled: {self.draft_disabled}")
+            return None
+        # Assisted generation compares token ids, so the draft must share the
+        # tokenizer; otherwise generation falls back to plain decoding.
+        if draft_tokenizer.get_vocab() != self.tokenizer.get_vocab():
+            self.draft_disabled = f"{self.draft_model_name} does not share the tokenizer of {self.model_name}"
+            print(f" Draft model disabled: {self.draft_disabled}")
+            return None
+        key = self._weights_key(self.draft_model_name, False)
+        draft = model_registry.acquire(key, lambda: self._load_model(self.draft_model_name, use_4bit=False))
+        if draft is self.model or draft.config.vocab_size != self.model.config.vocab_size:
+            model_registry.release(key)
+            self.draft_disabled = (
+                f"{self.draft_model_name} is the model itself" if draft is self.model else
+                f"{self.draft_model_name} has {draft.config.vocab_size} embedding rows "
+                f"but {self.model_name} has {self.model.config.vocab_size}"
+            )
+            print(f" Draft model disabled: {self.draft_disabled}")
+            return None
+        draft.generation_config.num_assistant_tokens = self.num_assistant_tokens
+        draft.generation_config.num_assistant_tokens_schedule = self.assistant_schedule
+        if not getattr(draft, '_omnirag_draft_hook', False):
+            # One hook for the model's lifetime: it is shared between clients
+            # and threads, so each generate call counts through a thread-local.
+            draft.register_forward_hook(_count_draft_call)
+            draft._omnirag_draft_hook = True
+        self._draft_key = key
+        return draft
+    def speculative_stats(self):
+        """Assisted-generation acceptance and throughput against the plain-decoding probes"""
+        with self._spec_lock:
+            assisted = dict(self._spec_stats['assisted'])
+            plain = dict(self._spec_stats['plain'])
+        for row in (assisted, plain):
+            row['tokens_per_second'] = row['tokens'] / row['seconds'] if row['seconds'] else 0.0
+        assisted['acceptance_rate'] = assisted['accepted'] / assisted['drafted'] if assisted['drafted'] else 0.0
+        assisted['tokens_per_round'] = assisted['tokens'] / assisted['rounds'] if assisted['rounds'] else 0.0
+        return {
+            'draft_model': self.draft_model_name,
+            'enabled': bool(self.draft_model_name) and self.draft_disabled is None and self.is_qwen,
+            'disabled_reason': self.draft_disabled,
+            'num_assistant_tokens': self.num_assistant_tokens,
+            'assistant_schedule': self.assistant_schedule,
+            'draft_min_tokens': self.draft_min_tokens,
+            'assisted': assisted,
+            'plain': plain,
+            'speedup': (
+                assisted['tokens_per_second'] / plain['tokens_per_second']
+                if assisted['tokens_per_second'] and plain['tokens_per_second'] else None
+            )
+        }
+    def _use_draft(self):
+        """Whether the next single-prompt call should be assisted (False on probe calls)"""
+        if self.draft is None:
+            return False
+        with self._spec_lock:
+            self._spec_calls += 1
+            calls = self._spec_calls
+        return not (self.draft_probe_interval and calls % self.draft_probe_interval == 0)
+    def _record_speculative(self, assisted, tokens, seconds, rounds=0, drafted=0):
+        with self._spec_lock:
+            row = self._spec_stats['assisted' if assisted else 'plain']
+            row['calls'] += 1
+            row['tokens'] += tokens
+            row['seconds'] += seconds
+            if assisted:
+                row['rounds'] += rounds
+                row['drafted'] += drafted
+                # Each verification round keeps its accepted draft tokens plus
+                # one token of the model's own.
+                row['accepted'] += max(tokens - rounds, 0)
+    def register_prefix(self, prefix):
+        """Declare a static prompt opening. Single-prompt Qwen calls whose prompt starts
+        with it reuse its cached past_key_values and only prefill the rest."""
+        if prefix and prefix not in self.prefixes:
+            self.prefixes.append(prefix)
+    def prefix_cache_stats(self):
+        with self._prefix_lock:
+            lookups = self.prefix_hits + self.prefix_misses
+            return {
+                'prefixes': len(self.prefixes),
+                'cached': len(self._prefix_cache),
+                'max_cached': self.prefix_cache_size,
+                'hits': self.prefix_hits,
+                'misses': self.prefix_misses,
+                'hit_rate': self.prefix_hits / lookups if lookups else 0.0,
+                'tokens_reused': self.prefix_tokens_reused,
+                'disabled_reason': self.prefix_cache_disabled
+            }
+    def clear_prefix_cache(self):
+        with self._prefix_lock:
+            self._prefix_cache = OrderedDict()
+    def generate(self, prompt, max_tokens=512, temperature=0.75, system_prompt=None, streamer=None):
+        """Generate one response; on failure the error is printed and "" returned"""
+        try:
+            return self._generate_one(prompt, max_tokens, temperature, system_prompt, streamer)
         except Exception as e:
             print(f" Generation error: {e}")
+            if streamer is not None:
+                streamer.end()
+            self.last_usage = [{'prompt_tokens': 0, 'completion_tokens': 0}]
             return ""
-    def _generate_qwen(self, prompt, max_tokens, temperature, system_prompt):
+    def _generate_one(self, prompt, max_tokens, temperature, system_prompt, streamer=None):
+        start = time.perf_counter()
+        if self.is_qwen:
+            response = self._generate_qwen([prompt], max_tokens, temperature, system_prompt, streamer)[0]
+        else:
+            response = self._generate_t5([prompt], max_tokens, temperature, streamer)[0]
+        tracing.record_llm_usage(self.last_usage, time.perf_counter() - start)
+        return response
+    def generate_stream(self, prompt, max_tokens=512, temperature=0.75, system_prompt=None):
+        """Yield text pieces of the response as the model produces them"""
+        from transformers import TextIteratorStreamer
+        streamer = TextIteratorStreamer(
+            self.tokenizer,
+            skip_prompt=True,
+            skip_special_tokens=True
+        )
+        thread = threading.Thread(
+            target=self.generate,
+            args=(prompt, max_tokens, temperature, system_prompt, streamer),
+            daemon=True
+        )
+        thread.start()
+        for text in streamer:
+            if text:
+                yield text
+        thread.join()
+    def generate_batch(self, prompts, max_tokens=512, temperature=0.75, system_prompt=None):
+        """Generate one response per prompt, running up to batch_size prompts per model.generate call.
+        A failed generation raises, so no prompt gets an empty answer passed off as real."""
+        prompts = list(prompts)
+        if len(prompts) <= 1:
+            return [self._generate_one(p, max_tokens, temperature, system_prompt) for p in prompts]
+        responses = []
+        usage = []
+        for i in range(0, len(prompts), self.batch_size):
+            batch = prompts[i:i + self.batch_size]
+            start = time.perf_counter()
+            if self.is_qwen:
+                responses.extend(self._generate_qwen(batch, max_tokens, temperature, system_prompt))
+            else:
+                responses.extend(self._generate_t5(batch, max_tokens, temperature))
+            usage.extend(self.last_usage)
+            tracing.record_llm_usage(self.last_usage, time.perf_counter() - start)
+        self.last_usage = usage
+        return responses
+    def _generate_qwen(self, prompts, max_tokens, temperature, system_prompt, streamer=None):
+        import torch
+        texts = [
+            self.tokenizer.apply_chat_template(
+                self._chat_messages(prompt, system_prompt),
+                tokenize=False,
+                add_generation_prompt=True
+            )
+            for prompt in prompts
+        ]
+        model_inputs = self.tokenizer(texts, return_tensors="pt", padding=True).to(self.device)
+        extra = {}
+        # Only a draft that actually loaded takes the call off the prefix
+        # cache; a disabled one leaves it to plain decoding with the cache.
+        speculative = len(prompts) == 1 and max_tokens >= self.draft_min_tokens and self.draft is not None
+        assisted = speculative and self._use_draft()
+        if len(prompts) == 1 and self.prefix_cache_size and self.prefix_cache_disabled is None and not speculative:
+            past_key_values = self._prefix_past(prompts[0], system_prompt, model_inputs.input_ids[0])
+            if past_key_values is not None:
+                extra['past_key_values'] = past_key_values
+        rounds = None
+        if speculative:
+            from transformers import StoppingCriteria, StoppingCriteriaList
+            rounds = [0]
+            class CountRounds(StoppingCriteria):
+                # Called once per decoding step, or per verification round
+                # when assisted.
+                def __call__(self, input_ids, scores, **kwargs):
+                    rounds[0] += 1
+                    return torch.zeros(input_ids.shape[0], dtype=torch.bool, device=input_ids.device)
+            extra['stopping_criteria'] = StoppingCriteriaList([CountRounds()])
+        if assisted:
+            extra['assistant_model'] = self.draft
+            _draft_calls.count = 0
+            _draft_calls.active = True
+        start = time.perf_counter()
+        try:
+            with torch.no_grad():
+                generated_ids = self.model.generate(
+                    **model_inputs,
+                    **extra,
+                    max_new_tokens=max_tokens,
+                    temperature=temperature,
+                    do_sample=temperature > 0,
+                    top_p=0.95,
+                    pad_token_id=self.tokenizer.pad_token_id or self.tokenizer.eos_token_id,
+                    streamer=streamer
+                )
+        finally:
+            _draft_calls.active = False
+        # With left padding all prompts share the same length, so the new
+        # tokens start at the same offset in every row.
+        prompt_length = model_inputs.input_ids.shape[1]
+        self.last_usage = self._usage(model_inputs.attention_mask, generated_ids[:, prompt_length:])
+        if speculative:
+            self._record_speculative(
+                assisted,
+                self.last_usage[0]['completion_tokens'],
+                time.perf_counter() - start,
+                rounds[0],
+                _draft_calls.count if assisted else 0
+            )
+        responses = self.tokenizer.batch_decode(
+            generated_ids[:, prompt_length:],
+            skip_special_tokens=True
+        )
+        return [response.strip() for response in responses]
+    def _chat_messages(self, prompt, system_prompt):
         messages = []
         if system_prompt:
             messages.append({
@@ -54,33 +574,92 @@ class LLMClient:
             "role": "user",
             "content": prompt
         })
-        text = self.tokenizer.apply_chat_template(
-            messages,
-            tokenize=False,
-            add_generation_prompt=True
-        )
-        model_inputs = self.tokenizer([text], return_tensors="pt").to(self.device)
-        with torch.no_grad():
-            generated_ids = self.model.generate(
-                **model_inputs,
-                max_new_tokens=max_tokens,
-                temperature=temperature,
-                do_sample=temperature > 0,
-                top_p=0.95,
-                pad_token_id=self.tokenizer.pad_token_id or self.tokenizer.eos_token_id
+        return messages
+    def _template_head(self, system_prompt):
+        """Chat-template text that comes before the user message (system portion included)"""
+        head = self._template_heads.get(system_prompt)
+        if head is None:
+            marker = "\0"
+            text = self.tokenizer.apply_chat_template(
+                self._chat_messages(marker, system_prompt),
+                tokenize=False,
+                add_generation_prompt=True
             )
-        generated_ids = [
-            output_ids[len(input_ids):]
-            for input_ids, output_ids in zip(model_inputs.input_ids, generated_ids)
-        ]
-        response = self.tokenizer.batch_decode(generated_ids, skip_special_tokens=True)[0]
-        return response.strip()
-    def _generate_t5(self, prompt, max_tokens, temperature):
+            head = text[:text.index(marker)]
+            self._template_heads[system_prompt] = head
+        return head
+    def _prefix_past(self, prompt, system_prompt, input_ids):
+        """Return a private copy of the cached KV for the static opening of input_ids, or None"""
+        import torch
+        static = max((p for p in self.prefixes if prompt.startswith(p)), key=len, default="")
+        key = (system_prompt, static)
+        with self._prefix_lock:
+            entry = self._prefix_cache.get(key)
+            if entry is not None:
+                self._prefix_cache.move_to_end(key)
+                self.prefix_hits += 1
+            else:
+                self.prefix_misses += 1
+        tracing.record_cache('prefix', entry is not None)
+        if entry is None:
+            prefix_ids = self.tokenizer(
+                self._template_head(system_prompt) + static,
+                return_tensors="pt"
+            ).input_ids.to(self.device)
+            with torch.no_grad():
+                past_key_values = self.model(input_ids=prefix_ids, use_cache=True).past_key_values
+            past_key_values = self._croppable_cache(past_key_values)
+            if past_key_values is None:
+                import transformers
+                self.prefix_cache_disabled = (
+                    f"transformers {transformers.__version__} has no DynamicCache with crop(); "
+                    "upgrade it to reuse prompt prefixes"
+                )
+                print(f" Prefix cache disabled: {self.prefix_cache_disabled}")
+                return None
+            entry = (prefix_ids[0], past_key_values)
+            with self._prefix_lock:
+                self._prefix_cache[key] = entry
+                while len(self._prefix_cache) > self.prefix_cache_size:
+                    self._prefix_cache.popitem(last=False)
+        prefix_ids, past_key_values = entry
+        # Tokens may merge across the prefix boundary, so only the leading run
+        # that matches the full prompt is reused; at least one token is left
+        # for generate to prefill.
+        length = min(len(prefix_ids), len(input_ids) - 1)
+        length = int((prefix_ids[:length] == input_ids[:length]).long().cumprod(0).sum())
+        if length == 0:
+            return None
+        past_key_values = copy.deepcopy(past_key_values)
+        if length < past_key_values.get_seq_length():
+            past_key_values.crop(length)
+        with self._prefix_lock:
+            self.prefix_tokens_reused += length
+        return past_key_values
+    def _croppable_cache(self, past_key_values):
+        """past_key_values as a cache object with crop() and get_seq_length(), or
+        None when this transformers version has none"""
+        if hasattr(past_key_values, 'crop') and hasattr(past_key_values, 'get_seq_length'):
+            return past_key_values
+        try:
+            from transformers import DynamicCache
+        except ImportError:
+            return None
+        if not all(hasattr(DynamicCache, name) for name in ('crop', 'get_seq_length', 'update')):
+            return None
+        # A legacy tuple of per-layer (key, value) tensors.
+        cache = DynamicCache()
+        for layer_idx, (key, value) in enumerate(past_key_values):
+            cache.update(key, value, layer_idx)
+        return cache
+    def _generate_t5(self, prompts, max_tokens, temperature, streamer=None):
+        import torch
         inputs = self.tokenizer(
-            prompt,
+            prompts,
             return_tensors="pt",
             max_length=512,
-            truncation=True
+            truncation=True,
+            padding=True
         ).to(self.device)
         with torch.no_grad():
             outputs = self.model.generate(
@@ -89,10 +668,23 @@ class LLMClient:
                 temperature=temperature if temperature > 0 else 1.0,
                 do_sample=temperature > 0,
                 top_p=0.95,
-                pad_token_id=self.tokenizer.pad_token_id or self.tokenizer.eos_token_id
+                pad_token_id=self.tokenizer.pad_token_id or self.tokenizer.eos_token_id,
+                streamer=streamer
             )
-        response = self.tokenizer.decode(outputs[0], skip_special_tokens=True)
-        return response.strip()
+        # Decoder outputs start with the decoder start token.
+        self.last_usage = self._usage(inputs.attention_mask, outputs[:, 1:])
+        responses = self.tokenizer.batch_decode(outputs, skip_special_tokens=True)
+        return [response.strip() for response in responses]
+    def _usage(self, attention_mask, new_ids):
+        pad_token_id = self.tokenizer.pad_token_id
+        prompt_tokens = attention_mask.sum(dim=1).tolist()
+        completion_tokens = (new_ids != pad_token_id).sum(dim=1).tolist()
+        return [
+            {'prompt_tokens': int(p), 'completion_tokens': int(c)}
+            for p, c in zip(prompt_tokens, completion_tokens)
+        ]
     def clear_cache(self):
-        if self.device == "cuda":
+        self.clear_prefix_cache()
+        if self.is_loaded and self.device == "cuda":
+            import torch
             torch.cuda.empty_cache()
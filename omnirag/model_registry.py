@@ -0,0 +1,67 @@
+import threading
+class ModelRegistry:
+    """Process-wide store of loaded models keyed by (kind, name, dtype, quantization).
+    Components acquire a model instead of loading their own copy, so every
+    LLMClient or VectorDBTool asking for the same weights shares one instance.
+    A model is dropped when the last holder releases it."""
+    def __init__(self):
+        self._entries = {}
+        self._loading = {}
+        self._lock = threading.Lock()
+        self.loads = 0
+        self.reuses = 0
+    def acquire(self, key, loader):
+        """Return the model stored under key, calling loader() to load it if absent,
+        and count one more reference to it"""
+        while True:
+            with self._lock:
+                entry = self._entries.get(key)
+                if entry is not None:
+                    entry['refs'] += 1
+                    self.reuses += 1
+                    return entry['model']
+                loading = self._loading.get(key)
+                if loading is None:
+                    loading = self._loading[key] = threading.Event()
+                    break
+            # Another thread is loading the same model: wait for it, then retry.
+            loading.wait()
+        try:
+            model = loader()
+        except BaseException:
+            with self._lock:
+                self._loading.pop(key).set()
+            raise
+        # Store the model and end the load in one step, so a waiter that wakes
+        # up finds the entry instead of starting a second load.
+        with self._lock:
+            self._entries[key] = {'model': model, 'refs': 1}
+            self.loads += 1
+            self._loading.pop(key).set()
+        return model
+    def release(self, key):
+        """Drop one reference; returns True when that was the last and the model was removed"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return False
+            entry['refs'] -= 1
+            if entry['refs'] > 0:
+                return False
+            del self._entries[key]
+        return True
+    def refs(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            return entry['refs'] if entry is not None else 0
+    def keys(self):
+        with self._lock:
+            return list(self._entries)
+    def stats(self):
+        with self._lock:
+            return {
+                'models': {" / ".join(str(part) for part in key): entry['refs'] for key, entry in self._entries.items()},
+                'loads': self.loads,
+                'reuses': self.reuses
+            }
+registry = ModelRegistry()
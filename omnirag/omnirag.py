@@ -1,5 +1,9 @@
 import os
 import json
+import time
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, FIRST_COMPLETED, wait
 from omnirag.liquid_analyzer import LiquidAnalyzer
 from omnirag.chain_decomposer import ChainDecomposer
 from omnirag.agentic_planner import AgenticPlanner
@@ -7,95 +11,557 @@ from omnirag.content_transformer import ContentTransformer
 from omnirag.vectordb_tool import VectorDBTool
 from omnirag.web_search_tool import WebSearchTool
 from omnirag.llm_client import LLMClient
-from omnirag.cache import SimpleCache
+from omnirag.cache import SimpleCache, SemanticCache, StageCache
+from omnirag.generation_queue import GenerationQueue
+from omnirag.context_packer import ContextPacker
+from omnirag.model_registry import registry as model_registry
+from omnirag.budget import PROFILES, BudgetPlanner, LatencyModel
+from omnirag import tracing
+from omnirag.ingestion import (
+    SUPPORTED_EXTENSIONS,
+    iter_file_chunks,
+    iter_word_chunks,
+    iter_token_chunks,
+    iter_batches,
+    iter_directory_files,
+    init_worker,
+    extract_file
+)
+# "staged" adapts chunks, answers and polishes in separate generations;
+# "fused" answers from raw chunks at the user's level in one generation.
+ANSWER_MODES = ("staged", "fused")
 class OmniRAG:
+    # load_directory()'s record of ingested files, saved with the database.
+    INGEST_MANIFEST_FILE = "ingest_manifest.json"
+    # Chunks retrieved per sub-query.
+    RETRIEVAL_TOP_K = 3
+    # Default context budget: room for RETRIEVAL_TOP_K chunks of the default 500
+    # words (~650-1000 tokens each), unless the model's window is smaller.
+    DEFAULT_MAX_CONTEXT_TOKENS = 4096
+    # Kept free in the window for the prompt's instructions and question.
+    PROMPT_OVERHEAD_TOKENS = 256
     def __init__(self,
                  model_name="Qwen/Qwen2.5-0.5B-Instruct",
                  embedding_model="all-MiniLM-L6-v2",
+                 index_type="flat",
+                 embedding_cache_dir=None,
                  enable_web_search=False,
                  use_4bit=False,
+                 generation_batch_size=8,
+                 max_concurrency=1,
+                 max_concurrent_queries=8,
+                 batch_window_ms=5,
+                 cache_ttl_minutes=60,
+                 cache_max_entries=1024,
+                 cache_max_bytes=64 * 1024 * 1024,
+                 semantic_cache_threshold=0.9,
+                 stage_cache_max_entries=4096,
+                 liquid_cascade_threshold=0.5,
+                 chunk_by_tokens=False,
+                 chunk_overlap=0,
+                 max_context_tokens=None,
+                 prefix_cache_size=8,
+                 draft_model=None,
+                 num_assistant_tokens=5,
+                 cpu_mode=None,
+                 num_threads=None,
+                 compile_model=False,
+                 quantized_cache_dir=None,
+                 llm=None,
+                 embedder=None,
+                 share_models=True,
+                 lexical_index=True,
+                 retrieval_mode="dense",
+                 profile="quality",
+                 deadline_ms=None,
+                 answer_mode="staged",
                  verbose=False):
+        if profile not in PROFILES:
+            raise ValueError(f"Unknown profile: {profile} (expected one of {', '.join(PROFILES)})")
+        if answer_mode not in ANSWER_MODES:
+            raise ValueError(f"Unknown answer_mode: {answer_mode} (expected one of {', '.join(ANSWER_MODES)})")
         self.verbose = verbose
+        self.profile = profile
+        self.deadline_ms = deadline_ms
+        self.answer_mode = answer_mode
+        # Stage costs learned from past queries, used to plan under a deadline.
+        self.latency = LatencyModel()
+        # Hooks receiving the trace events of this instance's queries only.
+        self._trace_hooks = []
+        self.max_concurrency = max_concurrency
+        self.max_concurrent_queries = max_concurrent_queries
+        self.chunk_by_tokens = chunk_by_tokens
+        self.chunk_overlap = chunk_overlap
         if verbose:
-            print("\n[1/7] Loading LLM...")
-        self.llm = LLMClient(model_name=model_name, use_4bit=use_4bit)
+            print("\n[1/7] Initializing LLM (loaded on first use)...")
+        # An injected llm or embedder (e.g. the benchmark stand-ins) replaces
+        # the model that model_name or embedding_model would load. Neither
+        # model is loaded here: see warmup().
+        self.llm = llm if llm is not None else LLMClient(
+            model_name=model_name,
+            use_4bit=use_4bit,
+            batch_size=generation_batch_size,
+            prefix_cache_size=prefix_cache_size,
+            shared=share_models,
+            draft_model=draft_model,
+            num_assistant_tokens=num_assistant_tokens,
+            cpu_mode=cpu_mode,
+            num_threads=num_threads,
+            compile_model=compile_model,
+            quantized_cache_dir=quantized_cache_dir
+        )
+        self.generator = GenerationQueue(self.llm, batch_window_ms=batch_window_ms)
+        self.context_packer = ContextPacker(
+            max_tokens=max_context_tokens,
+            tokenizer_loader=self._packer_tokenizer,
+            max_tokens_loader=self._default_context_tokens if max_context_tokens is None else None
+        )
+        self.stage_cache = StageCache(
+            self.llm.model_name,
+            max_entries=stage_cache_max_entries
+        ) if stage_cache_max_entries else None
         if verbose:
             print("\n[2/7] Initializing Liquid RAG (User Detection)...")
-        self.liquid_analyzer = LiquidAnalyzer(self.llm)
-        self.content_transformer = ContentTransformer(self.llm)
+        self.liquid_analyzer = LiquidAnalyzer(
+            self.generator,
+            stage_cache=self.stage_cache,
+            cascade_threshold=liquid_cascade_threshold
+        )
+        self.content_transformer = ContentTransformer(self.generator, stage_cache=self.stage_cache)
         if verbose:
             print("[3/7] Initializing Chain RAG (Query Decomposition)...")
-        self.chain_decomposer = ChainDecomposer(self.llm)
+        self.chain_decomposer = ChainDecomposer(self.generator, stage_cache=self.stage_cache)
         if verbose:
             print("[4/7] Initializing Agentic RAG (Tool Selection)...")
-        self.agentic_planner = AgenticPlanner(self.llm)
+        self.agentic_planner = AgenticPlanner(self.generator)
         if verbose:
             print(f"\n[5/7] Initializing VectorDB ({embedding_model})...")
-        self.vectordb = VectorDBTool(embedding_model=embedding_model)
+        self.vectordb = VectorDBTool(
+            embedding_model=embedding_model,
+            index_type=index_type,
+            embedding_cache_dir=embedding_cache_dir,
+            embedder=embedder,
+            shared=share_models,
+            lexical_index=lexical_index,
+            retrieval_mode=retrieval_mode
+        )
         if verbose:
             print(f"[6/7] Initializing Web Search: {enable_web_search}...")
         self.web_search = WebSearchTool() if enable_web_search else None
         if verbose:
             print("[7/7] Initializing Cache...")
-        self.cache = SimpleCache()
-    def add_documents(self, documents):
+        self.cache = SimpleCache(
+            ttl_minutes=cache_ttl_minutes,
+            max_entries=cache_max_entries,
+            max_bytes=cache_max_bytes
+        )
+        self.semantic_cache = SemanticCache(
+            threshold=semantic_cache_threshold,
+            ttl_minutes=cache_ttl_minutes,
+            max_entries=cache_max_entries,
+            embedder_loader=lambda: self.vectordb.embedder
+        ) if semantic_cache_threshold is not None else None
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_concurrency,
+            thread_name_prefix="omnirag-subquery"
+        ) if max_concurrency > 1 else None
+        self._query_executor = None
+        self._ingest_executor = None
+        self._ingest_manifest = {}
+    def warmup(self, components=("llm", "embedder"), background=False):
+        """Load the models of the given components ("llm", "embedder") in parallel
+        threads, so the first query does not pay for it. Returns the futures when
+        background=True, else waits for them."""
+        loaders = {
+            'llm': getattr(self.llm, 'load', None),
+            'embedder': self.vectordb.load_embedder
+        }
+        unknown = set(components) - set(loaders)
+        if unknown:
+            raise ValueError(f"Unknown components: {', '.join(sorted(unknown))} (expected llm or embedder)")
+        tasks = [(name, loaders[name]) for name in components if loaders[name] is not None]
+        if not tasks:
+            return []
+        pool = ThreadPoolExecutor(max_workers=len(tasks), thread_name_prefix="omnirag-warmup")
+        futures = [pool.submit(loader) for _, loader in tasks]
+        pool.shutdown(wait=False)
+        if background:
+            return futures
+        start = time.perf_counter()
+        for future in futures:
+            future.result()
+        if self.verbose:
+            print(f" Warmed up {', '.join(name for name, _ in tasks)} in {time.perf_counter() - start:.2f}s")
+        return futures
+    def add_documents(self, documents, precompute_levels=None, background=True):
+        """Add documents; with precompute_levels (e.g. ("beginner", "expert")) their
+        level-specific rewrites are generated as a batched job, in a background
+        thread unless background=False. Returns the job's Future, if any."""
         if self.verbose:
             print(f"Adding {len(documents)} documents...")
+        start = self.vectordb.count()
         self.vectordb.add_documents(documents)
-    def load_from_file(self, file_path, chunk_size=500):
+        if precompute_levels:
+            return self.precompute_variants(
+                precompute_levels,
+                doc_ids=range(start, self.vectordb.count()),
+                background=background
+            )
+    def precompute_variants(self, levels=("beginner", "expert"), doc_ids=None, background=True):
+        """Generate and store level-specific rewrites for documents that do not have them yet"""
+        if isinstance(levels, str):
+            levels = (levels,)
+        levels = [level for level in levels if level in ("beginner", "expert")]
+        if background:
+            if self._ingest_executor is None:
+                self._ingest_executor = ThreadPoolExecutor(
+                    max_workers=1,
+                    thread_name_prefix="omnirag-precompute"
+                )
+            return self._ingest_executor.submit(self._precompute_variants, levels, doc_ids)
+        self._precompute_variants(levels, doc_ids)
+    def _precompute_variants(self, levels, doc_ids):
+        batch_size = self.llm.batch_size * 4
+        for level in levels:
+            missing = set(self.vectordb.missing_variants(level))
+            pending = [doc_id for doc_id in (doc_ids if doc_ids is not None else sorted(missing)) if doc_id in missing]
+            for i in range(0, len(pending), batch_size):
+                batch = pending[i:i + batch_size]
+                rewrites = self.content_transformer.transform_batch(
+                    [self.vectordb.documents[doc_id] for doc_id in batch],
+                    level
+                )
+                self.vectordb.set_variants(level, {
+                    doc_id: text for doc_id, text in zip(batch, rewrites) if text
+                })
+            if self.verbose and pending:
+                print(f"[LIQUID] Precomputed {len(pending)} '{level}' variants")
+    def load_from_file(self, file_path, chunk_size=500, precompute_levels=None, background=True,
+                       batch_size=256, progress_callback=None):
+        """Stream a file through pages/lines -> chunks -> embedding batches -> index,
+        holding at most one batch of chunks in memory. Returns an ingestion report;
+        with precompute_levels its 'precompute' entry is the variant job's Future."""
         if not os.path.exists(file_path):
             raise FileNotFoundError(f"File not found: {file_path}")
         file_ext = os.path.splitext(file_path)[1].lower()
-        documents = []
-        if file_ext in ['.txt', '.md']:
-            with open(file_path, 'r', encoding='utf-8') as f:
-                content = f.read()
-                documents = self._chunk_text(content, chunk_size)
-        elif file_ext == '.json':
-            with open(file_path, 'r', encoding='utf-8') as f:
-                data = json.load(f)
-                if isinstance(data, list):
-                    documents = [str(item) for item in data]
-                else:
-                    documents = [str(data)]
-        elif file_ext == '.pdf':
+        if file_ext not in SUPPORTED_EXTENSIONS:
+            raise ValueError(f"Unsupported file type: {file_ext}")
+        report = {
+            'file': file_path,
+            'bytes': os.path.getsize(file_path),
+            'chunks': 0,
+            'batches': 0,
+            'seconds': 0.0,
+            'chunks_per_second': 0.0,
+            'precompute': None
+        }
+        if file_ext == '.pdf':
+            # Only the PDF reader is optional here; a missing faiss or
+            # sentence-transformers surfaces from add_documents as itself.
             try:
-                from PyPDF2 import PdfReader
-                reader = PdfReader(file_path)
-                text = ""
-                for page in reader.pages:
-                    text += page.extract_text() + "\n"
-                documents = self._chunk_text(text, chunk_size)
+                import PyPDF2
             except ImportError:
                 print("❌ PyPDF2 not installed! Install with: pip install PyPDF2")
-                return
+                return report
+        start_id = self.vectordb.count()
+        start = time.perf_counter()
+        chunks = iter_file_chunks(file_path, chunk_size, self.chunk_overlap, self._chunk_tokenizer())
+        for batch in iter_batches(chunks, batch_size):
+            self.vectordb.add_documents(batch)
+            report['chunks'] += len(batch)
+            report['batches'] += 1
+            report['seconds'] = time.perf_counter() - start
+            report['chunks_per_second'] = report['chunks'] / report['seconds'] if report['seconds'] else 0.0
+            if self.verbose:
+                print(f"   {file_path}: {report['chunks']} chunks ({report['chunks_per_second']:.1f} chunks/s)")
+            if progress_callback is not None:
+                progress_callback(dict(report))
+        if precompute_levels and report['chunks']:
+            report['precompute'] = self.precompute_variants(
+                precompute_levels,
+                doc_ids=range(start_id, self.vectordb.count()),
+                background=background
+            )
+        return report
+    def load_directory(self, path, patterns=None, workers=None, chunk_size=500, batch_size=256,
+                       recursive=True, manifest_path=None, precompute_levels=None, background=True):
+        """Ingest every matching file under path. Text extraction and chunking run in a
+        process pool; chunks feed one batched embedding stage in this process. Files
+        whose mtime/size or content hash match the manifest are skipped, and a file
+        that fails is reported without stopping the others. A changed file is
+        re-ingested and the chunks of its previous version (their ids are kept in
+        the manifest) are deleted from searches. A file at
+        manifest_path outlives clear_database() and load_database(), so delete it
+        along with the database, or its files are skipped as already ingested."""
+        if not os.path.isdir(path):
+            raise FileNotFoundError(f"Directory not found: {path}")
+        manifest = self._ingest_manifest
+        if manifest_path and os.path.exists(manifest_path):
+            with open(manifest_path, 'r', encoding='utf-8') as f:
+                manifest.update(json.load(f))
+        report = {
+            'directory': path,
+            'files': 0,
+            'ingested': 0,
+            'skipped': 0,
+            'failed': 0,
+            'errors': {},
+            'chunks': 0,
+            'seconds': 0.0,
+            'chunks_per_second': 0.0,
+            'precompute': None
+        }
+        start_id = self.vectordb.count()
+        # Chunks are embedded in the order they are collected, so each file's
+        # chunks get the next ids.
+        next_id = start_id
+        start = time.perf_counter()
+        pending_chunks = []
+        def embed(flush=False):
+            while len(pending_chunks) >= batch_size or (flush and pending_chunks):
+                batch = pending_chunks[:batch_size]
+                del pending_chunks[:batch_size]
+                self.vectordb.add_documents(batch)
+                report['chunks'] += len(batch)
+        def collect(entry):
+            nonlocal next_id
+            known = manifest.get(entry['path']) or {}
+            doc_ids = known.get('doc_ids')
+            if entry['chunks'] is None:
+                report['skipped'] += 1
+            else:
+                if doc_ids:
+                    self.vectordb.delete(range(*doc_ids))
+                doc_ids = [next_id, next_id + len(entry['chunks'])]
+                next_id = doc_ids[1]
+                pending_chunks.extend(entry['chunks'])
+                report['ingested'] += 1
+                embed()
+            manifest[entry['path']] = dict(
+                {key: entry[key] for key in ('mtime_ns', 'size', 'sha256')},
+                doc_ids=doc_ids
+            )
+        to_extract = []
+        for file_path in iter_directory_files(path, patterns, recursive):
+            report['files'] += 1
+            known = manifest.get(file_path)
+            stat = os.stat(file_path)
+            if known and known['mtime_ns'] == stat.st_mtime_ns and known['size'] == stat.st_size:
+                report['skipped'] += 1
+                continue
+            to_extract.append((file_path, known['sha256'] if known else None))
+        workers = workers or os.cpu_count() or 1
+        if workers <= 1:
+            for file_path, known_sha256 in to_extract:
+                try:
+                    collect(extract_file(
+                        file_path,
+                        chunk_size,
+                        known_sha256,
+                        self.chunk_overlap,
+                        self._chunk_tokenizer()
+                    ))
+                except Exception as e:
+                    report['failed'] += 1
+                    report['errors'][file_path] = f"{type(e).__name__}: {e}"
         else:
-            raise ValueError(f"Unsupported file type: {file_ext}")
-        self.add_documents(documents)
+            with ProcessPoolExecutor(
+                max_workers=workers,
+                initializer=init_worker,
+                initargs=(self._chunk_tokenizer(),)
+            ) as pool:
+                # Keep a bounded number of files in flight so extracted chunks
+                # never pile up faster than the embedder drains them.
+                queued = iter(to_extract)
+                in_flight = {}
+                while True:
+                    while len(in_flight) < workers * 2:
+                        item = next(queued, None)
+                        if item is None:
+                            break
+                        in_flight[pool.submit(
+                            extract_file, item[0], chunk_size, item[1], self.chunk_overlap
+                        )] = item[0]
+                    if not in_flight:
+                        break
+                    done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        file_path = in_flight.pop(future)
+                        try:
+                            collect(future.result())
+                        except Exception as e:
+                            report['failed'] += 1
+                            report['errors'][file_path] = f"{type(e).__name__}: {e}"
+                    if self.verbose:
+                        print(f"   {path}: {report['ingested']} files, {report['chunks']} chunks embedded")
+        embed(flush=True)
+        report['seconds'] = time.perf_counter() - start
+        report['chunks_per_second'] = report['chunks'] / report['seconds'] if report['seconds'] else 0.0
+        if manifest_path:
+            with open(manifest_path + ".tmp", 'w', encoding='utf-8') as f:
+                json.dump(manifest, f)
+            os.replace(manifest_path + ".tmp", manifest_path)
+        if report['errors']:
+            for file_path, error in report['errors'].items():
+                print(f"❌ Failed to ingest {file_path}: {error}")
+        if precompute_levels and report['chunks']:
+            report['precompute'] = self.precompute_variants(
+                precompute_levels,
+                doc_ids=range(start_id, self.vectordb.count()),
+                background=background
+            )
+        return report
+    def _default_context_tokens(self):
+        """DEFAULT_MAX_CONTEXT_TOKENS, or less when the model's context window minus
+        the answer and the prompt's own text is smaller"""
+        window = getattr(self.llm.tokenizer, 'model_max_length', None)
+        # Tokenizers without a configured limit report a huge sentinel value.
+        if not window or window > 10 ** 7:
+            return self.DEFAULT_MAX_CONTEXT_TOKENS
+        answer_tokens = max(profile['answer_tokens'] for profile in PROFILES.values())
+        return max(min(self.DEFAULT_MAX_CONTEXT_TOKENS, window - answer_tokens - self.PROMPT_OVERHEAD_TOKENS), 1)
+    def _packer_tokenizer(self):
+        # An instance of its own where the client can make one: a fast
+        # tokenizer switches its padding and truncation state on every call,
+        # so sharing it with the generation worker breaks padded batches.
+        new_tokenizer = getattr(self.llm, 'new_tokenizer', None)
+        return new_tokenizer() if new_tokenizer is not None else self.llm.tokenizer
+    def _chunk_tokenizer(self):
+        return self.llm.tokenizer if self.chunk_by_tokens else None
     def _chunk_text(self, text, chunk_size=500):
-        words = text.split()
-        chunks = []
-        for i in range(0, len(words), chunk_size):
-            chunk = ' '.join(words[i:i + chunk_size])
-            if chunk.strip():
-                chunks.append(chunk)
-        return chunks
-    def query(self, user_query, force_complexity=None, max_sub_queries=4):
-        cached = self.cache.get(user_query)
+        if self.chunk_by_tokens:
+            return list(iter_token_chunks([text], self.llm.tokenizer, chunk_size, self.chunk_overlap))
+        return list(iter_word_chunks([text], chunk_size, self.chunk_overlap))
+    def query(self, user_query, force_complexity=None, max_sub_queries=4, profile=None, deadline_ms=None,
+              answer_mode=None):
+        """Answer user_query. profile ("fast", "balanced" or "quality") chooses which
+        optional stages run; with deadline_ms, stages are dropped or generations
+        shortened to fit; answer_mode is "staged" or "fused". All default to the
+        instance's settings."""
+        for event in self._traced_pipeline(user_query, force_complexity, max_sub_queries, profile=profile,
+                                           deadline_ms=deadline_ms, answer_mode=answer_mode):
+            if event['type'] == 'done':
+                return event['result']
+    def query_stream(self, user_query, force_complexity=None, max_sub_queries=4, profile=None, deadline_ms=None,
+                     answer_mode=None):
+        """Yield progress events for each stage, then the final answer token by token.
+        Events are dicts with a 'type' of 'user_level', 'sub_queries', 'tools',
+        'token' (carrying 'text') and finally 'done' (carrying the full 'result')."""
+        return self._traced_pipeline(user_query, force_complexity, max_sub_queries, True, profile, deadline_ms,
+                                     answer_mode)
+    async def aquery(self, user_query, force_complexity=None, max_sub_queries=4, profile=None, deadline_ms=None,
+                     answer_mode=None):
+        """Async query: runs the pipeline off the event loop while its LLM calls
+        are micro-batched with those of every other in-flight query"""
+        if self._query_executor is None:
+            self._query_executor = ThreadPoolExecutor(
+                max_workers=self.max_concurrent_queries,
+                thread_name_prefix="omnirag-query"
+            )
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self._query_executor,
+            functools.partial(self.query, user_query, force_complexity, max_sub_queries, profile, deadline_ms,
+                              answer_mode)
+        )
+    def _traced_pipeline(self, user_query, force_complexity=None, max_sub_queries=4, stream=False,
+                         profile=None, deadline_ms=None, answer_mode=None):
+        """Run the pipeline with a fresh trace active only while pipeline code runs,
+        and return the trace in the final result's metadata"""
+        answer_mode = answer_mode or self.answer_mode
+        if answer_mode not in ANSWER_MODES:
+            raise ValueError(f"Unknown answer_mode: {answer_mode} (expected one of {', '.join(ANSWER_MODES)})")
+        trace = tracing.Trace(user_query, hooks=self._trace_hooks)
+        budget = BudgetPlanner(
+            profile or self.profile,
+            deadline_ms if deadline_ms is not None else self.deadline_ms,
+            self.latency,
+            # The fused answer replaces the per-chunk rewrites and the polish.
+            omit=('transform', 'polish') if answer_mode == "fused" else ()
+        )
+        pipeline = self._run_pipeline(user_query, force_complexity, max_sub_queries, stream, budget, answer_mode)
+        while True:
+            with tracing.use(trace):
+                event = next(pipeline, None)
+            if event is None:
+                return
+            if event['type'] == 'done':
+                result = event['result']
+                finished = trace.finish()
+                self.latency.observe(finished, skipped=[skip['stage'] for skip in budget.skipped])
+                # A cached answer was not produced under this query's budget.
+                budget_metadata = {'cached': True} if event.get('cached') else budget.metadata()
+                event = {
+                    'type': 'done',
+                    'result': dict(result, metadata=dict(result['metadata'], budget=budget_metadata, trace=finished))
+                }
+            yield event
+    def _run_pipeline(self, user_query, force_complexity=None, max_sub_queries=4, stream=False, budget=None,
+                      answer_mode=None):
+        answer_mode = answer_mode or self.answer_mode
+        fused = answer_mode == "fused"
+        if budget is None:
+            budget = BudgetPlanner(
+                self.profile,
+                self.deadline_ms,
+                self.latency,
+                omit=('transform', 'polish') if fused else ()
+            )
+        # A forced level, another profile or another answer mode produces a
+        # different answer, so they are part of the key.
+        cache_key = f"{force_complexity}:{user_query}" if force_complexity else user_query
+        if budget.profile != self.profile or answer_mode != self.answer_mode:
+            cache_key = f"{budget.profile}|{answer_mode}|{cache_key}"
+        cached = self.cache.get(cache_key)
+        tracing.record_cache('answer', cached is not None)
         if cached:
             if self.verbose:
                 print("Returning cached result")
-            return cached
+            if stream:
+                yield {'type': 'token', 'text': cached['answer']}
+            yield {'type': 'done', 'result': cached, 'cached': True}
+            return
         if force_complexity:
             container = {"complexity": force_complexity, "query": user_query}
         else:
-            container = self.liquid_analyzer.analyze(user_query)
+            with tracing.span('classify'):
+                container = self.liquid_analyzer.analyze(user_query, use_llm=budget.run('classify'))
         if self.verbose:
             print(f"\n [LIQUID] User Level Detected: {container['complexity'].upper()}")
+        yield {'type': 'user_level', 'user_level': container['complexity']}
+        query_vector = None
+        # Profile and answer mode change the answer, so paraphrases only share
+        # answers produced under the same ones. A deadline does not: answers it
+        # cut short are never cached.
+        semantic_namespace = (budget.profile, answer_mode)
+        if self.semantic_cache is not None:
+            with tracing.span('semantic_cache'):
+                query_vector = self.semantic_cache.embed(user_query)
+                similar, similarity = self.semantic_cache.lookup(
+                    query_vector,
+                    container['complexity'],
+                    semantic_namespace
+                )
+            tracing.record_cache('semantic', similar is not None)
+            if similar:
+                if self.verbose:
+                    print(f"Returning semantically cached result (similarity {similarity:.3f})")
+                result = dict(similar)
+                result['metadata'] = dict(
+                    similar['metadata'],
+                    semantic_cache_hit=True,
+                    similarity=similarity
+                )
+                self.cache.set(cache_key, result)
+                if stream:
+                    yield {'type': 'token', 'text': result['answer']}
+                yield {'type': 'done', 'result': result, 'cached': True}
+                return
         is_complex = self.chain_decomposer.is_complex(user_query)
         if is_complex:
-            sub_queries = self.chain_decomposer.decompose(user_query)
-            sub_queries = sub_queries[:max_sub_queries]
+            with tracing.span('decompose'):
+                sub_queries = self.chain_decomposer.decompose(user_query)
+            sub_queries = sub_queries[:min(max_sub_queries, budget.max_sub_queries)]
             if self.verbose:
                 print(f"\n [CHAIN] Complex Query! Decomposed into {len(sub_queries)} parts:")
                 for i, sq in enumerate(sub_queries, 1):
@@ -104,49 +570,102 @@ class OmniRAG:
             sub_queries = [user_query]
             if self.verbose:
                 print(f"\n [CHAIN] Simple Query - No decomposition needed")
-        all_sub_results = []
-        for idx, sub_query in enumerate(sub_queries, 1):
-            if self.verbose:
-                print(f"\n Processing Sub-Query {idx}/{len(sub_queries)}: {sub_query}")
-            plan = self.agentic_planner.plan(
+        yield {'type': 'sub_queries', 'sub_queries': sub_queries, 'was_complex': is_complex}
+        plans = [
+            self.agentic_planner.plan(
                 sub_query,
-                web_available=(self.web_search is not None)
+                web_available=(self.web_search is not None),
+                lexical_available=(self.vectordb.lexical is not None)
             )
-            if self.verbose:
-                print(f" [AGENTIC] Tool: {plan['tool']}")
-                print(f" Reasoning: {plan['reasoning']}")
-            if plan['tool'] == 'web_search' and self.web_search:
-                chunks = self.web_search.search(sub_query, max_results=3)
-            else:
-                chunks = self.vectordb.search(sub_query, top_k=3)
-            if self.verbose:
-                print(f" Retrieved {len(chunks)} chunks")
-            transformed_chunks = []
-            for chunk in chunks:
-                transformed = self.content_transformer.transform(
-                    chunk,
+            for sub_query in sub_queries
+        ]
+        yield {'type': 'tools', 'tools': [plan['tool'] for plan in plans]}
+        concurrent = self._executor is not None and len(sub_queries) > 1
+        if concurrent:
+            hit_lists = list(self._executor.map(tracing.bind(self._retrieve), sub_queries, plans))
+        else:
+            hit_lists = []
+            for idx, (sub_query, plan) in enumerate(zip(sub_queries, plans), 1):
+                if self.verbose:
+                    print(f"\n Processing Sub-Query {idx}/{len(sub_queries)}: {sub_query}")
+                hit_lists.append(self._retrieve(sub_query, plan))
+        hit_lists = self.context_packer.dedupe(hit_lists)
+        transform = budget.run('transform')
+        # Set when the final text was streamed while it was generated.
+        streamed = False
+        if fused:
+            prompts = [
+                self.content_transformer.fused_answer_prompt(
+                    sub_query,
+                    self.context_packer.pack([hit['text'] for hit in hits], [hit['score'] for hit in hits]),
                     container['complexity']
                 )
-                transformed_chunks.append(transformed)
+                for sub_query, hits in zip(sub_queries, hit_lists)
+            ]
+            if stream and len(prompts) == 1:
+                answer = yield from self._stream_generation('answer', prompts[0], budget.max_tokens('answer'))
+                sub_answers = [answer]
+                streamed = True
+            else:
+                with tracing.span('answer', prompts=len(prompts)):
+                    sub_answers = self.generator.generate_batch(
+                        prompts,
+                        max_tokens=budget.max_tokens('answer'),
+                        temperature=0.75
+                    )
+            all_sub_results = [
+                {'sub_query': sub_query, 'answer': sub_answer, 'tool': plan['tool']}
+                for sub_query, plan, sub_answer in zip(sub_queries, plans, sub_answers)
+            ]
+        elif concurrent:
+            all_sub_results = list(self._executor.map(
+                tracing.bind(
+                    lambda sub_query, plan, hits: self._process_sub_query(
+                        sub_query, plan, hits, container['complexity'], budget, transform
+                    )
+                ),
+                sub_queries,
+                plans,
+                hit_lists
+            ))
+        else:
+            all_sub_results = self._process_sub_queries_batched(
+                sub_queries,
+                plans,
+                hit_lists,
+                container['complexity'],
+                budget,
+                transform
+            )
+        if len(all_sub_results) == 1:
+            synthesized_answer = all_sub_results[0]['answer']
+        elif not budget.run('synthesis'):
+            # Without a synthesis pass the sub-answers are listed in order.
+            synthesized_answer = "\n\n".join(f"{r['sub_query']}\n{r['answer']}" for r in all_sub_results)
+        elif fused:
+            # Synthesis and polish in a single pass.
             if self.verbose:
-                print(f"[LIQUID] Transformed to '{container['complexity']}' level")
-            context = "\n\n".join(transformed_chunks)
-            prompt = f"""Based on the context, answer the question clearly and concisely.
-Context:
-{context}
-Question: {sub_query}
-Answer (for {container['complexity']} level user):"""
-            sub_answer = self.llm.generate(
-                prompt,
-                max_tokens=300,
-                temperature=0.75
+                print(f"\n [CHAIN] Synthesizing {len(all_sub_results)} sub-answers...")
+            synthesis_prompt = self.content_transformer.fused_synthesis_prompt(
+                user_query,
+                all_sub_results,
+                container['complexity']
             )
-            all_sub_results.append({
-                'sub_query': sub_query,
-                'answer': sub_answer,
-                'tool': plan['tool']
-            })
-        if len(all_sub_results) > 1:
+            if stream:
+                synthesized_answer = yield from self._stream_generation(
+                    'synthesis',
+                    synthesis_prompt,
+                    budget.max_tokens('synthesis')
+                )
+                streamed = True
+            else:
+                with tracing.span('synthesis'):
+                    synthesized_answer = self.generator.generate(
+                        synthesis_prompt,
+                        max_tokens=budget.max_tokens('synthesis'),
+                        temperature=0.75
+                    )
+        else:
             if self.verbose:
                 print(f"\n [CHAIN] Synthesizing {len(all_sub_results)} sub-answers...")
             combined = "\n\n".join([
@@ -158,42 +677,230 @@ Original Question: {user_query}
 Sub-Answers:
 {combined}
 Create a unified answer for a {container['complexity']} level user:"""
-            synthesized_answer = self.llm.generate(
-                synthesis_prompt,
-                max_tokens=500,
-                temperature=0.75
-            )
+            with tracing.span('synthesis'):
+                synthesized_answer = self.generator.generate(
+                    synthesis_prompt,
+                    max_tokens=budget.max_tokens('synthesis'),
+                    temperature=0.75
+                )
+        if streamed:
+            final_answer = synthesized_answer
+        elif not budget.run('polish'):
+            final_answer = synthesized_answer
+            if stream:
+                yield {'type': 'token', 'text': final_answer}
+        elif stream:
+            if self.verbose:
+                print(f"\n [LIQUID] Final polish for {container['complexity']} level...")
+            pieces = []
+            with tracing.span('polish'):
+                for text in self.content_transformer.polish_stream(
+                    synthesized_answer,
+                    container['complexity'],
+                    max_tokens=budget.max_tokens('polish')
+                ):
+                    pieces.append(text)
+                    yield {'type': 'token', 'text': text}
+            final_answer = "".join(pieces).strip()
         else:
-            synthesized_answer = all_sub_results[0]['answer']
-        if self.verbose:
-            print(f"\n [LIQUID] Final polish for {container['complexity']} level...")
-        final_answer = self.content_transformer.polish(
-            synthesized_answer,
-            container['complexity']
-        )
+            if self.verbose:
+                print(f"\n [LIQUID] Final polish for {container['complexity']} level...")
+            with tracing.span('polish'):
+                final_answer = self.content_transformer.polish(
+                    synthesized_answer,
+                    container['complexity'],
+                    max_tokens=budget.max_tokens('polish')
+                )
         result = {
             'answer': final_answer,
             'metadata': {
                 'user_level': container['complexity'],
                 'sub_queries_count': len(sub_queries),
                 'tools_used': [r['tool'] for r in all_sub_results],
-                'was_complex': is_complex
+                'was_complex': is_complex,
+                'answer_mode': answer_mode,
+                'skipped': [skip['stage'] for skip in budget.skipped]
             }
         }
-        self.cache.set(user_query, result)
-        return result
+        # An answer cut short by a deadline is not reused.
+        if not budget.degraded:
+            self.cache.set(cache_key, result)
+            if query_vector is not None:
+                self.semantic_cache.add(
+                    query_vector,
+                    user_query,
+                    container['complexity'],
+                    result,
+                    semantic_namespace
+                )
+        yield {'type': 'done', 'result': result}
+    def _stream_generation(self, stage, prompt, max_tokens):
+        """Yield token events while prompt is generated; returns the stripped text"""
+        pieces = []
+        with tracing.span(stage):
+            for text in self.generator.generate_stream(prompt, max_tokens=max_tokens, temperature=0.75):
+                pieces.append(text)
+                yield {'type': 'token', 'text': text}
+        return "".join(pieces).strip()
+    def _retrieve(self, sub_query, plan):
+        if self.verbose:
+            print(f" [AGENTIC] Tool: {plan['tool']} ({sub_query})")
+            print(f" Reasoning: {plan['reasoning']}")
+        with tracing.span('retrieve', tool=plan['tool']):
+            if plan['tool'] == 'web_search' and self.web_search:
+                hits = [
+                    {'id': None, 'text': text, 'score': -float(rank)}
+                    for rank, text in enumerate(self.web_search.search(sub_query, max_results=3))
+                ]
+            elif plan['tool'] in ('lexical', 'hybrid'):
+                hits = self.vectordb.search_hits(sub_query, top_k=self.RETRIEVAL_TOP_K, mode=plan['tool'])
+            else:
+                hits = self.vectordb.search_hits(sub_query, top_k=self.RETRIEVAL_TOP_K)
+        if self.verbose:
+            print(f" Retrieved {len(hits)} chunks")
+        return hits
+    def _transform_hits(self, hits, user_level, live=True):
+        """Use precomputed level variants where they exist and transform the rest
+        live, or keep their original text when live=False"""
+        texts = [
+            self.vectordb.get_variant(hit['id'], user_level) if hit['id'] is not None else None
+            for hit in hits
+        ]
+        missing = [i for i, text in enumerate(texts) if text is None]
+        if missing and not live:
+            for i in missing:
+                texts[i] = hits[i]['text']
+        elif missing:
+            transformed = self.content_transformer.transform_batch(
+                [hits[i]['text'] for i in missing],
+                user_level
+            )
+            for i, text in zip(missing, transformed):
+                texts[i] = text
+        if self.verbose and len(missing) < len(hits):
+            print(f"[LIQUID] {len(hits) - len(missing)}/{len(hits)} chunks served from precomputed variants")
+        return texts
+    def _answer_prompt(self, sub_query, context, user_level):
+        return f"""Based on the context, answer the question clearly and concisely.
+Context:
+{context}
+Question: {sub_query}
+Answer (for {user_level} level user):"""
+    def _process_sub_query(self, sub_query, plan, hits, user_level, budget, transform=True):
+        """Transform and answer one sub-query branch; LLM calls go through the shared generation queue"""
+        with tracing.span('transform', chunks=len(hits)):
+            transformed_chunks = self._transform_hits(hits, user_level, live=transform)
+        context = self.context_packer.pack(transformed_chunks, [hit['score'] for hit in hits])
+        with tracing.span('answer'):
+            sub_answer = self.generator.generate(
+                self._answer_prompt(sub_query, context, user_level),
+                max_tokens=budget.max_tokens('answer'),
+                temperature=0.75
+            )
+        return {
+            'sub_query': sub_query,
+            'answer': sub_answer,
+            'tool': plan['tool']
+        }
+    def _process_sub_queries_batched(self, sub_queries, plans, hit_lists, user_level, budget, transform=True):
+        """Transform the hits of every sub-query in one batch, then answer them all in one batch"""
+        all_hits = [hit for hits in hit_lists for hit in hits]
+        with tracing.span('transform', chunks=len(all_hits)):
+            transformed_chunks = self._transform_hits(all_hits, user_level, live=transform)
+        if self.verbose and transform:
+            print(f"\n[LIQUID] Adapted {len(all_hits)} chunks to '{user_level}' level")
+        prompts = []
+        offset = 0
+        for sub_query, hits in zip(sub_queries, hit_lists):
+            context = self.context_packer.pack(
+                transformed_chunks[offset:offset + len(hits)],
+                [hit['score'] for hit in hits]
+            )
+            offset += len(hits)
+            prompts.append(self._answer_prompt(sub_query, context, user_level))
+        with tracing.span('answer', prompts=len(prompts)):
+            sub_answers = self.generator.generate_batch(
+                prompts,
+                max_tokens=budget.max_tokens('answer'),
+                temperature=0.75
+            )
+        return [
+            {'sub_query': sub_query, 'answer': sub_answer, 'tool': plan['tool']}
+            for sub_query, plan, sub_answer in zip(sub_queries, plans, sub_answers)
+        ]
     def get_stats(self):
         return {
             'documents_count': self.vectordb.count(),
+            'embeddings': self.vectordb.get_embedding_stats(),
+            'lexical_index': self.vectordb.lexical_stats(),
+            'precomputed_variants': self.vectordb.variant_counts(),
             'cache_size': self.cache.size(),
+            'cache': self.cache.stats(),
+            'semantic_cache': self.semantic_cache.stats() if self.semantic_cache else None,
+            'stage_cache': self.stage_cache.stats() if self.stage_cache else None,
+            'liquid_cascade': self.liquid_analyzer.cascade_stats(),
+            'context_packing': self.context_packer.stats(),
             'model': self.llm.model_name,
-            'device': self.llm.device
+            'device': self.llm.device,
+            'max_concurrency': self.max_concurrency,
+            'generation': self.generator.stats(),
+            'prefix_cache': self.llm.prefix_cache_stats(),
+            'model_registry': model_registry.stats(),
+            'latency_estimates': self.latency.stats()
         }
+    def add_trace_hook(self, hook):
+        """Call hook(event) for every finished stage span ({'type': 'span', ...}) and
+        query ({'type': 'query', 'query', 'trace'}) of this instance, e.g. to forward
+        them to a tracer. tracing.registry.add_hook() sees every instance's."""
+        self._trace_hooks.append(hook)
+    def remove_trace_hook(self, hook):
+        self._trace_hooks.remove(hook)
+    def metrics_text(self):
+        """Aggregated counters and latency histograms in the Prometheus text format"""
+        return tracing.registry.render()
+    def serve_metrics(self, port=9464, addr=""):
+        """Expose metrics_text() over HTTP for a Prometheus scraper"""
+        return tracing.registry.serve(port, addr)
     def clear_cache(self):
         self.cache.clear()
+        if self.semantic_cache is not None:
+            self.semantic_cache.clear()
+        if self.stage_cache is not None:
+            self.stage_cache.clear()
         if self.verbose:
             print(" Cache cleared")
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+        if self._query_executor is not None:
+            self._query_executor.shutdown(wait=True)
+        if self._ingest_executor is not None:
+            self._ingest_executor.shutdown(wait=True)
+        self.generator.close()
+        # Hand shared models back to the registry; they are freed once no
+        # other OmniRAG instance in the process uses them.
+        release = getattr(self.llm, 'release', None)
+        if release is not None:
+            release()
+        self.vectordb.release_embedder()
+    def save_database(self, path):
+        self.vectordb.save(path)
+        manifest_path = os.path.join(path, self.INGEST_MANIFEST_FILE)
+        with open(manifest_path + ".tmp", 'w', encoding='utf-8') as f:
+            json.dump(self._ingest_manifest, f)
+        os.replace(manifest_path + ".tmp", manifest_path)
+    def load_database(self, path, mmap=True):
+        self.vectordb.load(path, mmap=mmap)
+        # Only files ingested into the loaded database count as already seen.
+        manifest_path = os.path.join(path, self.INGEST_MANIFEST_FILE)
+        self._ingest_manifest = {}
+        if os.path.exists(manifest_path):
+            with open(manifest_path, 'r', encoding='utf-8') as f:
+                self._ingest_manifest = json.load(f)
+        self.clear_cache()
     def clear_database(self):
         self.vectordb.clear()
+        self._ingest_manifest = {}
+        self.clear_cache()
         if self.verbose:
             print(" Database cleared")
@@ -0,0 +1,106 @@
+"""Pre-fork serving: load model weights once in a parent process, then fork workers.
+
+The workers inherit the parent's models through the process-wide model
+registry, so every OmniRAG instance they create (one per tenant, say) borrows
+the same weights. The forked pages stay shared copy-on-write as long as nobody
+writes to them, giving M workers and N tenants a single copy of each model.
+
+    from omnirag import OmniRAG, prefork
+
+    def worker(index):
+        tenants = {name: OmniRAG(model_name=MODEL) for name in TENANTS}
+        ...  # load each tenant's database and serve requests
+
+    prefork.run(worker, workers=4, preload=lambda: prefork.preload_models(MODEL))
+"""
+import gc
+import os
+import signal
+import sys
+import traceback
+from omnirag.llm_client import LLMClient
+from omnirag.vectordb_tool import VectorDBTool
+# Clients whose registry references keep the preloaded models alive.
+_preloaded = []
+def preload_models(model_name=None, embedding_model="all-MiniLM-L6-v2", use_4bit=False, cpu_mode=None,
+                   compile_model=False, quantized_cache_dir=None):
+    """Load an LLM and/or an embedding model into the model registry of this process
+    and hold a reference to each, so they are never freed before the workers fork.
+    use_4bit and cpu_mode pick the registry entry, so they must match what the
+    workers' clients ask for, or the workers load a second copy."""
+    if model_name:
+        llm = LLMClient(
+            model_name=model_name,
+            use_4bit=use_4bit,
+            cpu_mode=cpu_mode,
+            compile_model=compile_model,
+            quantized_cache_dir=quantized_cache_dir
+        )
+        llm.load()
+        _preloaded.append(llm)
+    if embedding_model:
+        vectordb = VectorDBTool(embedding_model=embedding_model)
+        vectordb.load_embedder()
+        _preloaded.append(vectordb)
+def run(worker, workers=2, preload=None, threads_per_worker=None):
+    """Call preload() here, then fork workers processes that each run worker(index).
+    Returns {index: exit code} once all have exited; SIGINT and SIGTERM are
+    forwarded to the workers. Must be called before this process starts any
+    threads or runs a model, since neither survives a fork."""
+    if not hasattr(os, 'fork'):
+        raise RuntimeError("Pre-fork mode needs os.fork (not available on this platform)")
+    if preload is not None:
+        preload()
+    # Move everything allocated so far out of the collector's reach: a
+    # collection in a worker would otherwise write to (and so copy) every
+    # page holding a tracked object.
+    gc.collect()
+    gc.freeze()
+    children = {}
+    try:
+        for index in range(workers):
+            pid = os.fork()
+            if pid == 0:
+                _run_worker(worker, index, threads_per_worker)
+            children[pid] = index
+        def forward(signum, frame):
+            for pid in children:
+                try:
+                    os.kill(pid, signum)
+                except ProcessLookupError:
+                    pass
+        previous = {signum: signal.signal(signum, forward) for signum in (signal.SIGINT, signal.SIGTERM)}
+        exit_codes = {}
+        try:
+            while len(exit_codes) < len(children):
+                pid, status = os.wait()
+                if pid in children:
+                    exit_codes[children[pid]] = _exit_code(status)
+        finally:
+            for signum, handler in previous.items():
+                signal.signal(signum, handler)
+    finally:
+        gc.unfreeze()
+    return dict(sorted(exit_codes.items()))
+def _exit_code(status):
+    """Exit code of a wait() status, or minus the signal that killed the process
+    (os.waitstatus_to_exitcode, which needs Python 3.9)"""
+    if os.WIFSIGNALED(status):
+        return -os.WTERMSIG(status)
+    return os.WEXITSTATUS(status)
+def _run_worker(worker, index, threads_per_worker):
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    code = 0
+    try:
+        if threads_per_worker and 'torch' in sys.modules:
+            sys.modules['torch'].set_num_threads(threads_per_worker)
+        worker(index)
+    except Exception:
+        traceback.print_exc()
+        code = 1
+    finally:
+        sys.stdout.flush()
+        sys.stderr.flush()
+    # Skip the parent's atexit handlers and buffered-file flushes.
+    os._exit(code)
@@ -0,0 +1,228 @@
+import contextvars
+import functools
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+# (trace, stage) of the query pipeline step running in this context.
+_current = contextvars.ContextVar('omnirag_trace', default=(None, None))
+class MetricsRegistry:
+    """Process-wide counters and latency histograms, exported in the Prometheus
+    text format. Hooks receive every finished span and query of every trace in
+    the process as an event dict."""
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self._counters = {}
+        self._histograms = {}
+        self._hooks = []
+        self._lock = threading.Lock()
+    def inc(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+    def observe(self, name, value, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = {'buckets': [0] * len(self.buckets), 'sum': 0.0, 'count': 0}
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    histogram['buckets'][i] += 1
+            histogram['sum'] += value
+            histogram['count'] += 1
+    def add_hook(self, hook):
+        with self._lock:
+            self._hooks.append(hook)
+    def remove_hook(self, hook):
+        with self._lock:
+            self._hooks.remove(hook)
+    def emit(self, event):
+        call_hooks(self._hooks, event)
+    def snapshot(self):
+        with self._lock:
+            return {
+                'counters': {self._series(name, labels): value for (name, labels), value in self._counters.items()},
+                'histograms': {
+                    self._series(name, labels): {'sum': h['sum'], 'count': h['count']}
+                    for (name, labels), h in self._histograms.items()
+                }
+            }
+    def render(self):
+        """All metrics in the Prometheus text exposition format"""
+        lines = []
+        with self._lock:
+            typed = set()
+            for (name, labels), value in sorted(self._counters.items()):
+                if name not in typed:
+                    lines.append(f"# TYPE {name} counter")
+                    typed.add(name)
+                lines.append(f"{self._series(name, labels)} {value}")
+            for (name, labels), h in sorted(self._histograms.items()):
+                if name not in typed:
+                    lines.append(f"# TYPE {name} histogram")
+                    typed.add(name)
+                for bound, count in zip(self.buckets, h['buckets']):
+                    lines.append(f"{self._series(name + '_bucket', labels + (('le', repr(bound)),))} {count}")
+                lines.append(f"{self._series(name + '_bucket', labels + (('le', '+Inf'),))} {h['count']}")
+                lines.append(f"{self._series(name + '_sum', labels)} {h['sum']}")
+                lines.append(f"{self._series(name + '_count', labels)} {h['count']}")
+        return "\n".join(lines) + "\n"
+    def serve(self, port=9464, addr=""):
+        """Serve render() over HTTP from a daemon thread; returns the server (call shutdown() to stop)"""
+        registry = self
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                body = registry.render().encode('utf-8')
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+            def log_message(self, *args):
+                pass
+        server = ThreadingHTTPServer((addr, port), Handler)
+        threading.Thread(target=server.serve_forever, name="omnirag-metrics", daemon=True).start()
+        return server
+    def reset(self):
+        with self._lock:
+            self._counters = {}
+            self._histograms = {}
+    def _series(self, name, labels):
+        if not labels:
+            return name
+        return name + "{" + ",".join(f'{key}="{value}"' for key, value in labels) + "}"
+def call_hooks(hooks, event):
+    for hook in list(hooks):
+        try:
+            hook(event)
+        except Exception as e:
+            print(f" Tracing hook error: {e}")
+registry = MetricsRegistry()
+class Trace:
+    """Timings, LLM usage and cache outcomes of one query. Spans may be recorded
+    from several threads; LLM usage is credited by the generation queue to the
+    trace and stage that were current when the prompt was submitted. Its finished
+    spans and the query go to the registry's hooks and to this trace's own hooks
+    (a list the owner may keep adding to)."""
+    def __init__(self, query=None, hooks=()):
+        self.query = query
+        self.hooks = hooks
+        self.started = time.perf_counter()
+        self.total_ms = None
+        self.spans = []
+        self.stages = {}
+        self.llm_calls = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.cache = {}
+        self._lock = threading.Lock()
+    @contextmanager
+    def span(self, name, **attrs):
+        """Time a pipeline stage; LLM calls submitted inside it are attributed to it"""
+        token = _current.set((self, name))
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            _current.reset(token)
+            self.add_span(name, time.perf_counter() - start, start, **attrs)
+    def add_span(self, name, seconds, start=None, **attrs):
+        record = {
+            'name': name,
+            'start_ms': 1000.0 * ((start or time.perf_counter() - seconds) - self.started),
+            'ms': 1000.0 * seconds,
+            **attrs
+        }
+        with self._lock:
+            self.spans.append(record)
+            stage = self._stage(name)
+            stage['calls'] += 1
+            stage['ms'] += record['ms']
+        registry.observe('omnirag_stage_seconds', seconds, stage=name)
+        self._emit({'type': 'span', **record})
+    def add_llm(self, stage, prompt_tokens, completion_tokens, seconds):
+        with self._lock:
+            self.llm_calls += 1
+            self.prompt_tokens += prompt_tokens
+            self.completion_tokens += completion_tokens
+            counters = self._stage(stage or 'other')
+            counters['llm_calls'] += 1
+            counters['llm_ms'] += 1000.0 * seconds
+            counters['prompt_tokens'] += prompt_tokens
+            counters['completion_tokens'] += completion_tokens
+    def add_cache(self, cache, hit):
+        with self._lock:
+            counters = self.cache.setdefault(cache, {'hits': 0, 'misses': 0})
+            counters['hits' if hit else 'misses'] += 1
+    def finish(self):
+        self.total_ms = 1000.0 * (time.perf_counter() - self.started)
+        registry.observe('omnirag_query_seconds', self.total_ms / 1000.0)
+        trace = self.to_dict()
+        self._emit({'type': 'query', 'query': self.query, 'trace': trace})
+        return trace
+    def to_dict(self):
+        with self._lock:
+            return {
+                'total_ms': self.total_ms,
+                'llm_calls': self.llm_calls,
+                'prompt_tokens': self.prompt_tokens,
+                'completion_tokens': self.completion_tokens,
+                'stages': {name: dict(counters) for name, counters in self.stages.items()},
+                'cache': {name: dict(counters) for name, counters in self.cache.items()},
+                'spans': [dict(span) for span in self.spans]
+            }
+    def _emit(self, event):
+        registry.emit(event)
+        call_hooks(self.hooks, event)
+    def _stage(self, name):
+        return self.stages.setdefault(name, {
+            'calls': 0, 'ms': 0.0, 'llm_calls': 0, 'llm_ms': 0.0, 'prompt_tokens': 0, 'completion_tokens': 0
+        })
+def current():
+    """(trace, stage) active in this context, or (None, None)"""
+    return _current.get()
+@contextmanager
+def use(trace, stage=None):
+    token = _current.set((trace, stage))
+    try:
+        yield
+    finally:
+        _current.reset(token)
+def bind(fn):
+    """Wrap fn so it runs under the caller's trace in whichever thread calls it"""
+    trace, stage = current()
+    @functools.wraps(fn)
+    def bound(*args, **kwargs):
+        with use(trace, stage):
+            return fn(*args, **kwargs)
+    return bound
+@contextmanager
+def timed(metric, span=None, **labels):
+    """Observe the block's duration in metric and, inside a traced query, add it as a span"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - start
+        registry.observe(metric, seconds, **labels)
+        trace, _ = current()
+        if trace is not None and span is not None:
+            trace.add_span(span, seconds, start)
+def record_cache(cache, hit):
+    registry.inc('omnirag_cache_lookups_total', cache=cache, result='hit' if hit else 'miss')
+    trace, _ = current()
+    if trace is not None:
+        trace.add_cache(cache, hit)
+def record_llm_usage(usage, seconds):
+    """Count one model call of len(usage) prompts, each {'prompt_tokens', 'completion_tokens'}"""
+    registry.inc('omnirag_llm_calls_total')
+    registry.inc('omnirag_llm_prompts_total', len(usage))
+    registry.inc('omnirag_llm_prompt_tokens_total', sum(u['prompt_tokens'] for u in usage))
+    registry.inc('omnirag_llm_completion_tokens_total', sum(u['completion_tokens'] for u in usage))
+    registry.observe('omnirag_llm_generate_seconds', seconds)
+def span(name, **attrs):
+    """Trace.span on the active trace; a no-op outside a traced query"""
+    trace, _ = current()
+    return trace.span(name, **attrs) if trace is not None else nullcontext()
@@ -1,32 +1,493 @@
-import faiss
+import os
+import json
+import time
+import hashlib
+import threading
 import numpy as np
-from sentence_transformers import SentenceTransformer
+from omnirag.model_registry import registry as model_registry
+from omnirag.document_store import DocumentStore
+from omnirag.embedding_cache import EmbeddingCache
+from omnirag.lexical_index import LexicalIndex
+from omnirag import tracing
+INDEX_TYPES = ("flat", "ivf_flat", "hnsw", "ivf_pq")
+RETRIEVAL_MODES = ("dense", "lexical", "hybrid")
+def reciprocal_rank_fusion(rankings, k=60):
+    """Fuse ranked lists of ids into [(id, score)], best first, scoring each id
+    by the sum of 1 / (k + rank) over the lists it appears in"""
+    scores = {}
+    for ranking in rankings:
+        for rank, item in enumerate(ranking, 1):
+            scores[item] = scores.get(item, 0.0) + 1.0 / (k + rank)
+    return sorted(scores.items(), key=lambda entry: entry[1], reverse=True)
+def create_index(index_type, dim, n_vectors, nlist=None, hnsw_m=32, pq_m=None):
+    """Create an empty (untrained) FAISS index of the given type sized for n_vectors"""
+    import faiss
+    if index_type == "flat":
+        return faiss.IndexFlatL2(dim)
+    if index_type == "hnsw":
+        return faiss.IndexHNSWFlat(dim, hnsw_m)
+    if nlist is None:
+        nlist = max(16, int(4 * np.sqrt(n_vectors)))
+    # FAISS wants ~39 training points per centroid.
+    nlist = max(1, min(nlist, n_vectors // 39))
+    quantizer = faiss.IndexFlatL2(dim)
+    if index_type == "ivf_flat":
+        return faiss.IndexIVFFlat(quantizer, dim, nlist)
+    if index_type == "ivf_pq":
+        if pq_m is None:
+            pq_m = next(m for m in (dim // 4, dim // 8, dim // 2, 1) if m and dim % m == 0)
+        return faiss.IndexIVFPQ(quantizer, dim, nlist, pq_m, 8)
+    raise ValueError(f"Unknown index type: {index_type} (expected one of {', '.join(INDEX_TYPES)})")
+def set_search_params(index, nprobe=None, ef_search=None):
+    import faiss
+    index = faiss.downcast_index(index)
+    if nprobe is not None and hasattr(index, 'nprobe'):
+        index.nprobe = nprobe
+    if ef_search is not None and hasattr(index, 'hnsw'):
+        index.hnsw.efSearch = ef_search
+def recall_report(index, exact_index, query_vectors, k=5, nprobe=(1, 4, 8, 16, 32), ef_search=(16, 32, 64, 128)):
+    """Measure recall@k against exact_index and mean per-query latency for each search setting of index"""
+    import faiss
+    query_vectors = np.asarray(query_vectors, dtype='float32')
+    _, truth = exact_index.search(query_vectors, k)
+    index = faiss.downcast_index(index)
+    if hasattr(index, 'nprobe'):
+        settings = [{'nprobe': value} for value in nprobe if value <= index.nlist]
+    elif hasattr(index, 'hnsw'):
+        settings = [{'ef_search': value} for value in ef_search]
+    else:
+        settings = [{}]
+    report = []
+    for params in settings:
+        set_search_params(index, **params)
+        start = time.perf_counter()
+        _, found = index.search(query_vectors, k)
+        elapsed = time.perf_counter() - start
+        hits = sum(len(set(f[f >= 0]) & set(t[t >= 0])) for f, t in zip(found, truth))
+        report.append({
+            **params,
+            'recall_at_k': hits / float(truth[truth >= 0].size or 1),
+            'latency_ms': 1000.0 * elapsed / len(query_vectors)
+        })
+    return report
 class VectorDBTool:
-    def __init__(self, embedding_model="all-MiniLM-L6-v2"):
-        print(f"Loading embedding model: {embedding_model}...")
-        self.embedder = SentenceTransformer(embedding_model)
-        self.embedding_dim = self.embedder.get_sentence_embedding_dimension()
-        self.index = faiss.IndexFlatL2(self.embedding_dim)
-        self.documents = []
-        print(f"FAISS VectorDB initialized (dim={self.embedding_dim})")
+    INDEX_FILE = "index.faiss"
+    META_FILE = "meta.json"
+    VARIANTS_FILE = "variants.jsonl"
+    FINGERPRINT_TEXT = "OmniRAG embedding model fingerprint"
+    def __init__(self,
+                 embedding_model="all-MiniLM-L6-v2",
+                 index_type="flat",
+                 ann_threshold=10000,
+                 nlist=None,
+                 hnsw_m=32,
+                 pq_m=None,
+                 nprobe=8,
+                 ef_search=64,
+                 embedding_cache_dir=None,
+                 encode_batch_size=256,
+                 embedder=None,
+                 shared=True,
+                 lexical_index=True,
+                 retrieval_mode="dense",
+                 rrf_k=60,
+                 lexical_min_score=0.3):
+        if index_type not in INDEX_TYPES:
+            raise ValueError(f"Unknown index type: {index_type} (expected one of {', '.join(INDEX_TYPES)})")
+        if retrieval_mode not in RETRIEVAL_MODES:
+            raise ValueError(f"Unknown retrieval mode: {retrieval_mode} (expected one of {', '.join(RETRIEVAL_MODES)})")
+        if retrieval_mode != "dense" and not lexical_index:
+            raise ValueError(f"Retrieval mode '{retrieval_mode}' needs lexical_index=True")
+        self.embedding_model = embedding_model
+        # Any object with SentenceTransformer's encode() and
+        # get_sentence_embedding_dimension() works; embedding_model names it.
+        # Without one, the model is loaded on first use, from the process-wide
+        # model registry when shared=True.
+        self._embedder = embedder
+        self.shared = shared
+        self._embedder_key = None
+        self._embedding_dim = None
+        self._load_lock = threading.Lock()
+        self.index_type = index_type
+        self.ann_threshold = ann_threshold
+        self.index_params = {'nlist': nlist, 'hnsw_m': hnsw_m, 'pq_m': pq_m}
+        self.search_params = {'nprobe': nprobe, 'ef_search': ef_search}
+        self._index = None
+        self.documents = DocumentStore()
+        self.variants = {}
+        # Ids of documents replaced by a newer version: they keep their place
+        # in the index and the store, but searches no longer return them.
+        self.deleted = set()
+        self._mapped_index_path = None
+        self.encode_batch_size = encode_batch_size
+        self.embedding_cache_dir = embedding_cache_dir
+        self._embedding_cache = None
+        self.embedding_stats = {'requested': 0, 'duplicates': 0, 'cache_hits': 0, 'encoded': 0}
+        # BM25 index over the same documents, for exact-term lookups that need
+        # no query embedding and for hybrid (dense + lexical) retrieval.
+        self.lexical = LexicalIndex() if lexical_index else None
+        self.retrieval_mode = retrieval_mode
+        self.rrf_k = rrf_k
+        # Lexical searches whose best BM25 score is below this fraction of the
+        # query's reference score (LexicalIndex.reference_score) go dense.
+        self.lexical_min_score = lexical_min_score
+        print(f"FAISS VectorDB initialized (index={index_type})")
+    @property
+    def embedder(self):
+        if self._embedder is None:
+            with self._load_lock:
+                if self._embedder is None:
+                    if self.shared:
+                        self._embedder = model_registry.acquire(self.embedder_key, self._load_embedder)
+                        self._embedder_key = self.embedder_key
+                    else:
+                        self._embedder = self._load_embedder()
+        return self._embedder
+    @property
+    def embedder_key(self):
+        """Registry key of the embedding model: (kind, name, dtype, quantization)"""
+        return ('embedder', self.embedding_model, 'float32', None)
+    @property
+    def embedding_dim(self):
+        if self._embedding_dim is None:
+            self._embedding_dim = self.embedder.get_sentence_embedding_dimension()
+        return self._embedding_dim
+    @property
+    def index(self):
+        if self._index is None:
+            import faiss
+            self._index = faiss.IndexFlatL2(self.embedding_dim)
+        return self._index
+    @index.setter
+    def index(self, index):
+        self._index = index
+    @property
+    def embedding_cache(self):
+        if self._embedding_cache is None and self.embedding_cache_dir:
+            # Key on the model's actual output as well as its name, so a
+            # re-trained model published under the same name never hits.
+            fingerprint = hashlib.sha256(np.round(self._fingerprint(), 4).tobytes()).hexdigest()[:16]
+            self._embedding_cache = EmbeddingCache(
+                self.embedding_cache_dir,
+                f"{self.embedding_model}:{self.embedding_dim}:{fingerprint}"
+            )
+        return self._embedding_cache
+    def load_embedder(self):
+        """Load the embedding model now instead of on the first add or search"""
+        return self.embedder
+    def release_embedder(self):
+        """Return a registry-loaded embedder; an injected one is kept"""
+        with self._load_lock:
+            if self._embedder_key is not None:
+                model_registry.release(self._embedder_key)
+                self._embedder = None
+                self._embedder_key = None
+    def _load_embedder(self):
+        from sentence_transformers import SentenceTransformer
+        print(f"Loading embedding model: {self.embedding_model}...")
+        return SentenceTransformer(self.embedding_model)
     def add_documents(self, documents):
         if not documents:
             return
-        embeddings = self.embedder.encode(documents, convert_to_numpy=True)
+        embeddings = self._embed_documents(documents)
+        self._ensure_writable_index()
         self.index.add(embeddings.astype('float32'))
         self.documents.extend(documents)
+        if self.lexical is not None:
+            self.lexical.add(documents)
         print(f"Added {len(documents)} documents to FAISS")
+        if self._needs_migration():
+            self.build_ann_index()
+    def _embed_documents(self, documents):
+        """Embed documents, encoding each distinct text once and only when it is not in the embedding cache"""
+        unique = {}
+        for text in documents:
+            unique.setdefault(text, None)
+        if self.embedding_cache is not None:
+            keys = {text: self.embedding_cache.key(text) for text in unique}
+            cached = self.embedding_cache.get_many(keys.values())
+            for text, key in keys.items():
+                unique[text] = cached.get(key)
+        misses = [text for text, vector in unique.items() if vector is None]
+        for i in range(0, len(misses), self.encode_batch_size):
+            batch = misses[i:i + self.encode_batch_size]
+            vectors = self.embedder.encode(
+                batch,
+                batch_size=min(len(batch), 64),
+                convert_to_numpy=True
+            ).astype('float32')
+            for text, vector in zip(batch, vectors):
+                unique[text] = vector
+            if self.embedding_cache is not None:
+                self.embedding_cache.put_many((keys[text], vector) for text, vector in zip(batch, vectors))
+        cache_hits = len(unique) - len(misses)
+        self.embedding_stats['requested'] += len(documents)
+        self.embedding_stats['duplicates'] += len(documents) - len(unique)
+        self.embedding_stats['cache_hits'] += cache_hits
+        self.embedding_stats['encoded'] += len(misses)
+        if len(misses) < len(documents):
+            print(
+                f"Embeddings: {len(misses)} encoded, {cache_hits} from cache, "
+                f"{len(documents) - len(unique)} duplicates ({1 - len(misses) / len(documents):.0%} saved)"
+            )
+        return np.stack([unique[text] for text in documents]).astype('float32')
+    def get_embedding_stats(self):
+        stats = dict(self.embedding_stats)
+        stats['encode_saved_rate'] = (
+            1 - stats['encoded'] / stats['requested'] if stats['requested'] else 0.0
+        )
+        if self._embedding_cache is not None:
+            stats['cache'] = self._embedding_cache.stats()
+        return stats
+    def build_ann_index(self):
+        """Train the configured ANN index on the vectors of the exact flat index and swap it in"""
+        if self.index_type == "flat" or self.current_index_type() != "flat" or self.index.ntotal == 0:
+            return
+        self._ensure_writable_index()
+        start = time.perf_counter()
+        vectors = self.index.reconstruct_n(0, self.index.ntotal)
+        index = create_index(self.index_type, self.embedding_dim, len(vectors), **self.index_params)
+        if not index.is_trained:
+            index.train(vectors)
+        index.add(vectors)
+        set_search_params(index, **self.search_params)
+        self.index = index
+        print(f"Migrated {len(vectors)} vectors to {self.index_type} index in {time.perf_counter() - start:.1f}s")
+    def set_search_params(self, nprobe=None, ef_search=None):
+        if nprobe is not None:
+            self.search_params['nprobe'] = nprobe
+        if ef_search is not None:
+            self.search_params['ef_search'] = ef_search
+        set_search_params(self.index, nprobe, ef_search)
+    def current_index_type(self):
+        import faiss
+        index = faiss.downcast_index(self.index)
+        if isinstance(index, faiss.IndexIVFPQ):
+            return "ivf_pq"
+        if isinstance(index, faiss.IndexIVFFlat):
+            return "ivf_flat"
+        if isinstance(index, faiss.IndexHNSWFlat):
+            return "hnsw"
+        return "flat"
+    def recall_report(self, queries, k=5, nprobe=(1, 4, 8, 16, 32), ef_search=(16, 32, 64, 128)):
+        """Recall@k and latency of the current index against an exact scan of the same vectors"""
+        import faiss
+        if self.current_index_type() == "flat":
+            print("Index is still exact (flat); nothing to compare")
+            return []
+        exact = faiss.IndexFlatL2(self.embedding_dim)
+        index = faiss.downcast_index(self.index)
+        if isinstance(index, faiss.IndexIVFPQ):
+            # PQ codes are lossy, so the ground truth has to come from fresh embeddings.
+            print(f"Re-embedding {self.count()} documents for exact ground truth...")
+            exact.add(self.embedder.encode(list(self.documents), convert_to_numpy=True).astype('float32'))
+        elif isinstance(index, faiss.IndexIVF):
+            index.make_direct_map()
+            exact.add(index.reconstruct_n(0, index.ntotal))
+            index.set_direct_map_type(faiss.DirectMap.NoMap)
+        else:
+            exact.add(index.reconstruct_n(0, index.ntotal))
+        query_vectors = self.embedder.encode(list(queries), convert_to_numpy=True)
+        report = recall_report(self.index, exact, query_vectors, k, nprobe, ef_search)
+        set_search_params(self.index, **self.search_params)
+        for row in report:
+            setting = ", ".join(f"{key}={row[key]}" for key in ('nprobe', 'ef_search') if key in row)
+            print(f"   {setting or 'default'}: recall@{k}={row['recall_at_k']:.3f} latency={row['latency_ms']:.3f}ms")
+        return report
     def search(self, query, top_k=5):
+        return [hit['text'] for hit in self.search_hits(query, top_k)]
+    def search_hits(self, query, top_k=5, mode=None):
+        """Search returning dicts with the document 'id', its 'text' and a 'score' (higher is closer).
+        mode (default: retrieval_mode) is "dense" (embedding similarity), "lexical"
+        (BM25 only, no query embedding; falls back to dense when the best match is
+        weak, see lexical_min_score)
+        or "hybrid" (both, merged by reciprocal rank fusion)."""
+        mode = mode or self.retrieval_mode
+        if mode not in RETRIEVAL_MODES:
+            raise ValueError(f"Unknown retrieval mode: {mode} (expected one of {', '.join(RETRIEVAL_MODES)})")
+        if mode != "dense" and self.lexical is None:
+            raise ValueError(f"Retrieval mode '{mode}' needs lexical_index=True")
         if self.count() == 0:
             return []
-        query_embedding = self.embedder.encode([query], convert_to_numpy=True)
-        k = min(top_k, self.count())
-        distances, indices = self.index.search(query_embedding.astype('float32'), k)
-        results = [self.documents[idx] for idx in indices[0]]
-        return results
+        if mode == "dense":
+            return self._dense_hits(query, top_k)
+        if mode == "lexical":
+            hits = self._lexical_hits(query, top_k)
+            if hits and hits[0]['score'] >= self.lexical_min_score * self.lexical.reference_score(query):
+                return hits
+            return self._dense_hits(query, top_k)
+        # Fuse deeper candidate lists than asked for, so a document ranked
+        # moderately by both retrievers can still make the top_k.
+        depth = max(4 * top_k, 20)
+        fused = reciprocal_rank_fusion(
+            [
+                [hit['id'] for hit in self._dense_hits(query, depth)],
+                [hit['id'] for hit in self._lexical_hits(query, depth)]
+            ],
+            k=self.rrf_k
+        )
+        return [
+            {'id': doc_id, 'text': self.documents[doc_id], 'score': score}
+            for doc_id, score in fused[:top_k]
+        ]
+    def _dense_hits(self, query, top_k):
+        with tracing.timed('omnirag_embed_query_seconds', span='embed_query'):
+            query_embedding = self.embedder.encode([query], convert_to_numpy=True)
+        # Fetch enough extra results that top_k remain once deleted ids are dropped.
+        k = min(top_k + len(self.deleted), self.count())
+        with tracing.timed('omnirag_vectordb_search_seconds', span='vectordb_search', index=self.current_index_type()):
+            distances, indices = self.index.search(query_embedding.astype('float32'), k)
+        return [
+            {'id': int(idx), 'text': self.documents[idx], 'score': -float(distance)}
+            for distance, idx in zip(distances[0], indices[0])
+            if idx >= 0 and int(idx) not in self.deleted
+        ][:top_k]
+    def _lexical_hits(self, query, top_k):
+        with tracing.timed('omnirag_lexical_search_seconds', span='lexical_search'):
+            ranked = self.lexical.search(query, top_k + len(self.deleted))
+        return [
+            {'id': doc_id, 'text': self.documents[doc_id], 'score': score}
+            for doc_id, score in ranked
+            if doc_id not in self.deleted
+        ][:top_k]
+    def delete(self, doc_ids):
+        """Stop returning documents from searches. Their ids are not reused, so the
+        ids of every other document stay valid."""
+        doc_ids = set(doc_ids)
+        self.deleted.update(doc_ids)
+        for variants in self.variants.values():
+            for doc_id in doc_ids:
+                variants.pop(doc_id, None)
+    def lexical_stats(self):
+        return self.lexical.stats() if self.lexical is not None else None
+    def get_variant(self, doc_id, user_level):
+        return self.variants.get(user_level, {}).get(doc_id)
+    def set_variants(self, user_level, variants):
+        """Store precomputed rewrites of documents for a user level, given as {doc_id: text}"""
+        self.variants.setdefault(user_level, {}).update(variants)
+    def missing_variants(self, user_level):
+        done = self.variants.get(user_level, {})
+        return [doc_id for doc_id in range(self.count()) if doc_id not in done and doc_id not in self.deleted]
+    def variant_counts(self):
+        return {user_level: len(variants) for user_level, variants in self.variants.items()}
     def count(self):
         return len(self.documents)
     def clear(self):
-        self.index.reset()
-        self.documents = []
+        self._index = None
+        self._mapped_index_path = None
+        self.documents = DocumentStore()
+        self.variants = {}
+        self.deleted = set()
+        if self.lexical is not None:
+            self.lexical = LexicalIndex(self.lexical.k1, self.lexical.b)
         print("FAISS database cleared")
+    def save(self, path):
+        """Persist the index, the documents and the embedding model identity to a directory"""
+        import faiss
+        os.makedirs(path, exist_ok=True)
+        index_path = os.path.join(path, self.INDEX_FILE)
+        faiss.write_index(self.index, index_path + ".tmp")
+        os.replace(index_path + ".tmp", index_path)
+        self.documents.save(path)
+        variants_path = os.path.join(path, self.VARIANTS_FILE)
+        with open(variants_path + ".tmp", 'w', encoding='utf-8') as f:
+            for user_level, variants in list(self.variants.items()):
+                for doc_id, text in list(variants.items()):
+                    f.write(json.dumps({'id': doc_id, 'level': user_level, 'text': text}) + "\n")
+        os.replace(variants_path + ".tmp", variants_path)
+        if self.lexical is not None:
+            self.lexical.save(path)
+        meta = {
+            'format_version': 1,
+            'embedding_model': self.embedding_model,
+            'embedding_dim': self.embedding_dim,
+            'index_type': self.current_index_type(),
+            'fingerprint': self._fingerprint().tolist(),
+            'count': self.count(),
+            'deleted': sorted(self.deleted)
+        }
+        with open(os.path.join(path, self.META_FILE), 'w', encoding='utf-8') as f:
+            json.dump(meta, f)
+        print(f"Saved {self.count()} documents to {path}")
+    def load(self, path, mmap=True):
+        """Load a store written by save(). With mmap=True the index and the document
+        text are memory-mapped read-only, so worker processes share their pages."""
+        import faiss
+        with open(os.path.join(path, self.META_FILE), 'r', encoding='utf-8') as f:
+            meta = json.load(f)
+        self._check_embedding_model(meta)
+        index_path = os.path.join(path, self.INDEX_FILE)
+        if mmap:
+            flags = getattr(faiss, 'IO_FLAG_MMAP_IFC', faiss.IO_FLAG_MMAP) | faiss.IO_FLAG_READ_ONLY
+            index = faiss.read_index(index_path, flags)
+        else:
+            index = faiss.read_index(index_path)
+        documents = DocumentStore.load(path, mmap_mode=mmap)
+        if index.ntotal != len(documents):
+            raise ValueError(
+                f"Corrupt store at {path}: index has {index.ntotal} vectors "
+                f"but {len(documents)} documents"
+            )
+        variants = {}
+        variants_path = os.path.join(path, self.VARIANTS_FILE)
+        if os.path.exists(variants_path):
+            with open(variants_path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    record = json.loads(line)
+                    variants.setdefault(record['level'], {})[record['id']] = record['text']
+        lexical = None
+        if self.lexical is not None:
+            lexical = self._load_lexical(path, documents, mmap)
+        set_search_params(index, **self.search_params)
+        self.index = index
+        self.documents = documents
+        self.variants = variants
+        self.deleted = set(meta.get('deleted', []))
+        self.lexical = lexical
+        self._mapped_index_path = index_path if mmap else None
+        print(f"Loaded {self.count()} documents from {path}{' (memory-mapped)' if mmap else ''}")
+    def _load_lexical(self, path, documents, mmap):
+        """The saved lexical index of a store, or one built from its documents
+        if the store was saved without it"""
+        if not LexicalIndex.exists(path):
+            lexical = LexicalIndex(self.lexical.k1, self.lexical.b)
+            for start in range(0, len(documents), self.encode_batch_size):
+                lexical.add(documents[start:start + self.encode_batch_size])
+            lexical.compact()
+            print(f"Built lexical index for {len(documents)} documents")
+            return lexical
+        lexical = LexicalIndex.load(path, mmap_mode=mmap, k1=self.lexical.k1, b=self.lexical.b)
+        if len(lexical) != len(documents):
+            raise ValueError(
+                f"Corrupt store at {path}: lexical index has {len(lexical)} documents "
+                f"but the store has {len(documents)}"
+            )
+        return lexical
+    def _fingerprint(self):
+        return self.embedder.encode([self.FINGERPRINT_TEXT], convert_to_numpy=True)[0].astype('float32')
+    def _check_embedding_model(self, meta):
+        if meta.get('embedding_model') != self.embedding_model or meta.get('embedding_dim') != self.embedding_dim:
+            raise ValueError(
+                f"Store was built with embedding model '{meta.get('embedding_model')}' "
+                f"(dim={meta.get('embedding_dim')}), but this VectorDBTool uses "
+                f"'{self.embedding_model}' (dim={self.embedding_dim})"
+            )
+        stored = np.asarray(meta.get('fingerprint', []), dtype='float32')
+        if stored.shape != (self.embedding_dim,) or not np.allclose(stored, self._fingerprint(), atol=1e-3):
+            raise ValueError(
+                f"Embedding model '{self.embedding_model}' produces different vectors than the "
+                "model the store was built with; re-embed the corpus instead of loading it"
+            )
+    def _needs_migration(self):
+        return (
+            self.index_type != "flat"
+            and self.current_index_type() == "flat"
+            and self.index.ntotal >= self.ann_threshold
+        )
+    def _ensure_writable_index(self):
+        import faiss
+        # A memory-mapped index is read-only; the first write loads a private copy.
+        if self._mapped_index_path is not None:
+            self.index = faiss.read_index(self._mapped_index_path)
+            set_search_params(self.index, **self.search_params)
+            self._mapped_index_path = None
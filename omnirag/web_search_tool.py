@@ -1,7 +1,11 @@
+from omnirag import tracing
 class WebSearchTool:
     def __init__(self):
         self.enabled = True
     def search(self, query, max_results=3):
+        with tracing.timed('omnirag_web_search_seconds', span='web_search'):
+            return self._search(query, max_results)
+    def _search(self, query, max_results):
         try:
             try:
                 from ddgs import DDGS
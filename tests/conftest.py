@@ -0,0 +1,11 @@
+import contextlib
+import io
+import pytest
+from benchmarks.stubs import StubEmbedder, StubLLM
+from omnirag import OmniRAG
+@pytest.fixture
+def rag():
+    with contextlib.redirect_stdout(io.StringIO()):
+        instance = OmniRAG(llm=StubLLM(), embedder=StubEmbedder(dim=64), embedding_model="stub-embedder")
+    yield instance
+    instance.close()
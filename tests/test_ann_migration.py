@@ -0,0 +1,45 @@
+import contextlib
+import io
+import pytest
+from omnirag.vectordb_tool import VectorDBTool
+from benchmarks.stubs import StubEmbedder
+DOCUMENTS = [f"Chunk {i} covers area {i % 13} with note {i % 29} and item {i}." for i in range(600)]
+QUERIES = [f"area {i % 13} note {i % 29}" for i in range(0, 60, 3)]
+def build(index_type, **kwargs):
+    with contextlib.redirect_stdout(io.StringIO()):
+        db = VectorDBTool(
+            embedding_model="stub-embedder",
+            embedder=StubEmbedder(dim=32),
+            index_type=index_type,
+            ann_threshold=500,
+            **kwargs
+        )
+        for start in range(0, len(DOCUMENTS), 100):
+            db.add_documents(DOCUMENTS[start:start + 100])
+    return db
+def ids(db, query):
+    return [hit['id'] for hit in db.search_hits(query, top_k=5, mode="dense")]
+def scores(db, query):
+    # Many stub chunks tie on distance, so results are compared by score.
+    return [round(hit['score'], 4) for hit in db.search_hits(query, top_k=5, mode="dense")]
+@pytest.mark.parametrize("index_type, kwargs, min_recall", [
+    ("ivf_flat", {'nprobe': 1024}, 1.0),
+    ("hnsw", {'ef_search': 256}, 0.95)
+])
+def test_migration_keeps_results(index_type, kwargs, min_recall):
+    exact = build("flat")
+    db = build(index_type, **kwargs)
+    assert exact.current_index_type() == "flat"
+    assert db.current_index_type() == index_type
+    assert db.count() == exact.count() == len(DOCUMENTS)
+    matching = sum(scores(db, q) == scores(exact, q) for q in QUERIES)
+    assert matching / len(QUERIES) >= min_recall
+    with contextlib.redirect_stdout(io.StringIO()):
+        db.add_documents(["A chunk added after the migration."])
+    assert db.current_index_type() == index_type
+    assert ids(db, "A chunk added after the migration.")[0] == len(DOCUMENTS)
+def test_below_threshold_the_index_stays_exact():
+    with contextlib.redirect_stdout(io.StringIO()):
+        db = VectorDBTool(embedding_model="stub-embedder", embedder=StubEmbedder(dim=32), index_type="hnsw")
+        db.add_documents(DOCUMENTS[:100])
+    assert db.current_index_type() == "flat"
@@ -0,0 +1,27 @@
+import asyncio
+import contextlib
+import io
+from benchmarks.stubs import StubEmbedder, StubLLM
+from omnirag import OmniRAG
+def test_concurrent_aqueries_share_generation_batches():
+    with contextlib.redirect_stdout(io.StringIO()):
+        rag = OmniRAG(
+            llm=StubLLM(decode_ms_per_token=1.0),
+            embedder=StubEmbedder(dim=64),
+            embedding_model="stub-embedder",
+            semantic_cache_threshold=None,
+            batch_window_ms=50
+        )
+    try:
+        rag.add_documents([f"Document {i} explains topic {i} of networking." for i in range(20)], background=False)
+        queries = [f"Explain networking topic {i}" for i in range(8)]
+        async def run():
+            return await asyncio.gather(*[rag.aquery(q, force_complexity="beginner", profile="fast") for q in queries])
+        results = asyncio.run(run())
+        assert len(results) == len(queries)
+        assert all(r['answer'] for r in results)
+        stats = rag.generator.stats()
+        assert stats['avg_batch_size'] > 1
+        assert stats['batches_run'] < stats['prompts_run']
+    finally:
+        rag.close()
@@ -0,0 +1,39 @@
+from omnirag.budget import BudgetPlanner, LatencyModel
+STAGE_MS = {'classify': 50, 'decompose': 10, 'retrieve': 20, 'transform': 400, 'answer': 500, 'synthesis': 200, 'polish': 300}
+def latency(ms_per_token=None):
+    model = LatencyModel(alpha=1.0)
+    stages = {stage: {'ms': ms, 'llm_ms': 0.0, 'completion_tokens': 0} for stage, ms in STAGE_MS.items()}
+    if ms_per_token:
+        stages['answer'].update(llm_ms=100 * ms_per_token, completion_tokens=100)
+    model.observe({'stages': stages})
+    return model
+def test_profile_skips_are_not_degradation():
+    budget = BudgetPlanner("fast", latency=latency())
+    assert {skip['stage'] for skip in budget.skipped} == {'classify', 'transform', 'synthesis', 'polish'}
+    assert {skip['reason'] for skip in budget.skipped} == {'profile'}
+    assert not budget.degraded
+    assert not budget.run('synthesis')
+def test_deadline_drops_stages_in_drop_order_until_the_estimate_fits():
+    budget = BudgetPlanner("quality", deadline_ms=800, latency=latency())
+    assert budget.skipped == [{'stage': 'transform', 'reason': 'deadline'}, {'stage': 'polish', 'reason': 'deadline'}]
+    assert budget.degraded
+    assert budget.run('classify') and budget.run('synthesis')
+    assert not budget.run('transform')
+def test_no_deadline_runs_every_stage():
+    budget = BudgetPlanner("quality", latency=latency())
+    assert budget.skipped == [] and not budget.degraded
+    assert all(budget.run(stage) for stage in ('classify', 'transform', 'synthesis', 'polish'))
+def test_stage_is_skipped_once_the_remaining_budget_is_spent():
+    budget = BudgetPlanner("quality", deadline_ms=1300, latency=latency())
+    assert budget.skipped == [{'stage': 'transform', 'reason': 'deadline'}]
+    budget.started -= 1.0
+    assert not budget.run('polish')
+    assert {'stage': 'polish', 'reason': 'deadline'} in budget.metadata()['skipped']
+def test_generations_are_shortened_to_the_remaining_budget():
+    budget = BudgetPlanner("quality", deadline_ms=1000, latency=latency(ms_per_token=5.0), min_tokens=32)
+    tokens = budget.max_tokens('answer')
+    assert 32 <= tokens < 300
+    assert budget.shortened == {'answer': tokens}
+    budget.started -= 10.0
+    assert budget.max_tokens('synthesis') == 32
+    assert budget.degraded
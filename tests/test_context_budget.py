@@ -0,0 +1,17 @@
+from omnirag.context_packer import ContextPacker
+class WordTokenizer:
+    def encode(self, text, add_special_tokens=False):
+        return text.split()
+    def decode(self, ids, skip_special_tokens=True):
+        return " ".join(ids)
+def test_default_budget_fits_default_chunks(rag):
+    chunk = " ".join(["word"] * 500)
+    context = rag.context_packer.pack([chunk] * 3, [3.0, 2.0, 1.0])
+    assert context.count(chunk) == 3
+    assert rag.context_packer.stats()['chunks_dropped'] == 0
+def test_default_budget_respects_a_small_window(rag):
+    rag.llm.tokenizer.model_max_length = 2048
+    assert rag._default_context_tokens() == 2048 - 300 - rag.PROMPT_OVERHEAD_TOKENS
+def test_explicit_budget_is_kept():
+    packer = ContextPacker(WordTokenizer(), max_tokens=10)
+    assert packer.pack(["a b c d e f", "g h i j k l"], [2.0, 1.0]) == "a b c d e f"
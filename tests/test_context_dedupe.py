@@ -0,0 +1,23 @@
+from omnirag.context_packer import ContextPacker
+def hit(doc_id, score):
+    return {'id': doc_id, 'text': f"chunk {doc_id}", 'score': score}
+def test_dedupe_keeps_a_chunk_where_it_ranks_best_across_score_scales():
+    # A BM25 list (large positive scores) and a dense list (negated L2
+    # distances): chunk 7 is the dense list's best hit but only the BM25
+    # list's third, so it belongs to the dense list.
+    lexical = [hit(1, 14.2), hit(2, 11.0), hit(7, 9.5)]
+    dense = [hit(7, -0.21), hit(3, -0.35)]
+    kept = ContextPacker(max_tokens=None).dedupe([lexical, dense])
+    assert [h['id'] for h in kept[0]] == [1, 2]
+    assert [h['id'] for h in kept[1]] == [7, 3]
+def test_dedupe_tie_goes_to_the_first_list():
+    packer = ContextPacker(max_tokens=None)
+    kept = packer.dedupe([[hit(5, 0.016), hit(6, 0.015)], [hit(7, -0.1), hit(6, -0.2)]])
+    assert [[h['id'] for h in hits] for hits in kept] == [[5, 6], [7]]
+    assert packer.stats()['duplicates_removed'] == 1
+def test_sub_queries_with_identical_hits_each_keep_their_top_hit():
+    packer = ContextPacker(max_tokens=None)
+    same = [hit(1, 0.9), hit(2, 0.8), hit(3, 0.7)]
+    kept = packer.dedupe([list(same), list(same), [hit(1, 0.5), hit(1, 0.5)]])
+    assert [[h['id'] for h in hits] for hits in kept] == [[1, 2, 3], [1], [1]]
+    assert all(packer.pack([h['text'] for h in hits], [h['score'] for h in hits]) for hits in kept)
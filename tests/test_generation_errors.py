@@ -0,0 +1,31 @@
+import pytest
+from benchmarks.stubs import StubTokenizer
+from omnirag.generation_queue import GenerationQueue
+from omnirag.llm_client import LLMClient
+def failing_client(monkeypatch):
+    client = LLMClient(model_name="Qwen/Qwen2.5-0.5B-Instruct")
+    def fail(*args, **kwargs):
+        raise ValueError("Unable to create tensor")
+    monkeypatch.setattr(client, '_generate_qwen', fail)
+    return client
+@pytest.mark.parametrize("prompts", [["a"], ["a", "b", "c"]])
+def test_failed_batch_raises_instead_of_empty_answers(monkeypatch, prompts):
+    client = failing_client(monkeypatch)
+    with pytest.raises(ValueError):
+        client.generate_batch(prompts)
+    queue = GenerationQueue(client)
+    try:
+        futures = queue.submit_batch(prompts)
+        for future in futures:
+            with pytest.raises(ValueError):
+                future.result(timeout=10)
+    finally:
+        queue.close()
+def test_direct_generate_still_returns_empty_on_failure(monkeypatch, capsys):
+    assert failing_client(monkeypatch).generate("a") == ""
+    assert "Generation error" in capsys.readouterr().out
+def test_packer_has_its_own_tokenizer(rag):
+    own = StubTokenizer()
+    rag.llm.new_tokenizer = lambda: own
+    assert rag.context_packer.tokenizer is own
+    assert rag.context_packer.count_tokens("one two three") == 3
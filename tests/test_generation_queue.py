@@ -0,0 +1,47 @@
+import threading
+from omnirag.generation_queue import GenerationQueue
+class RecordingLLM:
+    batch_size = 8
+    def __init__(self):
+        self.batches = []
+        self.last_usage = []
+        self._lock = threading.Lock()
+    def generate_batch(self, prompts, max_tokens=512, temperature=0.75, system_prompt=None):
+        with self._lock:
+            self.batches.append((list(prompts), max_tokens))
+        self.last_usage = [{'prompt_tokens': 1, 'completion_tokens': 1} for _ in prompts]
+        return [f"{prompt}:{max_tokens}" for prompt in prompts]
+    def generate_stream(self, prompt, max_tokens=512, temperature=0.75, system_prompt=None):
+        self.last_usage = [{'prompt_tokens': 1, 'completion_tokens': 3}]
+        yield from ("streamed ", "answer ", "here")
+def test_requests_with_the_same_params_share_a_batch():
+    llm = RecordingLLM()
+    queue = GenerationQueue(llm, batch_window_ms=200)
+    try:
+        short = queue.submit_batch(["a", "b"], max_tokens=50)
+        long = queue.submit("c", max_tokens=300)
+        more_short = queue.submit("d", max_tokens=50)
+        assert [f.result(timeout=10) for f in short + [more_short]] == ["a:50", "b:50", "d:50"]
+        assert long.result(timeout=10) == "c:300"
+    finally:
+        queue.close()
+    assert sorted(llm.batches) == [(["a", "b", "d"], 50), (["c"], 300)]
+    assert queue.stats()['batches_run'] == 2
+def test_batches_are_capped_at_max_batch_size():
+    llm = RecordingLLM()
+    queue = GenerationQueue(llm, max_batch_size=2, batch_window_ms=200)
+    try:
+        assert queue.generate_batch(["a", "b", "c"]) == ["a:512", "b:512", "c:512"]
+    finally:
+        queue.close()
+    assert [len(prompts) for prompts, _ in llm.batches] == [2, 1]
+def test_streaming_request_runs_alone_through_its_sink():
+    llm = RecordingLLM()
+    queue = GenerationQueue(llm)
+    try:
+        assert list(queue.generate_stream("q")) == ["streamed ", "answer ", "here"]
+        assert queue.generate("after") == "after:512"
+    finally:
+        queue.close()
+    assert llm.batches == [(["after"], 512)]
+    assert queue.stats()['prompts_run'] == 2
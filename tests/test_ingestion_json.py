@@ -0,0 +1,42 @@
+import json
+import random
+import pytest
+from omnirag.ingestion import iter_json_records
+def write(tmp_path, text, name="data.json"):
+    path = tmp_path / name
+    path.write_text(text, encoding='utf-8')
+    return str(path)
+@pytest.mark.parametrize("read_size", [1, 2, 3, 64])
+def test_leading_whitespace_spanning_reads(tmp_path, read_size):
+    path = write(tmp_path, "  [1]")
+    assert list(iter_json_records(path, read_size=read_size)) == [1]
+def test_number_split_at_read_boundary(tmp_path):
+    path = write(tmp_path, "[1.5, 2]")
+    assert list(iter_json_records(path, read_size=3)) == [1.5, 2]
+def test_single_document(tmp_path):
+    path = write(tmp_path, '  {"a": [1, 2]}')
+    assert list(iter_json_records(path, read_size=1)) == [{'a': [1, 2]}]
+def random_value(rng, depth=0):
+    kind = rng.randrange(7 if depth < 2 else 5)
+    if kind == 0:
+        return rng.randint(-10**6, 10**6)
+    if kind == 1:
+        return rng.choice([rng.uniform(-1e3, 1e3), rng.uniform(-1, 1) * 10 ** rng.randint(-8, 8)])
+    if kind == 2:
+        return "".join(rng.choice("ab ,]\\\"é1.") for _ in range(rng.randrange(8)))
+    if kind == 3:
+        return rng.choice([True, False, None])
+    if kind == 4:
+        return -rng.random()
+    if kind == 5:
+        return [random_value(rng, depth + 1) for _ in range(rng.randrange(4))]
+    return {f"k{i}": random_value(rng, depth + 1) for i in range(rng.randrange(4))}
+def test_random_arrays_through_small_reads(tmp_path):
+    rng = random.Random(0)
+    for case in range(200):
+        items = [random_value(rng) for _ in range(rng.randrange(12))]
+        separators = rng.choice([(",", ":"), (", ", ": "), (" ,\n ", " : ")])
+        text = " " * rng.randrange(4) + json.dumps(items, separators=separators)
+        path = write(tmp_path, text, f"case{case}.json")
+        for read_size in (1, 2, 3, 5, 8):
+            assert list(iter_json_records(path, read_size=read_size)) == items, (text, read_size)
@@ -0,0 +1,46 @@
+import os
+def write_corpus(directory, files=3):
+    for i in range(files):
+        with open(os.path.join(directory, f"doc{i}.txt"), 'w', encoding='utf-8') as f:
+            f.write(f"Document {i} explains topic {i} in a few plain words.")
+def test_clear_database_then_reload_directory(rag, tmp_path):
+    write_corpus(tmp_path)
+    first = rag.load_directory(str(tmp_path), workers=1)
+    assert first['ingested'] == 3
+    assert rag.load_directory(str(tmp_path), workers=1)['skipped'] == 3
+    rag.clear_database()
+    again = rag.load_directory(str(tmp_path), workers=1)
+    assert again['ingested'] == 3
+    assert rag.vectordb.count() == first['chunks']
+def test_load_database_restores_its_own_manifest(rag, tmp_path):
+    corpus = tmp_path / "corpus"
+    corpus.mkdir()
+    write_corpus(corpus)
+    empty = tmp_path / "empty"
+    rag.save_database(str(empty))
+    rag.load_directory(str(corpus), workers=1)
+    saved = tmp_path / "saved"
+    rag.save_database(str(saved))
+    rag.load_database(str(empty), mmap=False)
+    assert rag.load_directory(str(corpus), workers=1)['ingested'] == 3
+    rag.load_database(str(saved), mmap=False)
+    assert rag.load_directory(str(corpus), workers=1)['skipped'] == 3
+def test_edited_file_replaces_its_old_chunks(rag, tmp_path):
+    corpus = tmp_path / "corpus"
+    corpus.mkdir()
+    write_corpus(corpus)
+    edited = corpus / "doc1.txt"
+    rag.load_directory(str(corpus), workers=1)
+    for version in ("second", "third"):
+        edited.write_text(f"Document 1 now covers the {version} draft of the quokka protocol.", encoding='utf-8')
+        os.utime(edited, ns=(edited.stat().st_mtime_ns + 10 ** 9,) * 2)
+        assert rag.load_directory(str(corpus), workers=1)['ingested'] == 1
+    for mode in ("dense", "lexical", "hybrid"):
+        texts = [hit['text'] for hit in rag.vectordb.search_hits("Document 1 quokka protocol topic", top_k=10, mode=mode)]
+        doc1 = [text for text in texts if text.startswith("Document 1 ")]
+        assert doc1 == ["Document 1 now covers the third draft of the quokka protocol."], mode
+    saved = tmp_path / "saved"
+    rag.save_database(str(saved))
+    rag.load_database(str(saved), mmap=False)
+    assert rag.vectordb.deleted == {1, 3}
+    assert 1 not in rag.vectordb.missing_variants("beginner")
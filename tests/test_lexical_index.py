@@ -0,0 +1,55 @@
+import math
+import pytest
+from omnirag.lexical_index import LexicalIndex, tokenize
+DOCUMENTS = [
+    "The parser raised ERR_CONN-42 twice.",
+    "A parser reads tokens and builds a tree of tokens.",
+    "Trees and graphs are data structures.",
+    "Nothing relevant is in this one."
+]
+def bm25(query, documents, k1=1.2, b=0.75):
+    """Reference BM25 over tokenize(), one score per document"""
+    docs = [tokenize(text) for text in documents]
+    avg_length = sum(len(doc) for doc in docs) / len(docs)
+    scores = []
+    for doc in docs:
+        score = 0.0
+        for term in set(tokenize(query)):
+            df = sum(term in other for other in docs)
+            tf = doc.count(term)
+            if not tf:
+                continue
+            idf = math.log(1.0 + (len(docs) - df + 0.5) / (df + 0.5))
+            score += idf * tf * (k1 + 1.0) / (tf + k1 * (1.0 - b + b * len(doc) / avg_length))
+        scores.append(score)
+    return scores
+def test_tokenize_keeps_identifiers_and_drops_stopwords():
+    assert tokenize("What is ERR_CONN-42 in v2.3 of the parser?") == ["err_conn-42", "v2.3", "parser"]
+@pytest.mark.parametrize("query", ["parser tokens", "ERR_CONN-42", "trees data", "the parser of a tree"])
+def test_scores_match_bm25(query):
+    index = LexicalIndex()
+    index.add(DOCUMENTS[:2])
+    index.add(DOCUMENTS[2:])
+    expected = bm25(query, DOCUMENTS)
+    ranked = index.search(query, top_k=len(DOCUMENTS))
+    assert [doc_id for doc_id, _ in ranked] == sorted(
+        (i for i, score in enumerate(expected) if score > 0), key=lambda i: -expected[i]
+    )
+    for doc_id, score in ranked:
+        assert score == pytest.approx(expected[doc_id], rel=1e-5)
+def test_stopwords_neither_match_nor_count_towards_length():
+    index = LexicalIndex()
+    index.add(DOCUMENTS)
+    assert index.search("is this the one", top_k=4) == [(3, pytest.approx(bm25("one", DOCUMENTS)[3], rel=1e-5))]
+    assert index.search("what is it", top_k=4) == []
+    assert index.reference_score("what is it") == 0.0
+    assert index.reference_score("parser") > 0.0
+def test_saved_index_loads_memory_mapped(tmp_path):
+    index = LexicalIndex()
+    index.add(DOCUMENTS)
+    index.save(str(tmp_path))
+    assert LexicalIndex.exists(str(tmp_path))
+    loaded = LexicalIndex.load(str(tmp_path))
+    assert loaded.search("parser tokens", top_k=3) == index.search("parser tokens", top_k=3)
+    loaded.add(["Another parser document."])
+    assert loaded.search("another parser", top_k=1)[0][0] == len(DOCUMENTS)
@@ -0,0 +1,36 @@
+import contextlib
+import io
+import pytest
+from omnirag.agentic_planner import AgenticPlanner
+from omnirag.lexical_index import LexicalIndex
+from omnirag.vectordb_tool import VectorDBTool
+from benchmarks.stubs import StubEmbedder
+@pytest.mark.parametrize("query", ["What is AI?", "How does DNS work?", "Explain SQL joins"])
+def test_acronym_queries_are_fused_with_dense(query):
+    assert AgenticPlanner(None).plan(query, lexical_available=True)['tool'] == 'hybrid'
+@pytest.mark.parametrize("query", [
+    "What does ERR_CONN_RESET mean?", "ECONNREFUSED 111", "E1234 on startup", "getUserName", '"connection reset by peer"'
+])
+def test_identifier_queries_skip_the_embedding(query):
+    assert AgenticPlanner(None).plan(query, lexical_available=True)['tool'] == 'lexical'
+def test_plain_questions_stay_dense():
+    planner = AgenticPlanner(None)
+    assert planner.plan("What is AI?", lexical_available=False)['tool'] == 'vectordb'
+    assert planner.plan("Why do neural networks generalize so well?", lexical_available=True)['tool'] == 'vectordb'
+def test_stopwords_do_not_score():
+    index = LexicalIndex()
+    index.add([f"What is the point of step {i} and how does it work?" for i in range(50)] + ["AI systems learn from data."])
+    assert index.search("What is AI?", top_k=1)[0][0] == 50
+    assert index.search("what is it", top_k=5) == []
+def make_db(documents):
+    with contextlib.redirect_stdout(io.StringIO()):
+        db = VectorDBTool(embedding_model="stub-embedder", embedder=StubEmbedder(dim=32))
+        db.add_documents(documents)
+    return db
+def test_weak_lexical_match_falls_back_to_dense():
+    db = make_db([f"Chunk {i} describes the system in general terms." for i in range(40)] + ["The quokka parser reads tokens."])
+    weak = "system zebra giraffe pelican"
+    assert db.search_hits(weak, top_k=3, mode="lexical") == db._dense_hits(weak, 3)
+    strong = db.search_hits("quokka parser", top_k=3, mode="lexical")
+    assert strong == db._lexical_hits("quokka parser", 3)
+    assert strong[0]['id'] == 40
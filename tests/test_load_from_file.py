@@ -0,0 +1,23 @@
+import builtins
+import pytest
+def test_missing_dependency_is_not_reported_as_pypdf2(rag, tmp_path, monkeypatch, capsys):
+    path = tmp_path / "notes.txt"
+    path.write_text("Some plain text about retrieval.", encoding='utf-8')
+    def add_documents(documents):
+        raise ImportError("No module named 'faiss'")
+    monkeypatch.setattr(rag.vectordb, 'add_documents', add_documents)
+    with pytest.raises(ImportError, match="faiss"):
+        rag.load_from_file(str(path))
+    assert "PyPDF2" not in capsys.readouterr().out
+def test_missing_pdf_reader_is_reported(rag, tmp_path, monkeypatch, capsys):
+    path = tmp_path / "paper.pdf"
+    path.write_bytes(b"%PDF-1.4")
+    real_import = builtins.__import__
+    def fake_import(name, *args, **kwargs):
+        if name == 'PyPDF2':
+            raise ImportError(name)
+        return real_import(name, *args, **kwargs)
+    monkeypatch.setattr(builtins, '__import__', fake_import)
+    report = rag.load_from_file(str(path))
+    assert report['chunks'] == 0
+    assert "PyPDF2 not installed" in capsys.readouterr().out
@@ -0,0 +1,37 @@
+import threading
+import time
+import pytest
+from omnirag.model_registry import ModelRegistry
+def test_concurrent_acquire_loads_once():
+    registry = ModelRegistry()
+    calls = []
+    def loader():
+        calls.append(1)
+        time.sleep(0.05)
+        return object()
+    start = threading.Barrier(8)
+    models = []
+    def acquire():
+        start.wait()
+        models.append(registry.acquire('model', loader))
+    threads = [threading.Thread(target=acquire) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(calls) == 1
+    assert len({id(model) for model in models}) == 1
+    assert registry.refs('model') == 8
+    for _ in range(7):
+        assert not registry.release('model')
+    assert registry.release('model')
+    assert registry.refs('model') == 0
+def test_failed_load_is_retried():
+    registry = ModelRegistry()
+    def failing():
+        raise RuntimeError("no weights")
+    with pytest.raises(RuntimeError):
+        registry.acquire('model', failing)
+    assert registry.keys() == []
+    assert registry.acquire('model', lambda: "model") == "model"
+    assert registry.refs('model') == 1
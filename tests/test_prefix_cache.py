@@ -0,0 +1,35 @@
+import types
+import torch
+import transformers
+from omnirag.llm_client import LLMClient
+class FakeTokenizer:
+    def __call__(self, text, return_tensors=None):
+        return types.SimpleNamespace(input_ids=torch.arange(1, len(text.split()) + 1).unsqueeze(0))
+    def apply_chat_template(self, messages, tokenize=False, add_generation_prompt=True):
+        return "".join(message['content'] for message in messages)
+class LegacyCacheModel:
+    def __call__(self, input_ids, use_cache=True):
+        shape = (1, 2, input_ids.shape[1], 4)
+        return types.SimpleNamespace(past_key_values=((torch.zeros(shape), torch.zeros(shape)),))
+def client_with_fakes():
+    client = LLMClient(model_name="Qwen/Qwen2.5-0.5B-Instruct")
+    client._device = "cpu"
+    client.tokenizer = FakeTokenizer()
+    client.model = LegacyCacheModel()
+    client.register_prefix("Answer from the context below:")
+    return client
+def test_legacy_tuple_cache_is_converted_and_cropped():
+    client = client_with_fakes()
+    prompt = "Answer from the context below: what is it"
+    past = client._prefix_past(prompt, None, torch.arange(1, 9))
+    assert past is not None and past.get_seq_length() == 5
+    assert client.prefix_cache_disabled is None
+def test_prefix_cache_turns_off_without_croppable_caches(monkeypatch, capsys):
+    class OldDynamicCache:
+        pass
+    monkeypatch.setattr(transformers, 'DynamicCache', OldDynamicCache)
+    client = client_with_fakes()
+    assert client._prefix_past("Answer from the context below: what is it", None, torch.arange(1, 9)) is None
+    assert "DynamicCache" in client.prefix_cache_disabled
+    assert client.prefix_cache_stats()['disabled_reason'] == client.prefix_cache_disabled
+    assert "Prefix cache disabled" in capsys.readouterr().out
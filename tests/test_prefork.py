@@ -0,0 +1,21 @@
+import os
+import signal
+import pytest
+from omnirag import prefork
+from omnirag.llm_client import LLMClient
+@pytest.mark.parametrize("cpu_mode", [None, "int8", "bf16"])
+def test_preload_uses_the_workers_registry_key(monkeypatch, cpu_mode):
+    monkeypatch.setattr(LLMClient, 'load', lambda self: None)
+    monkeypatch.setattr(prefork, '_preloaded', [])
+    prefork.preload_models("Qwen/Qwen2.5-0.5B-Instruct", embedding_model=None, cpu_mode=cpu_mode)
+    preloaded = prefork._preloaded[0]
+    worker = LLMClient(model_name="Qwen/Qwen2.5-0.5B-Instruct", cpu_mode=cpu_mode)
+    assert preloaded.cpu_mode == cpu_mode
+    assert preloaded._weights_key(preloaded.model_name, False) == worker._weights_key(worker.model_name, False)
+def test_run_reports_exit_codes_and_signals():
+    def worker(index):
+        if index == 1:
+            raise RuntimeError("worker failed")
+        if index == 2:
+            os.kill(os.getpid(), signal.SIGKILL)
+    assert prefork.run(worker, workers=3) == {0: 0, 1: 1, 2: -signal.SIGKILL}
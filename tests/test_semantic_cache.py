@@ -0,0 +1,33 @@
+def test_paraphrase_hit_needs_matching_answer_mode_and_profile(rag):
+    rag.add_documents([f"Document {i} is about vectors and search." for i in range(20)], background=False)
+    query = "Explain how vector search works"
+    rag.cache.clear()
+    first = rag.query(query, force_complexity="beginner")
+    assert not first['metadata'].get('semantic_cache_hit')
+    rag.cache.clear()
+    fused = rag.query(query, force_complexity="beginner", answer_mode="fused")
+    assert not fused['metadata'].get('semantic_cache_hit')
+    assert fused['metadata']['answer_mode'] == "fused"
+    rag.cache.clear()
+    fast = rag.query(query, force_complexity="beginner", profile="fast")
+    assert not fast['metadata'].get('semantic_cache_hit')
+    rag.cache.clear()
+    again = rag.query(query, force_complexity="beginner", answer_mode="fused")
+    assert again['metadata']['semantic_cache_hit']
+    assert again['answer'] == fused['answer']
+def test_cache_hits_report_cached_budget(rag):
+    rag.add_documents([f"Document {i} is about vectors and search." for i in range(20)], background=False)
+    first = rag.query("What is a vector index?", force_complexity="beginner")
+    assert first['metadata']['budget']['profile'] == rag.profile
+    exact = rag.query("What is a vector index?", force_complexity="beginner")
+    assert exact['metadata']['budget'] == {'cached': True}
+    rag.cache.clear()
+    similar = rag.query("What is a vector index?", force_complexity="beginner")
+    assert similar['metadata']['semantic_cache_hit']
+    assert similar['metadata']['budget'] == {'cached': True}
+def test_paraphrase_hit_is_shared_across_deadlines(rag):
+    rag.add_documents([f"Document {i} is about vectors and search." for i in range(20)], background=False)
+    rag.query("Explain how vector search works", force_complexity="beginner", deadline_ms=60000)
+    rag.cache.clear()
+    again = rag.query("Explain how vector search works", force_complexity="beginner", deadline_ms=45000)
+    assert again['metadata']['semantic_cache_hit']
@@ -0,0 +1,31 @@
+import time
+from omnirag.cache import SimpleCache, estimate_size
+def test_least_recently_used_entry_is_evicted():
+    cache = SimpleCache(max_entries=2)
+    cache.set("a", {'answer': "A"})
+    cache.set("b", {'answer': "B"})
+    assert cache.get("a") == {'answer': "A"}
+    cache.set("c", {'answer': "C"})
+    assert cache.get("b") is None
+    assert cache.get("a") and cache.get("c")
+    assert cache.stats()['evictions'] == 1
+def test_byte_limit_evicts_and_skips_oversized_results():
+    result = {'answer': "x" * 1000}
+    size = estimate_size(result)
+    cache = SimpleCache(max_bytes=2 * size + size // 2)
+    for key in ("a", "b", "c"):
+        cache.set(key, {'answer': key * 1000})
+    assert cache.size() == 2
+    assert cache.get("a") is None
+    assert cache.stats()['bytes'] <= cache.max_bytes
+    cache.set("huge", {'answer': "y" * 10000})
+    assert cache.get("huge") is None
+    assert cache.size() == 2
+def test_expired_entries_are_purged_on_any_access():
+    cache = SimpleCache(ttl_minutes=0.05 / 60)
+    cache.set("a", {'answer': "A"})
+    assert cache.get("a") == {'answer': "A"}
+    time.sleep(0.1)
+    assert cache.size() == 0
+    stats = cache.stats()
+    assert stats['expirations'] == 1 and stats['bytes'] == 0
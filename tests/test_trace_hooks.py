@@ -0,0 +1,30 @@
+import contextlib
+import io
+from benchmarks.stubs import StubEmbedder, StubLLM
+from omnirag import OmniRAG, tracing
+def make_rag():
+    with contextlib.redirect_stdout(io.StringIO()):
+        rag = OmniRAG(llm=StubLLM(), embedder=StubEmbedder(dim=64), embedding_model="stub-embedder")
+    rag.add_documents([f"Document {i} is about caching." for i in range(10)], background=False)
+    return rag
+def test_trace_hooks_only_see_their_own_instance():
+    first, second = make_rag(), make_rag()
+    seen = {'first': [], 'second': [], 'process': []}
+    first.add_trace_hook(lambda event: seen['first'].append(event))
+    second.add_trace_hook(lambda event: seen['second'].append(event))
+    process_hook = lambda event: seen['process'].append(event)
+    tracing.registry.add_hook(process_hook)
+    try:
+        first.query("How does caching work?", force_complexity="beginner")
+        second.query("Why is caching useful?", force_complexity="beginner")
+    finally:
+        tracing.registry.remove_hook(process_hook)
+        first.close()
+        second.close()
+    queries = {name: [e['query'] for e in events if e['type'] == 'query'] for name, events in seen.items()}
+    assert queries == {
+        'first': ["How does caching work?"],
+        'second': ["Why is caching useful?"],
+        'process': ["How does caching work?", "Why is caching useful?"]
+    }
+    assert any(event['type'] == 'span' for event in seen['first'])
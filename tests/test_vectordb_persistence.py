@@ -0,0 +1,43 @@
+import contextlib
+import io
+import pytest
+from omnirag.vectordb_tool import VectorDBTool
+from benchmarks.stubs import StubEmbedder
+class NegatedEmbedder(StubEmbedder):
+    def encode(self, sentences, **kwargs):
+        return -super().encode(sentences, **kwargs)
+def make_db(embedder=None, embedding_model="stub-embedder", **kwargs):
+    with contextlib.redirect_stdout(io.StringIO()):
+        return VectorDBTool(embedding_model=embedding_model, embedder=embedder or StubEmbedder(dim=32), **kwargs)
+def quiet(call, *args, **kwargs):
+    with contextlib.redirect_stdout(io.StringIO()):
+        return call(*args, **kwargs)
+DOCUMENTS = [f"Chunk {i} is about subject {i % 7} and detail {i}." for i in range(50)]
+@pytest.mark.parametrize("mmap", [True, False])
+def test_saved_store_loads_with_the_same_results(tmp_path, mmap):
+    db = make_db()
+    quiet(db.add_documents, DOCUMENTS)
+    db.set_variants("beginner", {3: "simple chunk 3"})
+    quiet(db.save, str(tmp_path))
+    loaded = make_db()
+    quiet(loaded.load, str(tmp_path), mmap=mmap)
+    assert loaded.count() == len(DOCUMENTS)
+    assert loaded.documents[17] == DOCUMENTS[17]
+    assert loaded.get_variant(3, "beginner") == "simple chunk 3"
+    for mode in ("dense", "lexical", "hybrid"):
+        assert loaded.search_hits("subject 3 detail 10", top_k=5, mode=mode) == \
+            db.search_hits("subject 3 detail 10", top_k=5, mode=mode)
+    # A memory-mapped store still takes new documents.
+    quiet(loaded.add_documents, ["A chunk added after loading."])
+    assert loaded.count() == len(DOCUMENTS) + 1
+    assert loaded.search_hits("added after loading", top_k=1, mode="lexical")[0]['id'] == len(DOCUMENTS)
+def test_load_refuses_another_embedding_model(tmp_path):
+    db = make_db()
+    quiet(db.add_documents, DOCUMENTS)
+    quiet(db.save, str(tmp_path))
+    with pytest.raises(ValueError, match="embedding model"):
+        make_db(embedding_model="other-model").load(str(tmp_path))
+    with pytest.raises(ValueError, match="dim="):
+        make_db(embedder=StubEmbedder(dim=16)).load(str(tmp_path))
+    with pytest.raises(ValueError, match="different vectors"):
+        make_db(embedder=NegatedEmbedder(dim=32)).load(str(tmp_path))